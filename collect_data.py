@@ -1,117 +1,105 @@
 import csv
+import hashlib
 import time
 import numpy as np
-from reskin_sensor import ReSkinProcess
+from reskin_sensor.sources import add_source_arguments, source_from_args
+from reskin_sensor.dataset import DatasetWriter
+from reskin_sensor.features import feature_names, frame_features, split_readings
+from reskin_sensor.filters import MovingAverage
+from reskin_sensor.segments import label_samples
+from init_value import initialize_sensor
 import argparse
 
-def initialize_sensor(sensor_stream, duration=20, sampling_rate=500):
+def label_recording(samples, seq, marks, init_values, num_mags=5, settle=0, smoother=None):
     """
-    Initialize the sensor by collecting data for a specified duration and calculating the average values.
+    Turn a labelled recording into training rows.
     
     Args:
-    - sensor_stream: The sensor stream object to collect data from.
-    - duration: The duration (in seconds) to collect data for initialization.
-    - sampling_rate: The rate (in Hz) at which to sample data.
+    - samples: The recorded samples, as returned by ReSkinProcess.get_buffer.
+    - seq: The sequence numbers of the recorded samples.
+    - marks: The label changes recorded with ReSkinProcess.mark.
+    - init_values: The initial values to subtract from the collected data, one per streamed channel.
+    - num_mags: Number of magnetometers on the sensor board.
+    - settle: Number of samples dropped after every label change.
+    - smoother: Optional stream filter (see reskin_sensor.filters) applied to the raw samples.
     
     Returns:
-    - init_values: A list of initial average values for t0, Bx0, By0, Bz0, ..., t4, Bx4, By4, Bz4.
+    - collected_data: A list of adjusted data points, each followed by its label.
     """
-    collected_data = {i: [] for i in range(20)}  # Dictionary to hold data for all sensors
+    labels = label_samples(seq, marks, settle=settle)
+    if not np.any(labels >= 0):
+        return []
 
-    total_samples = duration * sampling_rate
+    values = np.array([sample.data for sample in samples], dtype=float)
+    if smoother is not None:
+        values = smoother.process(values)
+    _, mags = split_readings(values - np.asarray(init_values), num_mags)
+    sensor_values = frame_features(mags)
 
-    for _ in range(total_samples):
-        if sensor_stream.is_alive():
-            sample = sensor_stream.get_data(num_samples=1)[0]
-            values = sample.data
-            if len(values) == 20:
-                for i in range(20):
-                    collected_data[i].append(values[i])
-        time.sleep(1 / sampling_rate)
-
-    window_size = 5
-    filtered_data = {i: np.convolve(collected_data[i], np.ones(window_size) / window_size, mode='valid') for i in collected_data}
-
-    init_values = [np.mean(filtered_data[i]) for i in range(20)]
-
-    return init_values
-
-def collect_data(sensor_stream, init_values, label, duration=10, sampling_rate=500):
-    """
-    Collect sensor data and subtract the initial values.
-    
-    Args:
-    - sensor_stream: The sensor stream object to collect data from.
-    - init_values: The initial values to subtract from the collected data.
-    - label: The label to assign to the collected data.
-    - duration: Duration of data collection in seconds.
-    - sampling_rate: Sampling rate in Hz.
-    
-    Returns:
-    - collected_data: A list of collected and adjusted data points with the label.
-    """
-    total_samples = duration * sampling_rate
-    collected_data = []
-
-    for _ in range(total_samples):
-        if sensor_stream.is_alive():
-            sample = sensor_stream.get_data(num_samples=1)[0]
-            values = sample.data
-            if len(values) == 20:
-                adjusted_values = [values[i] - init_values[i] for i in range(20)]
-                sensor_values = adjusted_values[1::4] + adjusted_values[2::4] + adjusted_values[3::4]
-                sensor_values.append(label)
-                collected_data.append(sensor_values)
-        time.sleep(1 / sampling_rate)
-
-    return collected_data
+    keep = labels >= 0
+    return [row + [label] for row, label in zip(sensor_values[keep].tolist(), labels[keep].tolist())]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Collect sensor data and save to a CSV file.")
-    parser.add_argument("-p", "--port", type=str, help="Port to which the microcontroller is connected", required=True)
-    parser.add_argument("-b", "--baudrate", type=int, help="Baudrate at which the microcontroller is streaming data", default=115200)
-    parser.add_argument("-n", "--num_mags", type=int, help="Number of magnetometers on the sensor board", default=5)
-    parser.add_argument("-tf", "--temp_filtered", action="store_true", help="Flag to filter temperature from sensor output")
-    parser.add_argument("-o", "--output_file", type=str, help="Output CSV file path", required=True)
+    add_source_arguments(parser)
+    parser.add_argument("-s", "--smooth", type=int, help="Moving average window applied to the samples (1 disables smoothing)", default=1)
+    parser.add_argument("--settle", type=float, help="Seconds of data dropped after every label change", default=1.0)
+    parser.add_argument("-o", "--output_file", type=str, help="Output CSV file path")
+    parser.add_argument("-d", "--dataset", type=str, help="Dataset directory to append the session to (see reskin_sensor.dataset)")
+    parser.add_argument("--session", type=str, help="Session name stored in the dataset; defaults to the start time", default=None)
     args = parser.parse_args()
+    if args.output_file is None and args.dataset is None:
+        parser.error("at least one of --output_file and --dataset is required")
 
-    sensor_stream = ReSkinProcess(
-        num_mags=args.num_mags,
-        port=args.port,
-        baudrate=args.baudrate,
-        burst_mode=True,
-        device_id=1,
-        temp_filtered=args.temp_filtered,
-    )
+    sensor_stream = source_from_args(args)
     sensor_stream.start()
     time.sleep(0.1)
 
-    init_values = initialize_sensor(sensor_stream)
+    init_values = initialize_sensor(sensor_stream, sampling_rate=500)
     print("Initial values:", init_values)
 
-    all_data = []
+    # Record one continuous stream and label it as we go
+    sensor_stream.start_buffering()
+    print("Recording started.")
 
     while True:
-        label = int(input("Enter the label for the sample (0: No press, 1: Top, 2: Left, 3: Right, 4: End collection): "))
+        label = int(input("Enter the label for the following samples (0: No press, 1: Top, 2: Left, 3: Right, 4: End collection): "))
         if label == 4:
+            sensor_stream.mark(-1)
             break
         elif label in [0, 1, 2, 3]:
-            print("Waiting for 1 seconds...")
-            time.sleep(1)
-            print("Starting data collection...")
-            data = collect_data(sensor_stream, init_values, label)
-            all_data.extend(data)
-            print(f"Data collection for label {label} completed.")
+            sensor_stream.mark(label)
+            print(f"Recording label {label}; enter the next label when done.")
         else:
             print("Invalid input, please enter again.")
 
-    print("Data collection ended, saving to CSV file...")
-    with open(args.output_file, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        header = ['Bx0', 'By0', 'Bz0', 'Bx1', 'By1', 'Bz1', 'Bx2', 'By2', 'Bz2', 'Bx3', 'By3', 'Bz3', 'Bx4', 'By4', 'Bz4', 'label']
-        writer.writerow(header)
-        writer.writerows(all_data)
-    print(f"Data has been saved to {args.output_file}")
+    buffer, seq = sensor_stream.get_buffer(pause_if_buffering=True, return_seq=True)
+    times = np.array([sample.time for sample in buffer])
+    rate = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 else 0
+    print(f"Recorded {len(buffer)} samples at {rate:.1f} Hz")
+
+    smoother = MovingAverage(args.smooth) if args.smooth > 1 else None
+    all_data = label_recording(
+        buffer, seq, sensor_stream.marks, init_values, num_mags=sensor_stream.num_mags,
+        settle=int(round(args.settle * rate)), smoother=smoother,
+    )
 
-    sensor_stream.stop()
+    if args.output_file is not None:
+        print("Data collection ended, saving to CSV file...")
+        with open(args.output_file, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            header = feature_names(sensor_stream.num_mags) + ['label']
+            writer.writerow(header)
+            writer.writerows(all_data)
+        print(f"Data has been saved to {args.output_file}")
+
+    if args.dataset is not None and all_data:
+        rows = np.array(all_data)
+        session = args.session or time.strftime("%Y%m%d-%H%M%S", time.localtime(times[0]))
+        calibration_id = hashlib.sha1(np.asarray(init_values, dtype=np.float64).tobytes()).hexdigest()[:12]
+        with DatasetWriter(args.dataset, feature_names(sensor_stream.num_mags)) as dataset:
+            dataset.add(rows[:, :-1], rows[:, -1], session=session, device=sensor_stream.device_id, calibration_id=calibration_id)
+        print(f"Session {session} has been added to {args.dataset}")
+
+    sensor_stream.join()
 
@@ -32,7 +32,16 @@ model.fit(X_new_scaled, y_new_one_hot, epochs=10, batch_size=8, verbose=1)
 # 保存更新后的模型
 model.save('updated_model_5.keras')
 
-# 如果需要保存标准化器，也可以使用 joblib 进行保存
-from joblib import dump
-dump(scaler, 'scaler.joblib')
+# Save the model together with its scaler as one bundle instead of overwriting
+# the shared scaler.joblib, which other models were trained with
+from reskin_sensor.bundle import ModelBundle, make_feature_spec
+from reskin_sensor.infer import DenseNetwork
+
+network = DenseNetwork.from_keras(model).fold_scaler(scaler.mean_, scaler.scale_)
+bundle = ModelBundle(
+    network,
+    feature_spec=make_feature_spec(X_new.shape[1] // 3),
+    metadata={"source_model": 'updated_model_5.keras', "finetuned_on": 'train_data9.csv'},
+)
+bundle.save('updated_model_5.reskin')
 
@@ -1,6 +1,6 @@
-import numpy as np
 import time
-from reskin_sensor import ReSkinProcess
+from reskin_sensor.sources import add_source_arguments, source_from_args
+from reskin_sensor.calibration import collect_calibration
 import argparse
 
 def initialize_sensor(sensor_stream, duration=20, sampling_rate=100):
@@ -13,53 +13,22 @@ def initialize_sensor(sensor_stream, duration=20, sampling_rate=100):
     - sampling_rate: The rate (in Hz) at which to sample data.
     
     Returns:
-    - init_values: A list of initial average values for t1, Bx1, By1, and Bz1.
+    - init_values: A list of initial average values, one per channel in the order they are streamed
+      (t0, Bx0, By0, Bz0, t1, ... or Bx0, By0, Bz0, Bx1, ... if temperature is filtered).
     """
-    collected_data = {i: [] for i in range(0,20)}  # Dictionary to hold data for t1, Bx1, By1, and Bz1
+    calibration = collect_calibration(sensor_stream, duration=duration, sampling_rate=sampling_rate)
 
-    # Calculate the total number of samples to collect
-    total_samples = duration * sampling_rate
-
-    # Collect data
-    for _ in range(total_samples):
-        if sensor_stream.is_alive():
-            sample = sensor_stream.get_data(num_samples=1)[0]
-            values = sample.data
-            if len(values) == 20:
-                for i in range(0, 20):
-                    collected_data[i].append(values[i])
-        time.sleep(1 / sampling_rate)
-
-    # Apply filtering (sliding window average)
-    window_size = 5
-    filtered_data = {i: np.convolve(collected_data[i], np.ones(window_size) / window_size, mode='valid') for i in collected_data}
-
-    # Calculate the average of the filtered data
-    init_values = [np.mean(filtered_data[i]) for i in range(0, 20)]
-
-    return init_values
+    return list(calibration.mean)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Test code to run a ReSkin streaming process in the background. Allows data to be collected without code blocking"
     )
-    # fmt: off
-    parser.add_argument("-p", "--port", type=str, help="port to which the microcontroller is connected", required=True,)
-    parser.add_argument("-b", "--baudrate", type=str, help="baudrate at which the microcontroller is streaming data", default=115200,)
-    parser.add_argument("-n", "--num_mags", type=int, help="number of magnetometers on the sensor board", default=5,)
-    parser.add_argument("-tf", "--temp_filtered", action="store_true", help="flag to filter temperature from sensor output",)
-    # fmt: on
+    add_source_arguments(parser)
     args = parser.parse_args()
 
     # Create sensor stream
-    sensor_stream = ReSkinProcess(
-    num_mags=args.num_mags,
-    port=args.port,
-    baudrate=args.baudrate,
-    burst_mode=True,
-    device_id=1,
-    temp_filtered=args.temp_filtered,
-    )
+    sensor_stream = source_from_args(args)
     # Start sensor stream
     sensor_stream.start()
     time.sleep(0.1)
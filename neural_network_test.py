@@ -1,18 +1,17 @@
-import pandas as pd
 import numpy as np
 from tensorflow.keras.models import load_model
-from sklearn.preprocessing import StandardScaler
 from joblib import load
 from sklearn.metrics import accuracy_score
+from reskin_sensor.loader import load_training_data
 
-# 加载测试数据
-test_data = pd.read_csv('test_data.csv')
+# 加载测试数据（解析结果缓存在 .reskin_cache）
+test_data = load_training_data('test_data.csv')
 
 # 前15列为输入数据
-X_test = test_data.iloc[:, :-1].values
+X_test = test_data.X
 
 # 第16列为标签
-y_test = test_data.iloc[:, -1].values
+y_test = test_data.y
 
 # 加载标准化器
 scaler = load('scaler.joblib')
@@ -1,50 +1,30 @@
-import pandas as pd
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense
 from tensorflow.keras.utils import to_categorical
-from sklearn.preprocessing import StandardScaler
 from joblib import dump
+from reskin_sensor.loader import cached_scaler, load_training_data
 
-# 读取训练数据
-train_data1 = pd.read_csv('train_data.csv')
-train_data2 = pd.read_csv('train_data1.csv')
-train_data3 = pd.read_csv('train_data2.csv')
-train_data4 = pd.read_csv('train_data3.csv')
-train_data5 = pd.read_csv('train_data4.csv')
-train_data6 = pd.read_csv('train_data5.csv')
-train_data7 = pd.read_csv('train_data6.csv')
-train_data8 = pd.read_csv('train_data7.csv')
-train_data9 = pd.read_csv('train_data8.csv')
-train_data10 = pd.read_csv('train_data9.csv')
-train_data11 = pd.read_csv('train_data10.csv')
-train_data12 = pd.read_csv('dataset2/train_data1.csv')
-train_data13 = pd.read_csv('dataset2/train_data2.csv')
-train_data14 = pd.read_csv('dataset2/train_data3.csv')
-
-# 合并数据集
-train_data = pd.concat([train_data1, train_data2, train_data3, train_data4, train_data5, train_data6, train_data7, train_data8, train_data9,train_data10,train_data11,train_data12,train_data13,train_data14], axis=0)
-
-# 过滤标签为1, 2, 3的数据
-train_data = train_data[train_data.iloc[:, -1].isin([1, 2, 3])]
+# 读取训练数据，只保留标签为1, 2, 3的数据（解析结果缓存在 .reskin_cache）
+train_data = load_training_data(['train_data*.csv', 'dataset2/train_data*.csv'], labels=[1, 2, 3])
 
 # 前15列为输入数据
-X_train = train_data.iloc[:, :-1].values
+X_train = train_data.X
 
 # 第16列为标签
-y_train = train_data.iloc[:, -1].values
+y_train = train_data.y
 
-# 标准化数据
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
+# 标准化数据（复用缓存的标准化器）
+scaler = cached_scaler(train_data)
+X_train_scaled = scaler.transform(X_train)
 
 # 将标签转换为one-hot编码
 y_train_one_hot = to_categorical(y_train)
 
 # 构建神经网络模型
 model = Sequential()
-model.add(Dense(64, input_dim=15, activation='tanh'))  # 第一层
+model.add(Dense(64, input_dim=X_train.shape[1], activation='tanh'))  # 第一层
 model.add(Dense(32, activation='tanh'))                # 第二层
 model.add(Dense(4, activation='softmax'))              # 输出层
 
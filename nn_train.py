@@ -1,27 +1,42 @@
-import pandas as pd
+import argparse
 import numpy as np
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Dropout
 from tensorflow.keras.regularizers import l2
 from tensorflow.keras.utils import to_categorical
-from sklearn.preprocessing import StandardScaler
 from joblib import dump
+from reskin_sensor.loader import cached_scaler, load_training_data
+from reskin_sensor.windows import labelled_window_features
 
-# 读取训练数据
-train_data = pd.read_csv('train_data.csv')
-test_data = pd.read_csv('test_data.csv')
+parser = argparse.ArgumentParser(description="Train the press classifier")
+parser.add_argument("-w", "--window", type=int, help="Classify statistics over this many frames instead of single frames (0: single frames)", default=0)
+parser.add_argument("-n", "--num_mags", type=int, help="Number of magnetometers on the sensor board", default=5)
+args = parser.parse_args()
+
+# 读取训练数据（解析结果缓存在 .reskin_cache）
+train_data = load_training_data('train_data.csv')
+test_data = load_training_data('test_data.csv')
 
 # 前15列为输入数据
-X_train = train_data.iloc[:, :-1].values
-X_test = test_data.iloc[:, :-1].values
+X_train = train_data.X
+X_test = test_data.X
 
 # 第16列为标签
-y_train = train_data.iloc[:, -1].values
-y_test = test_data.iloc[:, -1].values
+y_train = train_data.y
+y_test = test_data.y
+
+# 窗口特征：与实时预测使用同一份代码 (reskin_sensor.windows)
+if args.window > 0:
+    X_train, y_train = labelled_window_features(X_train, y_train, args.num_mags, args.window)
+    X_test, y_test = labelled_window_features(X_test, y_test, args.num_mags, args.window)
 
-# 标准化数据
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
+# 标准化数据（复用缓存的标准化器）
+if args.window > 0:
+    from sklearn.preprocessing import StandardScaler
+    scaler = StandardScaler().fit(X_train)
+else:
+    scaler = cached_scaler(train_data)
+X_train_scaled = scaler.transform(X_train)
 X_test_scaled = scaler.transform(X_test)
 
 # 将标签转换为one-hot编码
@@ -30,7 +45,7 @@ y_test_one_hot = to_categorical(y_test)
 
 # 构建神经网络模型
 model = Sequential()
-model.add(Dense(64, input_dim=15, activation='relu', kernel_regularizer=l2(0.001)))  # 使用L2正则化
+model.add(Dense(64, input_dim=X_train.shape[1], activation='relu', kernel_regularizer=l2(0.001)))  # 使用L2正则化
 model.add(Dropout(0.5))  # 使用Dropout
 model.add(Dense(4, activation='softmax'))
 
@@ -41,8 +56,18 @@ model.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accur
 history = model.fit(X_train_scaled, y_train_one_hot, epochs=1, batch_size=10, verbose=1, validation_data=(X_test_scaled, y_test_one_hot))
 
 # 保存模型和标准化器
-model.save('nn_model.keras')  # 使用推荐的Keras原生格式
-dump(scaler, 'scaler.joblib')
+if args.window > 0:
+    # Saved only as a bundle, so the single-frame nn_model.keras and
+    # scaler.joblib other scripts load are left alone; the bundle also holds
+    # the window spec the realtime predictor needs to compute the same features
+    from reskin_sensor.bundle import ModelBundle, make_feature_spec
+    from reskin_sensor.infer import DenseNetwork
+
+    network = DenseNetwork.from_keras(model).fold_scaler(scaler.mean_, scaler.scale_)
+    ModelBundle(network, make_feature_spec(args.num_mags, window=args.window)).save('nn_model.reskin')
+else:
+    model.save('nn_model.keras')  # 使用推荐的Keras原生格式
+    dump(scaler, 'scaler.joblib')
 
 # 评估模型
 loss, accuracy = model.evaluate(X_test_scaled, y_test_one_hot)
@@ -0,0 +1,45 @@
+import argparse
+import numpy as np
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.layers import Dense
+from joblib import dump
+from sklearn.preprocessing import StandardScaler
+from reskin_sensor.dataset import Dataset
+from reskin_sensor.batches import BatchGenerator, running_stats
+
+# Train the press classifier from a dataset directory (see reskin_sensor.dataset) without loading it into memory
+parser = argparse.ArgumentParser(description="Train the press classifier on a dataset larger than memory")
+parser.add_argument("-d", "--dataset", type=str, help="Dataset directory", required=True)
+parser.add_argument("-l", "--labels", type=int, nargs="+", help="Labels to train on", default=[1, 2, 3])
+parser.add_argument("--balanced", action="store_true", help="Sample every label with equal probability")
+parser.add_argument("--batch_size", type=int, default=256)
+parser.add_argument("--epochs", type=int, default=1)
+parser.add_argument("-o", "--output", type=str, help="Output model path", default='nn_model/nn_model_stream.keras')
+args = parser.parse_args()
+
+dataset = Dataset(args.dataset)
+rows = dataset.rows(labels=args.labels)
+
+# Scaling statistics are computed once, chunk by chunk
+mean, std = running_stats(dataset.data, rows)
+num_classes = int(max(args.labels)) + 1
+batches = BatchGenerator(
+    dataset.data, dataset.labels, batch_size=args.batch_size, mean=mean, std=std,
+    rows=rows, balanced=args.balanced, num_classes=num_classes,
+)
+
+# 构建神经网络模型
+model = Sequential()
+model.add(Dense(64, input_dim=dataset.data.shape[1], activation='tanh'))  # 第一层
+model.add(Dense(32, activation='tanh'))                                   # 第二层
+model.add(Dense(num_classes, activation='softmax'))                       # 输出层
+
+model.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
+model.fit(batches.repeat(), steps_per_epoch=len(batches), epochs=args.epochs, verbose=1)
+
+# Save a scaler with the streamed statistics so the realtime tools can use it as before
+scaler = StandardScaler()
+scaler.mean_, scaler.scale_, scaler.var_ = mean, std, np.square(std)
+scaler.n_features_in_, scaler.n_samples_seen_ = dataset.data.shape[1], len(rows)
+model.save(args.output)
+dump(scaler, 'scaler.joblib')
@@ -1,25 +1,20 @@
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, accuracy_score
+from reskin_sensor.loader import cached_scaler, load_training_data
+from reskin_sensor.bundle import ModelBundle, make_feature_spec
+from reskin_sensor.forest import FlatForest
 
-# Load training data
-train_data = pd.read_csv('train_data.csv')
+# Load training and testing data; parsed files are cached in .reskin_cache
+train_data = load_training_data('train_data.csv')
+test_data = load_training_data('test_data.csv')
 
-# Separate features and labels for training data
-X_train = train_data[['Bx0', 'By0', 'Bz0', 'Bx1', 'By1', 'Bz1', 'Bx2', 'By2', 'Bz2', 'Bx3', 'By3', 'Bz3', 'Bx4', 'By4', 'Bz4']]
-y_train = train_data['label']
+# Separate features and labels
+X_train, y_train = train_data.X, train_data.y
+X_test, y_test = test_data.X, test_data.y
 
-# Load testing data
-test_data = pd.read_csv('test_data.csv')
-
-# Separate features and labels for testing data
-X_test = test_data[['Bx0', 'By0', 'Bz0', 'Bx1', 'By1', 'Bz1', 'Bx2', 'By2', 'Bz2', 'Bx3', 'By3', 'Bz3', 'Bx4', 'By4', 'Bz4']]
-y_test = test_data['label']
-
-# Standardize the data
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
+# Standardize the data, reusing the scaler fit on the same training files
+scaler = cached_scaler(train_data)
+X_train_scaled = scaler.transform(X_train)
 X_test_scaled = scaler.transform(X_test)
 
 # Train Random Forest model
@@ -33,3 +28,14 @@ y_pred = clf.predict(X_test_scaled)
 print("Accuracy:", accuracy_score(y_test, y_pred))
 print("Classification Report:")
 print(classification_report(y_test, y_pred))
+
+# Export the forest with the scaler folded into its thresholds, so the realtime
+# predictor can run it with NumPy: python realtime_visualize_nn.py -m random_forest.reskin
+forest = FlatForest.from_sklearn(clf).fold_scaler(scaler.mean_, scaler.scale_)
+print("Flat forest agreement:", (forest.predict_label(X_test) == y_pred).mean())
+bundle = ModelBundle(
+    forest,
+    feature_spec=make_feature_spec(X_train.shape[1] // 3),
+    metadata={"source_model": "RandomForestClassifier", "train_data": "train_data.csv"},
+)
+bundle.save('random_forest.reskin')
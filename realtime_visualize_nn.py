@@ -1,132 +1,132 @@
 import argparse
+import collections
 import time
-import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from joblib import load
-from reskin_sensor import ReSkinProcess
-from init_value import initialize_sensor
-from tensorflow.keras.models import load_model
+from reskin_sensor.sources import add_source_arguments, source_from_args
+from reskin_sensor.bundle import DEFAULT_LABELS, ModelBundle
+from reskin_sensor.filters import MovingAverage
+from reskin_sensor.infer import load_predictor
+from reskin_sensor.live_plot import LivePlot
+from reskin_sensor.calibration import collect_calibration
+from reskin_sensor.contact import ContactDetector
+from reskin_sensor.reload import ModelWatcher
+from reskin_sensor.worker import InferenceWorker
+
+# A classifier with everything needed to run it; swapped as a whole on reload
+Classifier = collections.namedtuple("Classifier", "model, scaler, label_names, press_threshold, extractor")
+
+
+def load_classifier(path, num_mags):
+    """Load a model and its scaler and label names; raise if it does not fit the sensor"""
+    model = load_predictor(path)
+    if isinstance(model, ModelBundle):
+        # Refuse to run a model trained on a different board layout
+        model.check_features(num_mags)
+        return Classifier(model, None, model.labels, model.press_threshold, model.feature_extractor())
+    if model.scaler_folded:
+        scaler = None  # standardisation is part of the model's first layer
+    else:
+        from joblib import load
+        scaler = load('scaler.joblib')
+    return Classifier(model, scaler, dict(DEFAULT_LABELS), None, None)
+
 
 def main():
     parser = argparse.ArgumentParser(
         description="Real-time visualization and prediction of ReSkin sensor data"
     )
-    parser.add_argument("-p", "--port", type=str, help="Port to which the microcontroller is connected", required=True)
-    parser.add_argument("-b", "--baudrate", type=int, help="Baudrate at which the microcontroller is streaming data", default=115200)
-    parser.add_argument("-n", "--num_mags", type=int, help="Number of magnetometers on the sensor board", default=5)
-    parser.add_argument("-tf", "--temp_filtered", action="store_true", help="Flag to filter temperature from sensor output")
+    add_source_arguments(parser)
+    parser.add_argument("-m", "--model", type=str, help="Classifier: a .reskin bundle or .npz exported with reskin_sensor (no TensorFlow needed), a keras model, or a directory whose newest model is used", default='nn_prediction_model10.keras')
+    parser.add_argument("-k", "--k_on", type=float, help="Press threshold, in multiples of the calibrated noise floor (default: from the model bundle, or 10)", default=None)
+    parser.add_argument("-s", "--smooth", type=int, help="Moving average window applied to the samples (1 disables smoothing)", default=1)
+    parser.add_argument("-w", "--watch", action="store_true", help="Reload the model when its file (or the newest model in the directory) changes; SIGHUP always reloads")
     args = parser.parse_args()
 
-    # Load the trained neural network model and scaler
-    nn_model = load_model('nn_prediction_model10.keras')
-    scaler = load('scaler.joblib')
-
-    # Create sensor stream
-    sensor_stream = ReSkinProcess(
-        num_mags=args.num_mags,
-        port=args.port,
-        baudrate=args.baudrate,
-        burst_mode=True,
-        device_id=1,
-        temp_filtered=args.temp_filtered,
-    )
-
-    # Start sensor stream and initialize sensor
+    # Create sensor stream and start it; the board size is known once it runs
+    sensor_stream = source_from_args(args)
     sensor_stream.start()
     time.sleep(0.1)
-    init_values = initialize_sensor(sensor_stream)  # 获取初始值
-    print("Initial values:", init_values)
-
-    # labels of plot
-    labels = ["Bx0", "By0", "Bz0", "Bx1", "By1", "Bz1", "Bx2", "By2", "Bz2", "Bx3", "By3", "Bz3", "Bx4", "By4", "Bz4"]
-
-    # initialize plots
-    fig, axs = plt.subplots(6, 3, figsize=(15, 24), sharex=True)
-    fig.subplots_adjust(hspace=0.4)
-
-    lines = []
-    for i in range(5):
-        for j, axis in enumerate(["Bx", "By", "Bz"]):
-            idx = i * 3 + j
-            line, = axs[i, j].plot([], [], label=labels[idx])
-            lines.append(line)
-            axs[i, j].set_xlim(0, 100)
-            axs[i, j].set_ylim(-1000, 1000)
-            axs[i, j].set_title(labels[idx])
-            axs[i, j].legend(loc='upper right')
+    num_mags = sensor_stream.num_mags
+
+    # Load the trained model and scaler; new models are loaded in the background
+    # and swapped in between frames while the stream and calibration keep running
+    watcher = ModelWatcher(args.model, load=lambda path: load_classifier(path, num_mags))
+    watcher.install_signal_handler()
+    if args.watch:
+        watcher.start()
+
+    def press_threshold(classifier):
+        """-k if given, else the model's own threshold"""
+        if args.k_on is not None:
+            return args.k_on
+        return classifier.press_threshold or 10.0
+
+    # Initialize sensor
+    calibration = collect_calibration(sensor_stream, sampling_rate=100)  # 获取初始值
+    init_values = calibration.mean
+    print("Initial values:", list(init_values))
+    print("Noise floor:", list(calibration.std))
+
+    # Plot Bx, By and Bz of every chip, plus a row for the prediction; every
+    # frame draws all samples streamed since the last one
+    plot = LivePlot(sensor_stream, num_mags, baseline=init_values)
+    layout = [["{}{}".format(axis, i) for axis in ["Bx", "By", "Bz"]] for i in range(num_mags)]
+    fig, axs = plot.make_figure(layout + [[None, None, None]], ylim=(-1000, 1000))
 
     # Add a subplot for displaying predictions
-    prediction_text = axs[5, 1].text(0.5, 0.5, '', horizontalalignment='center', verticalalignment='center', fontsize=15)
-    axs[5, 1].axis('off')  # Hide the axis
-
-    # store data
-    data = [[] for _ in range(15)]
-
-    def init():
-        for line in lines:
-            line.set_data([], [])
-        prediction_text.set_text('')
-        return lines + [prediction_text]
-
-    def update(frame):
-        if sensor_stream.is_alive():
-            sample = sensor_stream.get_data(num_samples=1)[0]  # acquire a sample
-            values = sample.data
-            if len(values) == 20:
-                adjusted_values = [values[i] - init_values[i] for i in range(20)]
-                sensor_values = adjusted_values[1::4] + adjusted_values[2::4] + adjusted_values[3::4]
-                sensor_values = np.array(sensor_values).reshape(1, -1)
-
-                # 判断最大绝对值是否超过150
-                if np.max(np.abs(sensor_values)) < 150:
-                    prediction_text.set_text("Current press location: No press")
-                else:
-                    # Standardize the data
-                    sensor_values_scaled = scaler.transform(sensor_values)
-
-                    # Predict the label using the neural network model
-                    probabilities = nn_model.predict(sensor_values_scaled)
-                    label = np.argmax(probabilities, axis=1)[0]
-
-                    # Display the result
-                    label_names = {0: 'No press', 1: 'Top', 2: 'Left', 3: 'Right'}
-                    prediction_text.set_text(f"Current press location: {label_names[label]}")
-
-                for i in range(5):
-                    # Subtract initial values for Bx, By, Bz
-                    Bx = values[i * 4 + 1] - init_values[i * 4 + 1]
-                    By = values[i * 4 + 2] - init_values[i * 4 + 2]
-                    Bz = values[i * 4 + 3] - init_values[i * 4 + 3]
-
-                    # Append new data
-                    data[i * 3].append(Bx)  # Bx
-                    data[i * 3 + 1].append(By)  # By
-                    data[i * 3 + 2].append(Bz)  # Bz
-
-                    # Ensure data lists do not exceed 100 points
-                    if len(data[i * 3]) > 100:
-                        data[i * 3].pop(0)
-                    if len(data[i * 3 + 1]) > 100:
-                        data[i * 3 + 1].pop(0)
-                    if len(data[i * 3 + 2]) > 100:
-                        data[i * 3 + 2].pop(0)
-
-                    # Create x values based on the length of data[0]
-                    x = list(range(len(data[i * 3])))
-
-                    # Update the plot lines with the new data
-                    lines[i * 3].set_data(x, data[i * 3])  # renew Bx
-                    lines[i * 3 + 1].set_data(x, data[i * 3 + 1])  # renew By
-                    lines[i * 3 + 2].set_data(x, data[i * 3 + 2])  # renew Bz
-
-        return lines + [prediction_text]
+    prediction_text = axs[num_mags, 1].text(0.5, 0.5, '', horizontalalignment='center', verticalalignment='center', fontsize=15)
+    axs[num_mags, 1].axis('off')  # Hide the axis
+
+    k_on = press_threshold(watcher.current)
+    detector = ContactDetector.from_calibration(calibration, num_mags, k_on=k_on, k_off=k_on / 2)
+    smoother = MovingAverage(args.smooth) if args.smooth > 1 else None
+
+    # The classifier used by the current pass of the worker
+    in_use = [watcher.current]
+
+    def transform(features):
+        # Read the classifier once per pass so a reload cannot swap it mid-batch
+        classifier = in_use[0] = watcher.current
+        k_on = press_threshold(classifier)
+        if k_on != detector.k_on:
+            # A reloaded model brings its own threshold; the detector is only
+            # fed from this thread, so it never sees a half-updated pair
+            detector.k_on, detector.k_off = k_on, k_on / 2
+        if classifier.extractor is not None:
+            # Windowed models: the same extractor the training data went
+            # through, fed with every sample so its windows have no gaps
+            features = classifier.extractor.process(features)
+        return features
+
+    def classify(features):
+        classifier = in_use[0]
+        scaled = features if classifier.scaler is None else classifier.scaler.transform(features)
+        return classifier.model.predict(scaled)
+
+    # Samples during a press are classified in a background thread at the
+    # sensor rate; the plot only shows the newest result
+    worker = InferenceWorker(
+        sensor_stream, classify, init_values, num_mags, smoother=smoother, detector=detector, transform=transform
+    ).start()
+
+    def show_prediction(new_samples):
+        prediction = worker.latest
+        if prediction is None or not prediction.in_contact:
+            prediction_text.set_text("Current press location: No press")
+        else:
+            label_names = watcher.current.label_names
+            prediction_text.set_text(
+                f"Current press location: {label_names.get(prediction.label, prediction.label)}"
+            )
+        return [prediction_text]
 
     # visualize
-    ani = animation.FuncAnimation(fig, update, init_func=init, blit=True, interval=10, save_count=50, cache_frame_data=False)
+    ani = plot.animate(fig, interval=30, extra_update=show_prediction)
 
     plt.xlabel('Sample Number')
     plt.show()
+    worker.stop()
+    watcher.stop()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,472 @@
+"""
+asyncio interface to ReSkin streams.
+
+Samples are pushed into the event loop as the operating system reports
+them, without helper threads, so one loop can consume many skins:
+
+- open_serial reads the microcontroller directly, registering the serial
+  port's file descriptor with loop.add_reader and decoding every burst of
+  frames at once
+- connect subscribes to a reskin-serve stream server over its socket
+- from_stream follows a ReSkinProcess running in this program; a process
+  offers no descriptor or notification to wait on, so its shared sample
+  ring is checked every poll_interval by a task on the loop, which wakes
+  the loop at that rate even while the sensor is idle
+
+All three return an AsyncReSkin:
+
+    async with await open_serial("/dev/ttyACM0", num_mags=5) as skin:
+        baseline = await skin.calibrate(num_samples=1000)
+        async for block in skin:
+            forces = block[:, 2:] - baseline.mean
+"""
+import asyncio
+import json
+import socket
+import time
+
+import numpy as np
+
+from .calibration import calibrate
+from .ring import SampleRing
+from .sensor import ReSkinData
+from .server import HEADER, MSG_DATA, MSG_ERROR, MSG_HELLO, MSG_SUBSCRIBE, pack_message, parse_address, unpack_data
+
+
+def decode_burst_frames(buf, num_floats: int):
+    """
+    Decode every complete burst-mode frame at the start of a byte buffer
+
+    A frame is num_floats native float32 values followed by b"\\r\\n".
+    Frames are checked and decoded in one vectorised pass; after a frame
+    without its terminator the decoder skips to the next b"\\r\\n", like
+    ReSkinBase.get_sample.
+
+    Parameters
+    ----------
+    buf : bytes or bytearray
+        Received bytes
+    num_floats : int
+        Values per frame, 4 * num_mags
+
+    Returns
+    -------
+    values : np.ndarray
+        (n, num_floats) decoded frames
+    consumed : int
+        Number of bytes of buf used; the rest is the start of an
+        incomplete frame
+    """
+    length = 4 * num_floats + 2
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    blocks = []
+    pos = 0
+    while True:
+        n = (raw.shape[0] - pos) // length
+        if n == 0:
+            break
+        frames = raw[pos : pos + n * length].reshape(n, length)
+        bad = np.flatnonzero((frames[:, -2] != 13) | (frames[:, -1] != 10))
+        good = n if bad.shape[0] == 0 else int(bad[0])
+        blocks.append(frames[:good, :-2])
+        pos += good * length
+        if good == n:
+            break
+        end = bytes(raw[pos:]).find(b"\r\n")
+        if end < 0:
+            # Keep a trailing b"\r" that may start the next terminator
+            pos = raw.shape[0] - 1
+            break
+        pos += end + 2
+    if not blocks:
+        return np.empty((0, num_floats), dtype=np.float32), pos
+    values = np.ascontiguousarray(np.concatenate(blocks)).view(np.float32)
+    return values, pos
+
+
+def decode_ascii_frames(buf, num_floats: int):
+    """
+    Decode every complete line of a non-burst-mode stream; see
+    decode_burst_frames. Lines that do not hold num_floats numbers are
+    skipped.
+    """
+    end = bytes(buf).rfind(b"\n")
+    if end < 0:
+        return np.empty((0, num_floats), dtype=np.float32), 0
+    rows = []
+    for line in bytes(buf[:end]).split(b"\n"):
+        try:
+            row = [float(x) for x in line.split()]
+        except ValueError:
+            continue
+        if len(row) == num_floats:
+            rows.append(row)
+    return np.array(rows, dtype=np.float32).reshape(-1, num_floats), end + 1
+
+
+class FrameDecoder:
+    """
+    Turns the bytes received from a serial port into rows of
+    [time, acq_delay, data...].
+
+    Frames completed by one feed share its arrival time; acq_delay is the
+    time spent decoding them.
+
+    Parameters
+    ----------
+    num_mags : int
+        Number of magnetometers on the board
+    burst_mode : bool
+        Whether the board streams binary frames instead of text lines
+    temp_filtered : bool
+        Drop the temperature channels
+    """
+
+    def __init__(self, num_mags: int, burst_mode: bool = True, temp_filtered: bool = False):
+        self.num_floats = 4 * num_mags
+        self._decode = decode_burst_frames if burst_mode else decode_ascii_frames
+        self._columns = np.arange(self.num_floats)
+        if temp_filtered:
+            self._columns = self._columns[self._columns % 4 != 0]
+        self._pending = bytearray()
+
+    @property
+    def width(self):
+        return 2 + self._columns.shape[0]
+
+    def feed(self, data, arrived: float):
+        """Rows of every frame completed by data, received at time arrived"""
+        self._pending += data
+        values, consumed = self._decode(self._pending, self.num_floats)
+        del self._pending[:consumed]
+        rows = np.empty((values.shape[0], self.width))
+        if values.shape[0]:
+            rows[:, 0] = arrived
+            rows[:, 1] = time.time() - arrived
+            rows[:, 2:] = values[:, self._columns]
+        return rows
+
+
+class AsyncReSkin:
+    """
+    A sensor stream consumed from an asyncio event loop.
+
+    Received samples are kept in a ring of the ring_size most recent rows
+    of [time, acq_delay, data...]. Coroutines waiting for data are woken
+    when a block arrives; only streams created by from_stream poll.
+
+    Attributes
+    ----------
+    num_mags : int
+        Number of magnetometers on the board
+    temp_filtered : bool
+        Whether the stream has no temperature channels
+    device_id : int
+        Sensor ID attached to returned samples
+
+    Methods
+    -------
+    blocks(max_samples=None):
+        Iterate over blocks of samples as they arrive
+    next_sample(timeout=None):
+        Wait for the next sample
+    get_data(num_samples=5):
+        Wait for the next num_samples samples
+    calibrate(num_samples=1000, window_size=5):
+        Collect resting samples and compute the calibration
+    read_since(seq, max_samples=None):
+        Return every sample received since sequence number seq
+    close():
+        Stop receiving
+    """
+
+    def __init__(self, num_mags: int, temp_filtered: bool = False, device_id: int = -1, ring_size: int = 4096):
+        self.num_mags = num_mags
+        self.temp_filtered = temp_filtered
+        self.device_id = device_id
+        self._ring = SampleRing(ring_size, 2 + num_mags * (4 - temp_filtered))
+        self._waiters = []
+        self._closed = False
+        self._error = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __aiter__(self):
+        return self.blocks()
+
+    @property
+    def sample_cnt(self):
+        return self._ring.count
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def read_since(self, seq: int, max_samples: int = None):
+        """Return every sample received since sequence number seq; see ReSkinProcess.read_since"""
+        return self._ring.read_since(seq, max_samples)
+
+    def _publish(self, rows):
+        if rows.shape[0] == 0:
+            return
+        self._ring.extend(rows)
+        self._wake()
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters = []
+
+    def _fail(self, error):
+        self._error = error
+        self._closed = True
+        self._wake()
+
+    async def _wait_past(self, seq: int):
+        """Wait until a sample with sequence number seq has arrived; False once closed"""
+        while self._ring.count <= seq:
+            if self._closed:
+                if self._error is not None:
+                    raise self._error
+                return False
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        return True
+
+    async def blocks(self, max_samples: int = None):
+        """
+        Iterate over blocks of samples as they arrive
+
+        Every step yields all samples received since the previous one,
+        starting with the next sample to arrive, as an (n, 2 + num_channels)
+        array of [time, acq_delay, data...]. Samples are skipped only if
+        ring_size newer ones arrive while the consumer is busy.
+
+        Parameters
+        ----------
+        max_samples : int
+            Yield at most this many of the newest samples per step
+        """
+        seq = self._ring.count
+        while await self._wait_past(seq):
+            rows, seq = self._ring.read_since(seq, max_samples)
+            if rows.shape[0]:
+                yield rows
+
+    def _format(self, row):
+        return ReSkinData(time=row[0], acq_delay=row[1], data=row[2:].tolist(), dev_id=self.device_id)
+
+    async def next_sample(self, timeout: float = None):
+        """
+        Wait for the next sample
+
+        Raises asyncio.TimeoutError if none arrives within timeout seconds,
+        and EOFError if the stream is closed.
+        """
+        seq = self._ring.count
+        if not await asyncio.wait_for(self._wait_past(seq), timeout):
+            raise EOFError("Stream closed")
+        rows, _ = self._ring.read_since(seq, self._ring.count - seq)
+        return self._format(rows[0])
+
+    async def get_data(self, num_samples: int = 5):
+        """Wait for the next num_samples samples; fewer if the stream closes"""
+        seq = self._ring.count
+        while self._ring.count < seq + num_samples and await self._wait_past(self._ring.count):
+            pass
+        rows, _ = self._ring.read_since(seq)
+        return [self._format(row) for row in rows[:num_samples]]
+
+    async def calibrate(self, num_samples: int = 1000, window_size: int = 5):
+        """
+        Collect resting samples and compute the calibration
+
+        Uses fewer than num_samples samples if the stream closes first, and
+        raises EOFError if it closes before any arrive.
+
+        Returns
+        -------
+        Calibration
+            See calibration.calibrate
+        """
+        collected = []
+        total = 0
+        async for block in self.blocks():
+            collected.append(block[:, 2:])
+            total += block.shape[0]
+            if total >= num_samples:
+                break
+        if not collected:
+            raise EOFError("Stream closed")
+        return calibrate(np.concatenate(collected)[:num_samples], window_size=window_size)
+
+    async def close(self):
+        """Stop receiving"""
+        self._closed = True
+        self._wake()
+
+
+class _SerialReSkin(AsyncReSkin):
+    def __init__(self, port: str, baudrate: int, burst_mode: bool, **kwargs):
+        import serial
+
+        super().__init__(**kwargs)
+        self._decoder = FrameDecoder(self.num_mags, burst_mode, self.temp_filtered)
+        self._serial = serial.Serial(port=port, baudrate=baudrate, timeout=0)
+        # Start from fresh data, not whatever the port buffered
+        self._serial.reset_input_buffer()
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._serial.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        try:
+            data = self._serial.read(max(1, self._serial.in_waiting))
+        except OSError as e:
+            self._loop.remove_reader(self._serial.fileno())
+            self._fail(e)
+            return
+        rows = self._decoder.feed(data, time.time())
+        if rows.shape[0]:
+            self._publish(rows)
+
+    async def close(self):
+        if not self._serial.closed:
+            self._loop.remove_reader(self._serial.fileno())
+            self._serial.close()
+        await super().close()
+
+
+class _ClientReSkin(AsyncReSkin):
+    def __init__(self, reader, writer, **kwargs):
+        super().__init__(**kwargs)
+        self._reader = reader
+        self._writer = writer
+        self._task = asyncio.get_running_loop().create_task(self._receive())
+
+    async def _receive(self):
+        try:
+            while True:
+                kind, length = HEADER.unpack(await self._reader.readexactly(HEADER.size))
+                payload = await self._reader.readexactly(length)
+                if kind == MSG_ERROR:
+                    raise ConnectionError(payload.decode(errors="replace"))
+                if kind == MSG_DATA:
+                    self._publish(unpack_data(payload, self._ring.width - 2)[1])
+        except asyncio.IncompleteReadError:
+            await super().close()
+        except (OSError, ConnectionError) as e:
+            self._fail(e)
+
+    async def close(self):
+        self._task.cancel()
+        self._writer.close()
+        await super().close()
+
+
+class _ProcessReSkin(AsyncReSkin):
+    def __init__(self, stream, poll_interval: float, **kwargs):
+        super().__init__(**kwargs)
+        self._stream = stream
+        self._poll_interval = poll_interval
+        self._task = asyncio.get_running_loop().create_task(self._follow())
+
+    async def _follow(self):
+        seq = self._stream.sample_cnt
+        while self._stream.is_alive():
+            rows, seq = self._stream.read_since(seq)
+            self._publish(rows)
+            await asyncio.sleep(self._poll_interval)
+        await super().close()
+
+    async def close(self):
+        self._task.cancel()
+        await super().close()
+
+
+async def open_serial(
+    port: str,
+    num_mags: int = 1,
+    baudrate: int = 115200,
+    burst_mode: bool = True,
+    device_id: int = -1,
+    temp_filtered: bool = False,
+    ring_size: int = 4096,
+):
+    """
+    Read a sensor's serial port from the running event loop
+
+    Needs an event loop with add_reader support, i.e. not the Windows
+    proactor loop. Parameters as for ReSkinProcess.
+    """
+    return _SerialReSkin(
+        port,
+        baudrate,
+        burst_mode,
+        num_mags=num_mags,
+        temp_filtered=temp_filtered,
+        device_id=device_id,
+        ring_size=ring_size,
+    )
+
+
+async def connect(address: str, ring_size: int = 4096):
+    """
+    Subscribe to every channel of a reskin-serve stream server
+
+    Parameters
+    ----------
+    address : str
+        Server address, see server.parse_address
+    """
+    family, sock_address = parse_address(address)
+    if family == socket.AF_UNIX:
+        reader, writer = await asyncio.open_unix_connection(sock_address)
+    else:
+        reader, writer = await asyncio.open_connection(*sock_address)
+    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    payload = await reader.readexactly(length)
+    if kind != MSG_HELLO:
+        writer.close()
+        raise ConnectionError("Expected a greeting from {}".format(address))
+    hello = json.loads(payload.decode())
+    writer.write(pack_message(MSG_SUBSCRIBE, json.dumps({"channels": None, "decimation": 1}).encode()))
+    return _ClientReSkin(
+        reader,
+        writer,
+        num_mags=hello["num_mags"],
+        temp_filtered=hello["temp_filtered"],
+        device_id=hello["device_id"],
+        ring_size=ring_size,
+    )
+
+
+async def from_stream(stream, poll_interval: float = 0.002, ring_size: int = 4096):
+    """
+    Follow a started ReSkinProcess from the running event loop
+
+    ReSkinProcess does not signal new samples to other processes, so unlike
+    open_serial and connect this polls: a task on the loop wakes every
+    poll_interval, even while no samples arrive. To be woken only by data,
+    serve the sensor with reskin-serve and use connect instead.
+
+    Parameters
+    ----------
+    stream : ReSkinProcess
+        Started sensor stream
+    poll_interval : float
+        Seconds between checks of the stream's sample ring
+    """
+    return _ProcessReSkin(
+        stream,
+        poll_interval,
+        num_mags=stream.num_mags,
+        temp_filtered=stream.temp_filtered,
+        device_id=stream.device_id,
+        ring_size=ring_size,
+    )
@@ -0,0 +1,239 @@
+import queue
+import threading
+
+import numpy as np
+
+
+def running_stats(data, rows=None, chunk_rows: int = 1 << 16):
+    """
+    Mean and standard deviation of every column, computed chunk by chunk
+
+    Parameters
+    ----------
+    data : array_like
+        (N, num_columns) features, e.g. a Dataset memory map
+    rows : array_like
+        Indices of the rows to use; all rows if None
+    chunk_rows : int
+        Number of rows read at a time
+
+    Returns
+    -------
+    mean, std : np.ndarray
+        (num_columns,) statistics; columns with zero variance get a
+        standard deviation of 1, as StandardScaler does
+    """
+    n = data.shape[0] if rows is None else len(rows)
+    total = np.zeros(data.shape[1])
+    total_sq = np.zeros(data.shape[1])
+    shift = None
+    for start in range(0, n, chunk_rows):
+        if rows is None:
+            chunk = np.asarray(data[start : start + chunk_rows], dtype=np.float64)
+        else:
+            chunk = np.asarray(data[np.sort(rows[start : start + chunk_rows])], dtype=np.float64)
+        if shift is None:
+            # Shifting by a sample keeps the sum of squares well conditioned
+            shift = chunk[0].copy()
+        chunk -= shift
+        total += chunk.sum(axis=0)
+        total_sq += np.square(chunk).sum(axis=0)
+    if n == 0:
+        raise ValueError("Cannot compute statistics of zero rows")
+    mean = total / n
+    var = np.maximum(total_sq / n - np.square(mean), 0.0)
+    std = np.sqrt(var)
+    std[std == 0] = 1.0
+    return mean + shift, std
+
+
+def _prefetch(iterable, depth):
+    """Run an iterator in a background thread, keeping `depth` items ready"""
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def worker():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class BatchGenerator:
+    """
+    Streams scaled training batches from data that need not fit in memory.
+
+    Batches are gathered from the (memory-mapped) data with one fancy-index
+    read each, scaled with a precomputed mean and standard deviation, and
+    prepared in a background thread while the consumer trains on the
+    previous batch.
+
+    Attributes
+    ----------
+    batch_size : int
+        Number of rows per batch
+    mean, std : np.ndarray
+        Scaling applied to every batch
+
+    Methods
+    -------
+    __iter__():
+        Yield (X, y) batches for one epoch
+    repeat():
+        Yield batches forever, e.g. for keras Model.fit
+    """
+
+    def __init__(
+        self,
+        data,
+        labels,
+        batch_size: int = 256,
+        mean=None,
+        std=None,
+        rows=None,
+        balanced: bool = False,
+        shuffle: bool = True,
+        num_classes: int = None,
+        prefetch: int = 4,
+        seed: int = None,
+    ):
+        """
+        Parameters
+        ----------
+        data : array_like
+            (N, num_columns) features, e.g. Dataset.data
+        labels : array_like
+            (N,) labels, e.g. Dataset.labels
+        batch_size : int
+            Number of rows per batch
+        mean, std : array_like
+            Per-column scaling; computed with running_stats if not given
+        rows : array_like
+            Indices of the rows to draw from, e.g. Dataset.rows(labels=...);
+            all rows if None
+        balanced : bool
+            Draw every class with equal probability instead of visiting
+            every row once per epoch
+        shuffle : bool
+            Visit rows in random order; ignored if balanced
+        num_classes : int
+            If given, labels are returned one-hot encoded with this many
+            classes, as keras categorical losses expect
+        prefetch : int
+            Number of batches prepared in advance; 0 disables the
+            background thread
+        seed : int
+            Seed of the random number generator
+        """
+        self.data = data
+        self.labels = np.asarray(labels)
+        self.rows = np.arange(data.shape[0]) if rows is None else np.asarray(rows)
+        if len(self.rows) == 0:
+            raise ValueError("No rows to draw batches from")
+        self.batch_size = batch_size
+        if mean is None or std is None:
+            mean, std = running_stats(data, None if rows is None else self.rows)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.std = np.asarray(std, dtype=np.float32)
+        self.balanced = balanced
+        self.shuffle = shuffle
+        self.num_classes = num_classes
+        self.prefetch = prefetch
+        self._rng = np.random.default_rng(seed)
+
+        row_labels = self.labels[self.rows]
+        self.classes, counts = np.unique(row_labels, return_counts=True)
+        order = np.argsort(row_labels, kind="stable")
+        self._class_rows = self.rows[order]
+        self._class_counts = counts
+        self._class_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    def __len__(self):
+        """Number of batches per epoch"""
+        return -(-len(self.rows) // self.batch_size)
+
+    def _epoch_indices(self):
+        n = len(self.rows)
+        if self.balanced:
+            for _ in range(len(self)):
+                cls = self._rng.integers(len(self.classes), size=self.batch_size)
+                offset = (self._rng.random(self.batch_size) * self._class_counts[cls]).astype(np.int64)
+                yield self._class_rows[self._class_starts[cls] + offset]
+        else:
+            order = self._rng.permutation(self.rows) if self.shuffle else self.rows
+            for start in range(0, n, self.batch_size):
+                yield order[start : start + self.batch_size]
+
+    def _batches(self, epochs):
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            for idx in self._epoch_indices():
+                # Sorted indices turn the gather into mostly sequential reads
+                idx = np.sort(idx)
+                X = (np.asarray(self.data[idx], dtype=np.float32) - self.mean) / self.std
+                y = self.labels[idx]
+                if self.shuffle or self.balanced:
+                    perm = self._rng.permutation(len(idx))
+                    X, y = X[perm], y[perm]
+                if self.num_classes is not None:
+                    y = np.eye(self.num_classes, dtype=np.float32)[y]
+                yield X, y
+            epoch += 1
+
+    def _iterate(self, epochs):
+        batches = self._batches(epochs)
+        if self.prefetch > 0:
+            return _prefetch(batches, self.prefetch)
+        return batches
+
+    def __iter__(self):
+        return self._iterate(1)
+
+    def repeat(self):
+        """Yield batches forever; pass steps_per_epoch=len(generator) to keras"""
+        return self._iterate(None)
+
+
+def partial_fit(estimator, batches, classes, epochs: int = 1):
+    """
+    Train an sklearn estimator that supports partial_fit on a BatchGenerator
+
+    Parameters
+    ----------
+    estimator : object
+        Estimator with a partial_fit(X, y, classes) method, such as
+        SGDClassifier or MLPClassifier
+    batches : BatchGenerator
+        Batch source; must not one-hot encode the labels
+    classes : array_like
+        All labels that can occur
+    epochs : int
+        Number of passes over the data
+    """
+    for _ in range(epochs):
+        for X, y in batches:
+            estimator.partial_fit(X, y, classes=classes)
+    return estimator
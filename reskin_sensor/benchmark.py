@@ -0,0 +1,481 @@
+"""
+Microbenchmarks of the acquisition, buffering and inference hot paths.
+
+    python -m reskin_sensor.benchmark -o results.json
+    python -m reskin_sensor.benchmark -o new.json --compare results.json
+
+Benchmarks run without hardware: decoding is measured on synthetic byte
+streams, or on raw captures of a real sensor (--record saves one), fed to
+ReSkinBase through ByteStreamSensor; the ReSkinProcess benchmarks use the
+dummy sensor. Results are written as JSON together with the package,
+Python and NumPy versions, so runs can be compared across versions and
+changes.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from .sensor import ReSkinBase
+
+BENCHMARKS = ("decode", "get_buffer", "last_reading", "inference")
+
+
+def summarize(seconds):
+    """Count, mean, percentiles and maximum of durations, in microseconds"""
+    us = np.asarray(seconds, dtype=float) * 1e6
+    if us.shape[0] == 0:
+        return {"n": 0}
+    p50, p95, p99 = np.percentile(us, [50, 95, 99])
+    return {
+        "n": int(us.shape[0]),
+        "mean_us": float(us.mean()),
+        "p50_us": float(p50),
+        "p95_us": float(p95),
+        "p99_us": float(p99),
+        "max_us": float(us.max()),
+    }
+
+
+def _time_calls(fn, min_time: float, min_calls: int = 10):
+    """Durations of repeated calls to fn, for at least min_time seconds"""
+    durations = []
+    stop = time.perf_counter() + min_time
+    while time.perf_counter() < stop or len(durations) < min_calls:
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return np.array(durations)
+
+
+def synthetic_bytes(num_mags: int, num_frames: int, burst_mode: bool = True, seed: int = None):
+    """
+    Bytes a sensor would send for num_frames random readings
+
+    Burst mode frames are 4 * num_mags native float32 values followed by
+    b"\\r\\n", otherwise every frame is a line of space-separated numbers.
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(-500, 500, size=(num_frames, 4 * num_mags)).astype(np.float32)
+    if burst_mode:
+        frames = np.empty((num_frames, 16 * num_mags + 2), dtype=np.uint8)
+        frames[:, :-2] = values.view(np.uint8).reshape(num_frames, -1)
+        frames[:, -2:] = np.frombuffer(b"\r\n", dtype=np.uint8)
+        return frames.tobytes()
+    return b"".join(" ".join("{:.2f}".format(v) for v in row).encode() + b"\r\n" for row in values)
+
+
+def record_capture(port: str, path: str, duration: float = 10.0, baudrate: int = 115200):
+    """Save the raw bytes a sensor sends for duration seconds"""
+    import serial
+
+    with serial.Serial(port=port, baudrate=baudrate, timeout=0.1) as ser, open(path, "wb") as f:
+        ser.reset_input_buffer()
+        stop = time.time() + duration
+        while time.time() < stop:
+            f.write(ser.read(max(1, ser.in_waiting)))
+
+
+class ByteStreamSensor(ReSkinBase):
+    """
+    A ReSkinBase reading from bytes in memory instead of a serial port.
+
+    The port always appears to hold up to 4000 bytes, the most get_sample
+    accepts without discarding its input, so get_sample decodes at the
+    speed of the code rather than of the serial link.
+
+    Parameters
+    ----------
+    data : bytes
+        Bytes to serve, e.g. from synthetic_bytes or a capture
+    loop : bool
+        Start over at the end of data instead of running dry
+    """
+
+    def __init__(
+        self,
+        data: bytes,
+        num_mags: int = 1,
+        burst_mode: bool = True,
+        device_id: int = -1,
+        temp_filtered: bool = False,
+        reskin_data_struct: bool = True,
+        loop: bool = True,
+    ):
+        # Like ReSkinDummy, skip opening a port
+        self.num_mags = num_mags
+        self.port_name = None
+        self.baud_rate = None
+        self.burst_mode = burst_mode
+        self.device_id = device_id
+        self.reskin_data_struct = reskin_data_struct
+
+        self._msg_floats = 4 * num_mags
+        self._msg_length = 4 * self._msg_floats + 2
+
+        self._temp_mask = np.ones((self._msg_floats,), dtype=bool)
+        if temp_filtered:
+            self._temp_mask[::4] = False
+
+        self._data = bytes(data)
+        self._pos = 0
+        self.loop = loop
+
+    def _remaining(self):
+        if self.loop and len(self._data) - self._pos <= self._msg_length:
+            self._pos = 0
+        return len(self._data) - self._pos
+
+    @property
+    def in_waiting(self):
+        return min(self._remaining(), 4000)
+
+    def read(self, size=1):
+        self._remaining()
+        out = self._data[self._pos : self._pos + size]
+        self._pos += len(out)
+        return out
+
+    def read_until(self, expected=b"\n", size=None):
+        self._remaining()
+        end = self._data.find(expected, self._pos)
+        end = len(self._data) if end < 0 else end + len(expected)
+        out = self._data[self._pos : end]
+        self._pos = end
+        return out
+
+    def readline(self, size=-1):
+        return self.read_until(b"\n")
+
+    def reset_input_buffer(self):
+        self._pos += self.in_waiting
+
+    def flush(self):
+        pass
+
+
+def bench_decode(data: bytes, num_mags: int, burst_mode: bool = True, min_time: float = 1.0):
+    """
+    Decode throughput of ReSkinBase.get_sample, and of the vectorised
+    aio.decode_burst_frames in burst mode
+
+    Returns
+    -------
+    dict
+        Frames per second and CPU time per frame of each decoder
+    """
+    sensor = ByteStreamSensor(data, num_mags=num_mags, burst_mode=burst_mode)
+    frames = 0
+    wall, cpu = time.perf_counter(), time.process_time()
+    stop = wall + min_time
+    while time.perf_counter() < stop:
+        for _ in range(100):
+            sensor.get_sample()
+        frames += 100
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    results = {
+        "bytes": len(data),
+        "get_sample": {
+            "frames": frames,
+            "frames_per_s": frames / wall,
+            "cpu_us_per_frame": cpu / frames * 1e6,
+        },
+    }
+    if burst_mode:
+        from .aio import decode_burst_frames
+
+        buf = bytearray(data)
+        counts = []
+
+        def decode():
+            counts.append(decode_burst_frames(buf, 4 * num_mags)[0].shape[0])
+
+        cpu = time.process_time()
+        durations = _time_calls(decode, min_time, min_calls=3)
+        cpu = time.process_time() - cpu
+        total = sum(counts)
+        results["decode_burst_frames"] = {
+            "frames": total,
+            "frames_per_s": float(total / durations.sum()),
+            "cpu_us_per_frame": cpu / total * 1e6,
+        }
+    return results
+
+
+def _dummy_process(num_mags: int, **kwargs):
+    from .sensor_proc import ReSkinProcess
+
+    stream = ReSkinProcess(num_mags=num_mags, port=None, allow_dummy_sensor=True, **kwargs)
+    stream.start()
+    while stream.sample_cnt == 0:
+        time.sleep(0.01)
+    return stream
+
+
+def bench_get_buffer(num_mags: int = 5, sizes=(1000, 10000, 100000), chunk_sizes=(1000, 10000), repeats: int = 3):
+    """
+    Time ReSkinProcess.get_buffer to transfer buffers of the given sizes,
+    for every chunk size, streaming from the dummy sensor
+
+    Returns
+    -------
+    dict
+        Median transfer time per "chunk_size=..." and "size=..."
+    """
+    results = {}
+    for chunk_size in chunk_sizes:
+        stream = _dummy_process(num_mags, chunk_size=chunk_size)
+        entries = results["chunk_size={}".format(chunk_size)] = {}
+        try:
+            for size in sizes:
+                durations, lengths = [], []
+                for _ in range(repeats):
+                    stream.start_buffering()
+                    while stream._buffer_size.value < size:
+                        time.sleep(0.001)
+                    stream.pause_buffering()
+                    start = time.perf_counter()
+                    buffer = stream.get_buffer()
+                    durations.append(time.perf_counter() - start)
+                    lengths.append(len(buffer))
+                seconds = float(np.median(durations))
+                samples = int(np.median(lengths))
+                entries["size={}".format(size)] = {
+                    "samples": samples,
+                    "seconds": seconds,
+                    "us_per_sample": seconds / max(samples, 1) * 1e6,
+                }
+        finally:
+            stream.join()
+    return results
+
+
+def bench_last_reading(num_mags: int = 5, duration: float = 1.0):
+    """
+    Cost of ReSkinProcess.last_reading, and how old the reading it returns
+    is: the time from the sample's timestamp to the reader seeing it
+    """
+    stream = _dummy_process(num_mags)
+    try:
+        calls, ages = [], []
+        last_time = None
+        stop = time.perf_counter() + duration
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            reading = stream.last_reading
+            calls.append(time.perf_counter() - start)
+            if reading.time != last_time:
+                ages.append(time.time() - reading.time)
+                last_time = reading.time
+    finally:
+        stream.join()
+    return {"call": summarize(calls), "age": summarize(ages)}
+
+
+def _synthetic_forest(num_trees: int, depth: int, num_inputs: int, num_classes: int, seed: int = None):
+    """Forest of complete random trees, to time FlatForest without sklearn"""
+    from .forest import FlatForest
+
+    rng = np.random.default_rng(seed)
+    per_tree = 2 ** (depth + 1) - 1
+    num_internal = 2**depth - 1
+    nodes = np.arange(per_tree)
+    feature, threshold, children, value = [], [], [], []
+    for t in range(num_trees):
+        offset = t * per_tree
+        internal = nodes < num_internal
+        feature.append(np.where(internal, rng.integers(0, num_inputs, per_tree), 0))
+        threshold.append(np.where(internal, rng.normal(size=per_tree), np.inf))
+        kids = np.stack((2 * nodes + 1, 2 * nodes + 2), axis=1)
+        kids[~internal] = nodes[~internal, None]
+        children.append(kids + offset)
+        probs = rng.dirichlet(np.ones(num_classes), size=per_tree)
+        value.append(np.where(internal[:, None], 0.0, probs))
+    return FlatForest(
+        np.concatenate(feature),
+        np.concatenate(threshold),
+        np.concatenate(children),
+        np.concatenate(value),
+        np.arange(num_trees) * per_tree,
+        np.arange(num_classes),
+    )
+
+
+def default_models(num_inputs: int = 15, num_classes: int = 4, seed: int = 0):
+    """Synthetic models of the sizes this repository trains"""
+    from .infer import DenseNetwork
+
+    rng = np.random.default_rng(seed)
+    sizes = [num_inputs, 64, 32, num_classes]
+    dense = DenseNetwork(
+        [rng.normal(size=(a, b)) for a, b in zip(sizes[:-1], sizes[1:])],
+        [rng.normal(size=b) for b in sizes[1:]],
+        ["relu", "relu", "softmax"],
+    )
+    return {
+        "dense": dense,
+        "forest": _synthetic_forest(100, 10, num_inputs, num_classes, seed),
+    }
+
+
+def bench_inference(models, batch_sizes=(1, 32, 1024), min_time: float = 0.5, seed: int = 0):
+    """
+    Latency of predict per model and batch size
+
+    Parameters
+    ----------
+    models : dict
+        Name to anything with predict(x) and num_inputs, e.g. from
+        default_models or infer.load_predictor
+    """
+    rng = np.random.default_rng(seed)
+    results = {}
+    for name, model in models.items():
+        results[name] = {"backend": type(model).__name__}
+        for batch in batch_sizes:
+            x = rng.normal(size=(batch, model.num_inputs)).astype(np.float32)
+            if batch == 1:
+                x = x[0]
+            stats = summarize(_time_calls(lambda: model.predict(x), min_time))
+            stats["samples_per_s"] = batch / (stats["mean_us"] * 1e-6)
+            results[name]["batch={}".format(batch)] = stats
+    return results
+
+
+def environment():
+    """Versions and machine the results were measured with"""
+    try:
+        from importlib.metadata import version
+
+        package = version("reskin_sensor")
+    except Exception:
+        package = None
+    return {
+        "package": package,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def flatten(results, prefix: str = ""):
+    """Numeric leaves of nested results, keyed by their path"""
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(flatten(value, "{}{}{}".format(prefix, "." if prefix else "", key)))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        flat[prefix] = float(results)
+    return flat
+
+
+def compare(new, old, threshold: float = 0.1):
+    """
+    Metrics that changed by more than threshold between two result files
+
+    Returns
+    -------
+    list
+        (metric, old, new, ratio) of throughputs (per_s) and times (_us,
+        seconds), worst regression first
+    """
+    a, b = flatten(old["results"]), flatten(new["results"])
+    changes = []
+    for key in sorted(set(a) & set(b)):
+        if not (key.endswith("per_s") or key.endswith("_us") or key.endswith("seconds") or key.endswith("per_frame") or key.endswith("per_sample")):
+            continue
+        if a[key] == 0:
+            continue
+        ratio = b[key] / a[key]
+        # Higher is better for throughputs, lower for times
+        slowdown = 1 / ratio if key.endswith("per_s") else ratio
+        if abs(slowdown - 1) > threshold:
+            changes.append((key, a[key], b[key], slowdown))
+    return sorted(changes, key=lambda c: -c[3])
+
+
+def run(names=BENCHMARKS, num_mags: int = 5, captures=(), models=None, quick: bool = False):
+    """Run the named benchmarks and return their results"""
+    scale = 0.2 if quick else 1.0
+    results = {}
+    if "decode" in names:
+        results["decode"] = {
+            "synthetic_burst": bench_decode(synthetic_bytes(num_mags, 10000, seed=0), num_mags, True, scale),
+            "synthetic_ascii": bench_decode(synthetic_bytes(num_mags, 2000, False, seed=0), num_mags, False, scale),
+        }
+        for path in captures:
+            with open(path, "rb") as f:
+                results["decode"][os.path.basename(path)] = bench_decode(f.read(), num_mags, True, scale)
+    if "get_buffer" in names:
+        sizes = (1000, 10000) if quick else (1000, 10000, 100000)
+        results["get_buffer"] = bench_get_buffer(num_mags, sizes=sizes, repeats=1 if quick else 3)
+    if "last_reading" in names:
+        results["last_reading"] = bench_last_reading(num_mags, duration=scale)
+    if "inference" in names:
+        all_models = default_models(num_inputs=3 * num_mags)
+        all_models.update(models or {})
+        results["inference"] = bench_inference(all_models, min_time=0.5 * scale)
+    return results
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(description="Benchmark decoding, buffering and inference")
+    parser.add_argument("-o", "--output", type=str, help="JSON file to write the results to", default="benchmark_results.json")
+    parser.add_argument("-n", "--num_mags", type=int, help="Number of magnetometers of the simulated board", default=5)
+    parser.add_argument("--only", type=str, nargs="+", choices=BENCHMARKS, help="Benchmarks to run", default=BENCHMARKS)
+    parser.add_argument("--capture", type=str, nargs="+", help="Raw burst-mode byte captures to decode", default=[])
+    parser.add_argument("-m", "--model", type=str, nargs="+", help="Models to time, as accepted by load_predictor", default=[])
+    parser.add_argument("--quick", action="store_true", help="Shorter runs, for a quick check")
+    parser.add_argument("--label", type=str, help="Free-form label stored with the results, e.g. a branch name")
+    parser.add_argument("--compare", type=str, help="Earlier results to compare with")
+    parser.add_argument("--record", type=str, help="Instead of benchmarking, save a raw capture of the sensor on --port here")
+    parser.add_argument("-p", "--port", type=str, help="Port of the sensor to record")
+    parser.add_argument("--duration", type=float, help="Seconds to record", default=10.0)
+    args = parser.parse_args()
+    # fmt: on
+
+    if args.record is not None:
+        if args.port is None:
+            parser.error("--record needs --port")
+        record_capture(args.port, args.record, args.duration)
+        print("Saved {}".format(args.record))
+        return
+
+    from .infer import load_predictor
+
+    models = {os.path.basename(path): load_predictor(path) for path in args.model}
+    output = {
+        "label": args.label,
+        "environment": environment(),
+        "num_mags": args.num_mags,
+        "results": run(args.only, args.num_mags, args.capture, models, args.quick),
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print("Results written to {}".format(args.output))
+
+    for key, value in flatten(output["results"]).items():
+        if key.endswith("per_s") or key.endswith("p50_us") or key.endswith("per_frame") or key.endswith("us_per_sample"):
+            print("{:70s} {:14.2f}".format(key, value))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        changes = compare(output, old)
+        print("\nChanges against {} (slowdown > 1 is worse):".format(args.compare))
+        for key, a, b, slowdown in changes:
+            print("{:70s} {:12.2f} -> {:12.2f}  x{:.2f}".format(key, a, b, slowdown))
+        if not changes:
+            print("No change above 10%")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
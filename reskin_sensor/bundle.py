@@ -0,0 +1,305 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from .features import feature_names
+from .forest import FlatForest
+from .infer import WEIGHT_DTYPES, DenseNetwork
+from .windows import WINDOW_FEATURES, WindowFeatures, window_feature_names
+
+BUNDLE_FORMAT = "reskin-model-bundle"
+BUNDLE_VERSION = 1
+BUNDLE_EXTENSION = ".reskin"
+
+# Layout produced by features.frame_features from baseline-subtracted readings
+FEATURE_LAYOUT = "axis-major"
+
+DEFAULT_LABELS = {0: "No press", 1: "Top", 2: "Left", 3: "Right"}
+
+
+def make_feature_spec(num_mags: int, layout: str = FEATURE_LAYOUT, window: int = None, window_features=WINDOW_FEATURES):
+    """
+    Describe the classifier input produced for a board with num_mags chips
+
+    If window is given, the classifier takes windows.WindowFeatures of
+    that many frames instead of single frames.
+    """
+    spec = {
+        "num_mags": num_mags,
+        "layout": layout,
+        "baseline_subtracted": True,
+        "names": feature_names(num_mags),
+    }
+    if window:
+        spec["window"] = {"size": window, "features": list(window_features)}
+        spec["names"] = window_feature_names(num_mags, window_features)
+    return spec
+
+
+class ModelBundle:
+    """
+    Classifier together with everything needed to use it.
+
+    A bundle is one file holding a JSON manifest and the arrays of the
+    network, the feature scaler (unless it is folded into the network), the
+    label names, the press threshold and the layout of the features the
+    classifier was trained on. Loading it needs only NumPy.
+
+    Attributes
+    ----------
+    network : DenseNetwork or FlatForest
+        The classifier
+    labels : dict
+        Label name of every class index
+    feature_spec : dict
+        Number of magnetometers, layout and names of the input features
+    press_threshold : float
+        Press threshold in multiples of the calibrated noise floor, or None
+    metadata : dict
+        Free-form information, e.g. the source model and training data
+
+    Methods
+    -------
+    predict(x):
+        Class probabilities of one sample or a batch of unscaled features
+    predict_label(x):
+        Most likely class of one sample or a batch of unscaled features
+    check_features(num_mags, layout):
+        Raise ValueError if the bundle expects a different feature layout
+    feature_extractor():
+        New windowed feature extractor the classifier expects, or None
+    keras_model():
+        Rebuild the classifier as a keras model; imports TensorFlow
+    """
+
+    # Bundles scale their input themselves, so they take unscaled features
+    scaler_folded = True
+
+    def __init__(
+        self,
+        network,
+        feature_spec,
+        labels=None,
+        press_threshold: float = None,
+        scaler_mean=None,
+        scaler_scale=None,
+        metadata=None,
+    ):
+        if network.scaler_folded and scaler_mean is not None:
+            raise ValueError("Network already includes a scaler")
+        if network.num_inputs != len(feature_spec["names"]):
+            raise ValueError(
+                "Network takes {} inputs but the feature spec has {}".format(
+                    network.num_inputs, len(feature_spec["names"])
+                )
+            )
+        self.network = network
+        self.feature_spec = dict(feature_spec)
+        self.labels = dict(DEFAULT_LABELS if labels is None else labels)
+        self.press_threshold = press_threshold
+        self.metadata = dict(metadata or {})
+        self.scaler_mean = None if scaler_mean is None else np.asarray(scaler_mean, dtype=np.float32)
+        self.scaler_scale = None if scaler_scale is None else np.asarray(scaler_scale, dtype=np.float32)
+
+    @property
+    def num_mags(self):
+        return self.feature_spec["num_mags"]
+
+    def label_name(self, label):
+        return self.labels.get(int(label), str(label))
+
+    def check_features(self, num_mags: int, layout: str = FEATURE_LAYOUT):
+        """Raise ValueError if the bundle expects a different feature layout"""
+        expected = (self.feature_spec["num_mags"], self.feature_spec["layout"])
+        if expected != (num_mags, layout):
+            raise ValueError(
+                "Model expects {} features from {} magnetometers, got {} features "
+                "from {} magnetometers".format(expected[1], expected[0], layout, num_mags)
+            )
+
+    def feature_extractor(self):
+        """
+        New windowed feature extractor the classifier expects, or None
+
+        Frame features must be passed through it, continuously and in
+        stream order, before they are classified.
+        """
+        window = self.feature_spec.get("window")
+        if window is None:
+            return None
+        return WindowFeatures(self.num_mags, window["size"], window["features"])
+
+    def predict(self, x):
+        """Class probabilities of one sample or a batch of unscaled features"""
+        if self.scaler_mean is not None:
+            x = (np.asarray(x, dtype=np.float32) - self.scaler_mean) / self.scaler_scale
+        return self.network.predict(x)
+
+    def predict_label(self, x):
+        """Most likely class of one sample or a batch of unscaled features"""
+        return np.argmax(self.predict(x), axis=-1)
+
+    def keras_model(self):
+        """Rebuild the classifier as a keras model; imports TensorFlow"""
+        if self.network.kind != "dense":
+            raise TypeError("Only dense networks can be converted to keras")
+        from tensorflow.keras.layers import Dense
+        from tensorflow.keras.models import Sequential
+
+        network = self.network
+        if self.scaler_mean is not None:
+            network = network.fold_scaler(self.scaler_mean, self.scaler_scale)
+        model = Sequential()
+        for i, (w, b, a) in enumerate(zip(network.weights, network.biases, network.activations)):
+            kwargs = {"input_dim": w.shape[0]} if i == 0 else {}
+            model.add(Dense(w.shape[1], activation=a, **kwargs))
+            model.layers[-1].set_weights([w, b])
+        return model
+
+    def save(self, path: str, dtype: str = None):
+        """
+        Write the bundle to a single file
+
+        Parameters
+        ----------
+        path : str
+            Output file; conventionally ending in .reskin
+        dtype : str
+            Weight precision of dense networks: float32, float16 or int8
+        """
+        network = self.network
+        model = {"kind": network.kind, "scaler_folded": network.scaler_folded}
+        if network.kind == "forest":
+            network_arrays = network.to_arrays()
+            model.update(trees=network.num_trees, depth=network.depth)
+        else:
+            network_arrays = network.to_arrays(dtype)
+            model.update(layers=len(network.weights), weight_dtype=dtype or network.weight_dtype)
+        arrays = {"net_" + k: v for k, v in network_arrays.items()}
+        if self.scaler_mean is not None:
+            arrays["scaler_mean"] = self.scaler_mean
+            arrays["scaler_scale"] = self.scaler_scale
+        manifest = {
+            "format": BUNDLE_FORMAT,
+            "version": BUNDLE_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "model": model,
+            "labels": {str(k): v for k, v in self.labels.items()},
+            "press_threshold": self.press_threshold,
+            "feature_spec": self.feature_spec,
+            "metadata": self.metadata,
+        }
+        arrays["manifest"] = np.array(json.dumps(manifest))
+        # Writing through a file object keeps numpy from appending .npz
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a bundle written with save()"""
+        with np.load(path) as f:
+            manifest = read_manifest(f, path)
+            arrays = {k[4:]: f[k] for k in f.files if k.startswith("net_")}
+            kind = manifest["model"].get("kind", "dense")
+            if kind == "forest":
+                network = FlatForest.from_arrays(arrays)
+            elif kind == "dense":
+                network = DenseNetwork.from_arrays(arrays)
+            else:
+                raise ValueError("{} holds an unsupported model kind {}".format(path, kind))
+            scaler_mean = f["scaler_mean"] if "scaler_mean" in f.files else None
+            scaler_scale = f["scaler_scale"] if "scaler_scale" in f.files else None
+        return cls(
+            network,
+            feature_spec=manifest["feature_spec"],
+            labels={int(k): v for k, v in manifest["labels"].items()},
+            press_threshold=manifest["press_threshold"],
+            scaler_mean=scaler_mean,
+            scaler_scale=scaler_scale,
+            metadata=manifest["metadata"],
+        )
+
+
+def read_manifest(f, path: str = "bundle"):
+    """Return the manifest of an open bundle, checking its format and version"""
+    if "manifest" not in f.files:
+        raise ValueError("{} is not a model bundle".format(path))
+    manifest = json.loads(str(f["manifest"]))
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError("{} is not a model bundle".format(path))
+    if manifest.get("version", 0) > BUNDLE_VERSION:
+        raise ValueError(
+            "{} has bundle version {}; this library reads up to {}".format(
+                path, manifest["version"], BUNDLE_VERSION
+            )
+        )
+    return manifest
+
+
+def create_bundle(
+    model_path: str,
+    scaler_path: str,
+    num_mags: int,
+    labels=None,
+    press_threshold: float = None,
+    fold_scaler: bool = True,
+):
+    """
+    Build a bundle from a keras model file and its StandardScaler
+
+    Parameters
+    ----------
+    model_path : str
+        Keras model file; TensorFlow is imported to read it
+    scaler_path : str
+        joblib file with the StandardScaler the model was trained with
+    num_mags : int
+        Number of magnetometers the features were computed from
+    labels : dict
+        Label name of every class index
+    press_threshold : float
+        Press threshold in multiples of the calibrated noise floor
+    fold_scaler : bool
+        Fold the scaler into the first layer instead of storing it
+    """
+    from joblib import load
+    from tensorflow.keras.models import load_model
+
+    network = DenseNetwork.from_keras(load_model(model_path))
+    scaler = load(scaler_path)
+    kwargs = {}
+    if fold_scaler:
+        network = network.fold_scaler(scaler.mean_, scaler.scale_)
+    else:
+        kwargs = {"scaler_mean": scaler.mean_, "scaler_scale": scaler.scale_}
+    return ModelBundle(
+        network,
+        feature_spec=make_feature_spec(num_mags),
+        labels=labels,
+        press_threshold=press_threshold,
+        metadata={"source_model": model_path, "source_scaler": scaler_path},
+        **kwargs
+    )
+
+
+if __name__ == "__main__":
+    # fmt: off
+    parser = argparse.ArgumentParser(description="Bundle a keras classifier with its scaler, labels and feature layout")
+    parser.add_argument("model", type=str, help="Keras model file")
+    parser.add_argument("scaler", type=str, help="StandardScaler joblib file the model was trained with")
+    parser.add_argument("-o", "--output", type=str, required=True, help="Output bundle, e.g. model.reskin")
+    parser.add_argument("-n", "--num_mags", type=int, default=5, help="Number of magnetometers the model was trained on")
+    parser.add_argument("-l", "--labels", type=str, nargs="+", default=None, help="Label names in class order")
+    parser.add_argument("-k", "--press_threshold", type=float, default=None, help="Press threshold in multiples of the noise floor")
+    parser.add_argument("--dtype", type=str, default="float32", choices=WEIGHT_DTYPES, help="Weight precision")
+    args = parser.parse_args()
+    # fmt: on
+
+    labels = None if args.labels is None else dict(enumerate(args.labels))
+    bundle = create_bundle(
+        args.model, args.scaler, args.num_mags, labels=labels, press_threshold=args.press_threshold
+    )
+    bundle.save(args.output, dtype=args.dtype)
+    print("Saved {}".format(args.output))
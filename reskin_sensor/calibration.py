@@ -0,0 +1,69 @@
+import collections
+import time
+
+import numpy as np
+
+from .filters import MovingAverage
+
+Calibration = collections.namedtuple("Calibration", "mean, std, num_samples")
+
+
+def calibrate(samples, window_size: int = 5):
+    """
+    Compute the resting baseline and noise floor of every channel
+
+    Parameters
+    ----------
+    samples : array_like
+        (N, num_channels) readings taken while the skin is not touched
+    window_size : int
+        Moving average window applied before the baseline is computed
+
+    Returns
+    -------
+    Calibration
+        Per-channel baseline (mean of the smoothed readings), noise floor
+        (standard deviation of the raw readings) and number of samples used
+    """
+    samples = np.asarray(samples, dtype=float)
+    if samples.ndim != 2 or samples.shape[0] < window_size:
+        raise ValueError(
+            "Need at least {} calibration samples, got {}".format(
+                window_size, samples.shape[0] if samples.ndim else 0
+            )
+        )
+    smoothed = MovingAverage(window_size).process(samples)[window_size - 1 :]
+    return Calibration(
+        mean=smoothed.mean(axis=0),
+        std=samples.std(axis=0),
+        num_samples=samples.shape[0],
+    )
+
+
+def collect_calibration(
+    sensor_stream,
+    duration: float = 20,
+    sampling_rate: float = 500,
+    window_size: int = 5,
+):
+    """
+    Sample a resting sensor and compute its calibration
+
+    Parameters
+    ----------
+    sensor_stream : ReSkinProcess
+        Running sensor stream
+    duration : float
+        Time to collect calibration data for, in s
+    sampling_rate : float
+        Rate at which the stream is sampled, in Hz
+    window_size : int
+        Moving average window applied before the baseline is computed
+    """
+    samples = []
+    for _ in range(int(duration * sampling_rate)):
+        if sensor_stream.is_alive():
+            samples.append(sensor_stream.get_data(num_samples=1)[0].data)
+        time.sleep(1 / sampling_rate)
+
+    return calibrate(samples, window_size=window_size)
@@ -0,0 +1,229 @@
+import collections
+
+import numpy as np
+
+from .features import frame_features, split_readings
+
+ContactEvent = collections.namedtuple("ContactEvent", "kind, index, time, summary")
+ContactSummary = collections.namedtuple(
+    "ContactSummary",
+    "start, end, num_samples, peak_score, peak_features, mean_features",
+)
+
+
+def _run_lengths(flags, carry):
+    """
+    Length of the run of True values ending at every sample
+
+    Parameters
+    ----------
+    flags : np.ndarray
+        (N,) booleans
+    carry : int
+        Length of the run of True values at the end of the previous block
+    """
+    idx = np.arange(flags.shape[0])
+    # Index of the last False at or before every sample; runs continuing
+    # from the previous block start `carry` samples before the block
+    last_false = np.where(flags, -1 - carry, idx)
+    np.maximum.accumulate(last_false, out=last_false)
+    return idx - last_false
+
+
+class ContactDetector:
+    """
+    Streaming contact segmenter with hysteresis.
+
+    Every sample is scored by its largest deviation from the baseline,
+    measured in units of the per-channel noise floor. A contact starts once
+    the score has stayed at or above `k_on` for `min_duration` samples, and
+    ends once it has stayed below `k_off` for `min_release` samples. Blocks
+    are processed with array operations only; the detector keeps its state
+    between blocks so a stream can be fed in blocks of any size.
+
+    Attributes
+    ----------
+    noise_std : np.ndarray
+        Noise floor of every input channel
+    in_contact : bool
+        Whether a contact is in progress
+    contact_flags : np.ndarray
+        Whether every sample of the last processed block was in contact
+    num_samples : int
+        Number of samples processed so far
+
+    Methods
+    -------
+    process(block, times=None):
+        Update the detector and return the contact events in a block
+    reset():
+        Forget all state
+    """
+
+    def __init__(
+        self,
+        noise_std,
+        k_on: float = 10.0,
+        k_off: float = 5.0,
+        min_duration: int = 3,
+        min_release: int = 5,
+        min_noise: float = 1.0,
+    ):
+        if k_off > k_on:
+            raise ValueError("k_off must not exceed k_on")
+        if min_duration < 1 or min_release < 1:
+            raise ValueError("min_duration and min_release must be at least 1")
+        self.noise_std = np.maximum(np.asarray(noise_std, dtype=float), min_noise)
+        self.k_on = k_on
+        self.k_off = k_off
+        self.min_duration = min_duration
+        self.min_release = min_release
+        self.reset()
+
+    @classmethod
+    def from_calibration(cls, calibration, num_mags: int, **kwargs):
+        """
+        Build a detector for frame features from a sensor calibration
+
+        Parameters
+        ----------
+        calibration : Calibration
+            Calibration of the raw sensor channels
+        num_mags : int
+            Number of magnetometers on the board
+        kwargs
+            Passed on to ContactDetector
+        """
+        _, mag_std = split_readings(calibration.std, num_mags)
+        return cls(frame_features(mag_std), **kwargs)
+
+    def reset(self):
+        """Forget all state"""
+        self.in_contact = False
+        self.contact_flags = np.zeros(0, dtype=bool)
+        self.num_samples = 0
+        self._run_on = 0
+        self._run_off = 0
+        self._contact = None
+        # The last min_duration - 1 samples and scores, where a contact
+        # confirmed early in the next block starts
+        self._tail = None
+        self._tail_score = None
+
+    def score(self, block):
+        """Largest deviation of every sample, in units of the noise floor"""
+        return np.max(np.abs(block) / self.noise_std, axis=-1)
+
+    def process(self, block, times=None):
+        """
+        Update the detector and return the contact events in a block
+
+        Parameters
+        ----------
+        block : array_like
+            (N, num_channels) baseline-subtracted samples
+        times : array_like
+            Optional (N,) sample times, reported with the events
+
+        Returns
+        -------
+        list of ContactEvent
+            "start" events carry the index of the first sample above k_on;
+            "end" events carry the index at which the release was confirmed
+            and a ContactSummary of the samples from the start up to it
+        """
+        block = np.asarray(block, dtype=float)
+        n = block.shape[0]
+        if n == 0:
+            self.contact_flags = np.zeros(0, dtype=bool)
+            return []
+        score = self.score(block)
+        if self._tail is None:
+            self._tail, self._tail_score = block[:0], score[:0]
+        above_on = score >= self.k_on
+        below_off = score < self.k_off
+
+        run_on = _run_lengths(above_on, self._run_on)
+        run_off = _run_lengths(below_off, self._run_off)
+        self._run_on = int(run_on[-1])
+        self._run_off = int(run_off[-1])
+
+        # Contact state is set by the last confirmed onset or release; the
+        # two can never be confirmed on the same sample since k_off <= k_on
+        decision = np.full(n, -1)
+        decision[run_off >= self.min_release] = 0
+        decision[run_on >= self.min_duration] = 1
+        has_decision = decision >= 0
+        last = np.where(has_decision, np.arange(n), -1)
+        np.maximum.accumulate(last, out=last)
+        state = np.where(last >= 0, decision[np.maximum(last, 0)], int(self.in_contact))
+
+        prev = np.concatenate(([int(self.in_contact)], state[:-1]))
+        changes = np.flatnonzero(state != prev)
+
+        events = []
+        offset = self.num_samples
+        seg_start = 0 if self.in_contact else None
+        for i in changes:
+            if state[i]:
+                onset = offset + i - self.min_duration + 1
+                self._contact = {
+                    "start": onset,
+                    "sum": np.zeros(block.shape[1:]),
+                    "count": 0,
+                    "peak_score": -np.inf,
+                    "peak_features": None,
+                }
+                events.append(self._event("start", onset, times, i, None))
+                # The onset samples before the confirmation may lie in the
+                # previous block
+                seg_start = i - self.min_duration + 1
+                if seg_start < 0:
+                    tail = self._tail.shape[0]
+                    self._accumulate(self._tail, self._tail_score, tail + seg_start, tail)
+                    seg_start = 0
+            else:
+                self._accumulate(block, score, seg_start, i)
+                summary = self._summary(offset + i)
+                events.append(self._event("end", offset + i, times, i, summary))
+                self._contact = None
+                seg_start = None
+        if seg_start is not None:
+            self._accumulate(block, score, seg_start, n)
+
+        self.contact_flags = state.astype(bool)
+        self.in_contact = bool(state[-1])
+        self.num_samples += n
+        keep = self.min_duration - 1
+        if keep:
+            self._tail = np.concatenate((self._tail, block[-keep:]))[-keep:]
+            self._tail_score = np.concatenate((self._tail_score, score[-keep:]))[-keep:]
+        return events
+
+    def _accumulate(self, block, score, start, stop):
+        if stop <= start:
+            return
+        contact = self._contact
+        contact["sum"] += block[start:stop].sum(axis=0)
+        contact["count"] += stop - start
+        peak = start + int(np.argmax(score[start:stop]))
+        if score[peak] > contact["peak_score"]:
+            contact["peak_score"] = float(score[peak])
+            contact["peak_features"] = block[peak].copy()
+
+    def _summary(self, end):
+        contact = self._contact
+        count = max(contact["count"], 1)
+        return ContactSummary(
+            start=contact["start"],
+            end=end,
+            num_samples=contact["count"],
+            peak_score=contact["peak_score"],
+            peak_features=contact["peak_features"],
+            mean_features=contact["sum"] / count,
+        )
+
+    @staticmethod
+    def _event(kind, index, times, i, summary):
+        t = None if times is None else float(times[i])
+        return ContactEvent(kind=kind, index=index, time=t, summary=summary)
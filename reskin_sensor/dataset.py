@@ -0,0 +1,344 @@
+"""
+Chunked binary store for labelled ReSkin data.
+
+A dataset is a directory holding two files:
+
+    data.f32        all rows, float32, row-major, one column per feature
+    manifest.json   column names and the row range of every chunk
+
+Every chunk is a run of rows from one session with one label, recorded on
+one device with one calibration. The data file can be memory-mapped in one
+go, and rows for a subset of labels or sessions can be read by range
+without touching the rest of the file.
+"""
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .features import feature_names
+
+MANIFEST_NAME = "manifest.json"
+DATA_NAME = "data.f32"
+DATASET_VERSION = 1
+
+
+def _read_manifest(path):
+    with open(os.path.join(path, MANIFEST_NAME), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != DATASET_VERSION:
+        raise ValueError(
+            "Unsupported dataset version {} in {}".format(manifest.get("version"), path)
+        )
+    return manifest
+
+
+class Dataset:
+    """
+    Read-only view of a dataset directory.
+
+    Attributes
+    ----------
+    path : str
+        Dataset directory
+    columns : list
+        Feature column names
+    chunks : list
+        One dict per chunk with keys session, label, device, calibration_id,
+        start and stop
+    data : np.memmap
+        (num_rows, num_columns) memory-mapped features
+    labels : np.ndarray
+        (num_rows,) label of every row
+
+    Methods
+    -------
+    select(labels=None, sessions=None):
+        Return the chunks matching the given labels and sessions
+    load(labels=None, sessions=None):
+        Return features and labels of the matching rows
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        manifest = _read_manifest(path)
+        self.columns = manifest["columns"]
+        self.chunks = manifest["chunks"]
+        self.num_rows = manifest["num_rows"]
+        if self.num_rows > 0:
+            self.data = np.memmap(
+                os.path.join(path, DATA_NAME),
+                dtype=np.float32,
+                mode="r",
+                shape=(self.num_rows, len(self.columns)),
+            )
+        else:
+            self.data = np.zeros((0, len(self.columns)), dtype=np.float32)
+        self._labels = None
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def labels(self):
+        if self._labels is None:
+            labels = np.empty((self.num_rows,), dtype=np.int64)
+            for c in self.chunks:
+                labels[c["start"] : c["stop"]] = c["label"]
+            self._labels = labels
+        return self._labels
+
+    def select(self, labels=None, sessions=None):
+        """
+        Return the chunks matching the given labels and sessions
+
+        Parameters
+        ----------
+        labels : iterable
+            Labels to keep; all labels if None
+        sessions : iterable
+            Sessions to keep; all sessions if None
+        """
+        labels = None if labels is None else set(labels)
+        sessions = None if sessions is None else set(sessions)
+        return [
+            c
+            for c in self.chunks
+            if (labels is None or c["label"] in labels)
+            and (sessions is None or c["session"] in sessions)
+        ]
+
+    def rows(self, labels=None, sessions=None):
+        """Indices of the rows in the matching chunks"""
+        chunks = self.select(labels, sessions)
+        if not chunks:
+            return np.zeros((0,), dtype=np.int64)
+        return np.concatenate([np.arange(c["start"], c["stop"]) for c in chunks])
+
+    def load(self, labels=None, sessions=None):
+        """
+        Return features and labels of the matching rows
+
+        Only the matching row ranges are read from disk. Without a filter
+        the memory map itself is returned.
+
+        Returns
+        -------
+        X : np.ndarray
+            (N, num_columns) float32 features
+        y : np.ndarray
+            (N,) labels
+        """
+        if labels is None and sessions is None:
+            return self.data, self.labels
+        chunks = self.select(labels, sessions)
+        if not chunks:
+            return (
+                np.zeros((0, len(self.columns)), dtype=np.float32),
+                np.zeros((0,), dtype=np.int64),
+            )
+        X = np.concatenate([self.data[c["start"] : c["stop"]] for c in chunks])
+        y = np.concatenate(
+            [np.full(c["stop"] - c["start"], c["label"], dtype=np.int64) for c in chunks]
+        )
+        return X, y
+
+
+class DatasetWriter:
+    """
+    Appends labelled sessions to a dataset directory.
+
+    The manifest is rewritten on close, so use the writer as a context
+    manager or call close() when done.
+
+    Parameters
+    ----------
+    path : str
+        Dataset directory; created if it does not exist
+    columns : list
+        Feature column names. Must match the existing columns when
+        appending to a dataset.
+    """
+
+    def __init__(self, path: str, columns):
+        self.path = path
+        self.columns = list(columns)
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            manifest = _read_manifest(path)
+            if manifest["columns"] != self.columns:
+                raise ValueError(
+                    "Columns {} do not match the columns {} of {}".format(
+                        self.columns, manifest["columns"], path
+                    )
+                )
+            self.chunks = manifest["chunks"]
+            self.num_rows = manifest["num_rows"]
+        else:
+            self.chunks = []
+            self.num_rows = 0
+        self._file = open(os.path.join(path, DATA_NAME), "ab")
+        self._file.truncate(self.num_rows * len(self.columns) * 4)
+        self._file.seek(0, os.SEEK_END)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, data, labels, session: str, device: int = -1, calibration_id=None):
+        """
+        Append the rows of one session
+
+        Parameters
+        ----------
+        data : array_like
+            (N, num_columns) features
+        labels : int or array_like
+            Label of all rows, or (N,) label of every row. Rows are grouped
+            into one chunk per run of equal labels.
+        session : str
+            Session name
+        device : int
+            Device ID of the sensor the session was recorded with
+        calibration_id : str
+            Identifier of the calibration the features are relative to
+        """
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if data.ndim != 2 or data.shape[1] != len(self.columns):
+            raise ValueError(
+                "Expected rows of {} columns, got shape {}".format(
+                    len(self.columns), data.shape
+                )
+            )
+        n = data.shape[0]
+        if n == 0:
+            return
+        labels = np.broadcast_to(np.asarray(labels, dtype=np.int64), (n,))
+        bounds = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+        starts = np.concatenate(([0], bounds))
+        stops = np.concatenate((bounds, [n]))
+
+        self._file.write(data.tobytes())
+        for a, b in zip(starts, stops):
+            self.chunks.append(
+                {
+                    "session": session,
+                    "label": int(labels[a]),
+                    "device": int(device),
+                    "calibration_id": calibration_id,
+                    "start": self.num_rows + int(a),
+                    "stop": self.num_rows + int(b),
+                }
+            )
+        self.num_rows += n
+
+    def close(self):
+        """Flush the data and write the manifest"""
+        if self._file.closed:
+            return
+        self._file.close()
+        manifest = {
+            "version": DATASET_VERSION,
+            "dtype": "float32",
+            "columns": self.columns,
+            "num_rows": self.num_rows,
+            "chunks": self.chunks,
+        }
+        tmp_path = os.path.join(self.path, MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_NAME))
+
+
+def read_csv(path: str):
+    """
+    Parse a CSV written by collect_data.py
+
+    Older versions of collect_data.py wrote the rows axis by axis, like
+    the current one, under a header naming the columns chip by chip; that
+    header is replaced with the names of the columns actually written.
+
+    Returns
+    -------
+    columns : list
+        Feature column names
+    data : np.ndarray
+        (N, num_columns) float32 features
+    labels : np.ndarray
+        (N,) labels, taken from the last column
+    """
+    with open(path, "r") as f:
+        header = f.readline().strip().split(",")
+    values = np.loadtxt(path, delimiter=",", skiprows=1, dtype=np.float64, ndmin=2)
+    if values.shape[0] == 0:
+        values = np.zeros((0, len(header)))
+    columns = header[:-1]
+    num_mags = len(columns) // 3
+    if columns == ["B{}{}".format(axis, m) for m in range(num_mags) for axis in "xyz"]:
+        columns = feature_names(num_mags)
+    return columns, values[:, :-1].astype(np.float32), values[:, -1].astype(np.int64)
+
+
+def convert_csvs(paths, out_path: str, device: int = -1, workers: int = None):
+    """
+    Convert CSV files written by collect_data.py into a dataset
+
+    Files are parsed in parallel and appended in the given order, one
+    session per file.
+
+    Parameters
+    ----------
+    paths : list
+        CSV files to convert; all must have the same columns
+    out_path : str
+        Dataset directory; appended to if it exists
+    device : int
+        Device ID recorded for all sessions
+    workers : int
+        Number of parsing processes; defaults to the number of CPUs
+    """
+    paths = list(paths)
+    if not paths:
+        raise ValueError("No CSV files to convert")
+    writer = None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, (columns, data, labels) in zip(paths, pool.map(read_csv, paths)):
+                if writer is None:
+                    writer = DatasetWriter(out_path, columns)
+                elif columns != writer.columns:
+                    # Same width is not enough, e.g. for CSVs of another board
+                    raise ValueError(
+                        "Columns {} of {} do not match the columns {} of the dataset".format(
+                            columns, path, writer.columns
+                        )
+                    )
+                writer.add(data, labels, session=os.path.relpath(path), device=device)
+                print("Converted {} ({} rows)".format(path, data.shape[0]))
+    finally:
+        # Keep the sessions converted so far readable
+        if writer is not None:
+            writer.close()
+    return Dataset(out_path)
+
+
+if __name__ == "__main__":
+    # fmt: off
+    parser = argparse.ArgumentParser(description="Convert collect_data.py CSV files into a ReSkin dataset")
+    parser.add_argument("csv", type=str, nargs="+", help="CSV files or glob patterns to convert")
+    parser.add_argument("-o", "--output", type=str, required=True, help="Dataset directory")
+    parser.add_argument("-d", "--device", type=int, default=-1, help="Device ID recorded for the sessions")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of parsing processes")
+    args = parser.parse_args()
+    # fmt: on
+
+    paths = []
+    for pattern in args.csv:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    dataset = convert_csvs(paths, args.output, device=args.device, workers=args.workers)
+    print("{} rows in {} chunks".format(len(dataset), len(dataset.chunks)))
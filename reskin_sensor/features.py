@@ -0,0 +1,70 @@
+import numpy as np
+
+
+def split_readings(data, num_mags: int):
+    """
+    Split raw sensor readings into temperatures and magnetic field
+
+    Parameters
+    ----------
+    data : array_like
+        Readings of shape (..., 4 * num_mags) ordered T0, Bx0, By0, Bz0, T1...
+        or, if temperature was filtered out, (..., 3 * num_mags) ordered
+        Bx0, By0, Bz0, Bx1...
+    num_mags : int
+        Number of magnetometers on the board
+
+    Returns
+    -------
+    temps : np.ndarray or None
+        (..., num_mags) temperatures; None if the readings have none
+    mags : np.ndarray
+        (..., num_mags, 3) magnetic field readings
+    """
+    data = np.asarray(data, dtype=float)
+    width = data.shape[-1]
+    if width == 4 * num_mags:
+        chips = data.reshape(data.shape[:-1] + (num_mags, 4))
+        return chips[..., 0], chips[..., 1:]
+    if width == 3 * num_mags:
+        return None, data.reshape(data.shape[:-1] + (num_mags, 3))
+    raise ValueError(
+        "Expected {} or {} values per reading for {} magnetometers, got {}".format(
+            4 * num_mags, 3 * num_mags, num_mags, width
+        )
+    )
+
+
+def frame_features(mags):
+    """
+    Flatten magnetic field readings into classifier features
+
+    Features are ordered axis by axis: Bx of every chip, then By of every
+    chip, then Bz of every chip. This is the column order of the training
+    data written by collect_data.py.
+
+    Parameters
+    ----------
+    mags : array_like
+        (..., num_mags, 3) magnetic field readings
+    """
+    mags = np.asarray(mags)
+    return np.swapaxes(mags, -1, -2).reshape(mags.shape[:-2] + (-1,))
+
+
+def features_to_mags(features, num_mags: int):
+    """Inverse of frame_features; returns (..., num_mags, 3) readings"""
+    features = np.asarray(features)
+    axes = features.reshape(features.shape[:-1] + (3, num_mags))
+    return np.swapaxes(axes, -1, -2)
+
+
+def feature_names(num_mags: int):
+    """Column names matching the order of frame_features"""
+    return ["B{}{}".format(axis, m) for axis in "xyz" for m in range(num_mags)]
+
+
+def channel_names(num_mags: int, temp_filtered: bool = False):
+    """Names of the raw sensor channels, in the order they are streamed"""
+    axes = ["Bx", "By", "Bz"] if temp_filtered else ["T", "Bx", "By", "Bz"]
+    return ["{}{}".format(axis, m) for m in range(num_mags) for axis in axes]
@@ -0,0 +1,289 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    from scipy.signal import lfilter as _scipy_lfilter
+except ImportError:
+    _scipy_lfilter = None
+
+
+class StreamFilter:
+    """
+    Base class for stateful filters applied along the sample axis.
+
+    Filters operate on blocks of shape (N, ...) where N is the number of
+    samples and the trailing dimensions are channels. All channels are
+    filtered at once. State is carried over between calls to process, so
+    feeding a recording block by block gives the same result as feeding it
+    in one go.
+
+    Methods
+    -------
+    process(block):
+        Filter a block of samples and update the filter state
+    reset():
+        Forget all state; the next block is treated as the start of a stream
+    """
+
+    def __call__(self, block):
+        return self.process(block)
+
+    def process(self, block):
+        """
+        Filter a block of samples
+
+        Parameters
+        ----------
+        block : array_like
+            Samples of shape (N, ...). Empty blocks are allowed.
+        """
+        block = np.asarray(block, dtype=float)
+        if block.shape[0] == 0:
+            return block.copy()
+        if not self._initialized:
+            self._init_state(block[0])
+            self._initialized = True
+        return self._process(block)
+
+    def reset(self):
+        """Forget all state; the next block is treated as the start of a stream"""
+        self._initialized = False
+
+    def _init_state(self, first_sample):
+        raise NotImplementedError
+
+    def _process(self, block):
+        raise NotImplementedError
+
+
+class _WindowFilter(StreamFilter):
+    """Filter computed over the last `window` samples of each channel."""
+
+    def __init__(self, window: int):
+        if window < 1:
+            raise ValueError("window must be a positive integer")
+        self.window = window
+        self.reset()
+
+    def _init_state(self, first_sample):
+        # Pad the start of the stream with the first sample so the output
+        # has one row per input row
+        self._history = np.repeat(first_sample[None], self.window - 1, axis=0)
+
+    def _process(self, block):
+        padded = np.concatenate((self._history, block), axis=0)
+        self._history = padded[padded.shape[0] - (self.window - 1) :]
+        windows = sliding_window_view(padded, self.window, axis=0)
+        return self._reduce(windows)
+
+    def _reduce(self, windows):
+        raise NotImplementedError
+
+
+class MovingAverage(_WindowFilter):
+    """
+    Boxcar (moving average) filter over the last `window` samples.
+
+    Parameters
+    ----------
+    window : int
+        Number of samples averaged
+    """
+
+    def _reduce(self, windows):
+        return windows.mean(axis=-1)
+
+
+class RunningMedian(_WindowFilter):
+    """
+    Running median over the last `window` samples. Useful for removing
+    isolated spikes from corrupted serial frames.
+
+    Parameters
+    ----------
+    window : int
+        Number of samples the median is taken over
+    """
+
+    def _reduce(self, windows):
+        return np.median(windows, axis=-1)
+
+
+class Biquad(StreamFilter):
+    """
+    Second order IIR filter in transposed direct form II.
+
+    The filter state is initialised to the steady state for the first
+    sample, so a stream starting at a large offset does not ring.
+
+    Parameters
+    ----------
+    b : array_like
+        Numerator coefficients (b0, b1, b2)
+    a : array_like
+        Denominator coefficients (a0, a1, a2)
+    """
+
+    def __init__(self, b, a):
+        b = np.asarray(b, dtype=float)
+        a = np.asarray(a, dtype=float)
+        if b.shape != (3,) or a.shape != (3,):
+            raise ValueError("Biquad expects three b and three a coefficients")
+        if a[0] == 0:
+            raise ValueError("a[0] must be non-zero")
+        self.b = b / a[0]
+        self.a = a / a[0]
+        self.reset()
+
+    @classmethod
+    def lowpass(cls, cutoff: float, fs: float, q: float = 1 / np.sqrt(2)):
+        """
+        Butterworth-style low-pass biquad (RBJ audio EQ cookbook)
+
+        Parameters
+        ----------
+        cutoff : float
+            Cutoff frequency in Hz
+        fs : float
+            Sampling rate in Hz
+        q : float
+            Quality factor; 1/sqrt(2) gives a maximally flat passband
+        """
+        w0 = 2 * np.pi * cutoff / fs
+        alpha = np.sin(w0) / (2 * q)
+        cos_w0 = np.cos(w0)
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+        return cls(b, a)
+
+    @classmethod
+    def highpass(cls, cutoff: float, fs: float, q: float = 1 / np.sqrt(2)):
+        """
+        High-pass biquad (RBJ audio EQ cookbook). Handy for removing slow
+        baseline drift.
+
+        Parameters
+        ----------
+        cutoff : float
+            Cutoff frequency in Hz
+        fs : float
+            Sampling rate in Hz
+        q : float
+            Quality factor
+        """
+        w0 = 2 * np.pi * cutoff / fs
+        alpha = np.sin(w0) / (2 * q)
+        cos_w0 = np.cos(w0)
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+        return cls(b, a)
+
+    def _init_state(self, first_sample):
+        b, a = self.b, self.a
+        if np.sum(a) == 0:
+            # Pole at DC, no steady state; start from rest
+            self._zi = np.zeros((2,) + first_sample.shape)
+            return
+        gain = np.sum(b) / np.sum(a)
+        z2 = (b[2] - a[2] * gain) * first_sample
+        z1 = (b[1] - a[1] * gain) * first_sample + z2
+        self._zi = np.stack((z1, z2))
+
+    def _process(self, block):
+        if _scipy_lfilter is not None:
+            out, self._zi = _scipy_lfilter(self.b, self.a, block, axis=0, zi=self._zi)
+            return out
+
+        # The recursion is inherently sequential in time, but every step is
+        # vectorised over all channels
+        b0, b1, b2 = self.b
+        _, a1, a2 = self.a
+        z1, z2 = self._zi
+        out = np.empty_like(block)
+        for n in range(block.shape[0]):
+            x = block[n]
+            y = b0 * x + z1
+            z1 = b1 * x - a1 * y + z2
+            z2 = b2 * x - a2 * y
+            out[n] = y
+        self._zi = np.stack((z1, z2))
+        return out
+
+
+class KalmanCV(Biquad):
+    """
+    Constant-velocity Kalman filter, run independently on every channel.
+
+    Each channel is modelled as a position/velocity pair driven by white
+    acceleration noise. Since the model, the noise levels and the sampling
+    interval are the same at every step, the Kalman gain converges to a
+    fixed value; the filter uses that steady-state gain. The resulting
+    alpha-beta filter is linear and time-invariant, which lets it run as a
+    biquad on whole blocks instead of one sample at a time.
+
+    Parameters
+    ----------
+    process_noise : float
+        Standard deviation of the acceleration noise, in units/s^2
+    measurement_noise : float
+        Standard deviation of the measurement noise, in units
+    dt : float
+        Sampling interval in s
+    """
+
+    def __init__(self, process_noise: float, measurement_noise: float, dt: float):
+        if process_noise <= 0 or measurement_noise <= 0 or dt <= 0:
+            raise ValueError("Noise levels and dt must be positive")
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.dt = dt
+        self.alpha, self.beta = self._steady_state_gain(
+            process_noise, measurement_noise, dt
+        )
+        alpha, beta = self.alpha, self.beta
+        # Transfer function from measurement to position estimate
+        super(KalmanCV, self).__init__(
+            b=[alpha, beta - alpha, 0.0],
+            a=[1.0, alpha + beta - 2.0, 1.0 - alpha],
+        )
+
+    @staticmethod
+    def _steady_state_gain(process_noise, measurement_noise, dt, max_iter=100000):
+        """Iterate the Riccati recursion until the gain settles"""
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        G = np.array([[0.5 * dt ** 2], [dt]])
+        Q = G @ G.T * process_noise ** 2
+        R = measurement_noise ** 2
+        P = np.eye(2) * R
+        K = np.zeros(2)
+        for _ in range(max_iter):
+            P_pred = F @ P @ F.T + Q
+            K_new = P_pred[:, 0] / (P_pred[0, 0] + R)
+            P = P_pred - np.outer(K_new, P_pred[0])
+            if np.allclose(K_new, K, rtol=1e-12, atol=1e-15):
+                break
+            K = K_new
+        return K_new[0], K_new[1] * dt
+
+
+class FilterChain(StreamFilter):
+    """
+    Applies several stream filters one after the other.
+
+    Parameters
+    ----------
+    filters : list
+        Filters to apply, in order
+    """
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def process(self, block):
+        for f in self.filters:
+            block = f.process(block)
+        return block
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
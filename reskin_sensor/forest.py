@@ -0,0 +1,288 @@
+import argparse
+
+import numpy as np
+
+
+class FlatForest:
+    """
+    NumPy runtime for decision tree ensembles exported from sklearn.
+
+    The nodes of all trees are packed into flat arrays, and every leaf
+    points to itself, so a batch walks all trees at once with one gather
+    per tree level instead of one Python call per tree and sample.
+
+    Predictions have one column per label value 0..max(classes), so as for
+    DenseNetwork the argmax of a prediction is the label itself.
+
+    Attributes
+    ----------
+    feature : np.ndarray
+        (num_nodes,) feature tested by every node; 0 for leaves
+    threshold : np.ndarray
+        (num_nodes,) samples with feature <= threshold go left; inf for leaves
+    children : np.ndarray
+        (num_nodes, 2) left and right child of every node; leaves point to
+        themselves
+    value : np.ndarray
+        (num_nodes, num_outputs) class probabilities of every leaf
+    roots : np.ndarray
+        (num_trees,) root node of every tree
+    classes : np.ndarray
+        Labels the forest was trained on
+    scaler_folded : bool
+        Whether the thresholds apply to unscaled features
+    depth : int
+        Number of levels of the deepest tree
+
+    Methods
+    -------
+    predict(x):
+        Class probabilities of one sample or a batch of samples
+    predict_label(x):
+        Most likely class of one sample or a batch of samples
+    fold_scaler(mean, scale):
+        Return a forest whose thresholds apply to unscaled features
+    """
+
+    kind = "forest"
+
+    def __init__(self, feature, threshold, children, value, roots, classes, scaler_folded=False):
+        self.feature = np.ascontiguousarray(feature, dtype=np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.children = np.ascontiguousarray(children, dtype=np.intp)
+        self.value = np.ascontiguousarray(value, dtype=np.float32)
+        self.roots = np.ascontiguousarray(roots, dtype=np.intp)
+        self.classes = np.asarray(classes)
+        self.scaler_folded = scaler_folded
+        self.num_inputs = int(self.feature.max()) + 1 if len(self.feature) else 0
+        self.depth = self._max_depth()
+
+    def _max_depth(self):
+        is_leaf = self.children[:, 0] == np.arange(len(self.children))
+        nodes = self.roots
+        depth = 0
+        while True:
+            nodes = nodes[~is_leaf[nodes]]
+            if len(nodes) == 0:
+                return depth
+            nodes = self.children[nodes].ravel()
+            depth += 1
+
+    @property
+    def num_trees(self):
+        return len(self.roots)
+
+    @property
+    def num_outputs(self):
+        return self.value.shape[1]
+
+    @classmethod
+    def from_sklearn(cls, estimator, num_inputs: int = None):
+        """
+        Pack a fitted sklearn forest or decision tree classifier
+
+        Parameters
+        ----------
+        estimator : object
+            RandomForestClassifier, ExtraTreesClassifier or
+            DecisionTreeClassifier with a single output
+        num_inputs : int
+            Number of features; defaults to the estimator's n_features_in_
+        """
+        trees = getattr(estimator, "estimators_", [estimator])
+        classes = np.asarray(estimator.classes_)
+        if classes.ndim != 1:
+            raise ValueError("Only single-output classifiers can be exported")
+        if np.issubdtype(classes.dtype, np.integer) and classes.min() >= 0:
+            columns = classes.astype(np.intp)
+            num_outputs = int(classes.max()) + 1
+        else:
+            columns = np.arange(len(classes))
+            num_outputs = len(classes)
+
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+        for tree in trees:
+            t = tree.tree_
+            n = t.node_count
+            nodes = np.arange(n)
+            leaf = t.children_left < 0
+            left = np.where(leaf, nodes, t.children_left) + offset
+            right = np.where(leaf, nodes, t.children_right) + offset
+            features.append(np.where(leaf, 0, t.feature))
+            thresholds.append(np.where(leaf, np.inf, t.threshold))
+            children.append(np.stack([left, right], axis=1))
+            # Leaves hold class counts or fractions depending on the sklearn
+            # version; a forest averages the normalised ones
+            counts = t.value[:, 0, :]
+            proba = np.zeros((n, num_outputs))
+            proba[:, columns] = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1e-12)
+            values.append(proba)
+            roots.append(offset)
+            offset += n
+
+        forest = cls(
+            np.concatenate(features),
+            np.concatenate(thresholds),
+            np.concatenate(children),
+            np.concatenate(values),
+            roots,
+            classes,
+        )
+        n_features = num_inputs or getattr(estimator, "n_features_in_", None)
+        if n_features is not None:
+            forest.num_inputs = int(n_features)
+        return forest
+
+    def fold_scaler(self, mean, scale):
+        """
+        Return a forest whose thresholds apply to unscaled features
+
+        (x - mean) / scale <= t is the same test as x <= t * scale + mean,
+        so a StandardScaler in front of the forest is absorbed into the
+        thresholds; predictions agree up to rounding at the thresholds.
+
+        Parameters
+        ----------
+        mean, scale : array_like
+            (num_inputs,) StandardScaler mean_ and scale_
+        """
+        if self.scaler_folded:
+            raise ValueError("Forest already includes a scaler")
+        mean = np.asarray(mean, dtype=np.float64)
+        scale = np.asarray(scale, dtype=np.float64)
+        f = self.feature
+        threshold = np.where(np.isinf(self.threshold), np.inf, self.threshold * scale[f] + mean[f])
+        forest = FlatForest(self.feature, threshold, self.children, self.value, self.roots, self.classes, True)
+        forest.num_inputs = self.num_inputs
+        return forest
+
+    def to_arrays(self):
+        """Arrays describing the forest, as stored by save()"""
+        return {
+            "kind": np.array(self.kind),
+            "feature": self.feature.astype(np.int32),
+            "threshold": self.threshold,
+            "children": self.children.astype(np.int32),
+            "value": self.value,
+            "roots": self.roots.astype(np.int32),
+            "classes": self.classes,
+            "num_inputs": np.array(self.num_inputs),
+            "scaler_folded": np.array(self.scaler_folded),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Build a forest from arrays returned by to_arrays() or an open .npz file"""
+        forest = cls(
+            arrays["feature"],
+            arrays["threshold"],
+            arrays["children"],
+            arrays["value"],
+            arrays["roots"],
+            arrays["classes"],
+            bool(arrays["scaler_folded"]),
+        )
+        forest.num_inputs = int(arrays["num_inputs"])
+        return forest
+
+    def save(self, path: str):
+        """Save the forest to a .npz file"""
+        np.savez(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a forest saved with save()"""
+        with np.load(path) as f:
+            return cls.from_arrays(f)
+
+    def leaves(self, x):
+        """
+        Leaf reached in every tree
+
+        Parameters
+        ----------
+        x : array_like
+            (N, num_inputs) batch
+
+        Returns
+        -------
+        np.ndarray
+            (N, num_trees) node indices
+        """
+        # Compare in float32 like sklearn does, against float64 thresholds
+        x = np.asarray(x, dtype=np.float32)
+        rows = np.arange(len(x))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(x), self.num_trees))
+        for _ in range(self.depth):
+            go_right = x[rows, self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children[nodes, go_right.view(np.int8)]
+        return nodes
+
+    def predict(self, x):
+        """
+        Class probabilities of one sample or a batch of samples
+
+        Parameters
+        ----------
+        x : array_like
+            (num_inputs,) sample or (N, num_inputs) batch
+
+        Returns
+        -------
+        np.ndarray
+            (num_outputs,) or (N, num_outputs) probabilities averaged over
+            the trees
+        """
+        x = np.asarray(x, dtype=np.float32)
+        out = self.value[self.leaves(np.atleast_2d(x))].mean(axis=1)
+        return out[0] if x.ndim == 1 else out
+
+    def predict_label(self, x):
+        """Most likely class of one sample or a batch of samples"""
+        return np.argmax(self.predict(x), axis=-1)
+
+
+def export_sklearn(model_path: str, out_path: str, scaler_path: str = None):
+    """
+    Export a joblib-pickled sklearn forest to a .npz file for FlatForest
+
+    Parameters
+    ----------
+    model_path : str
+        joblib file with a fitted forest
+    out_path : str
+        Output .npz file
+    scaler_path : str
+        Optional joblib file with the StandardScaler used in training; it
+        is folded into the thresholds
+    """
+    from joblib import load
+
+    forest = FlatForest.from_sklearn(load(model_path))
+    if scaler_path is not None:
+        scaler = load(scaler_path)
+        forest = forest.fold_scaler(scaler.mean_, scaler.scale_)
+    forest.save(out_path)
+    return forest
+
+
+if __name__ == "__main__":
+    # fmt: off
+    parser = argparse.ArgumentParser(description="Export an sklearn forest for the NumPy inference runtime")
+    parser.add_argument("model", type=str, help="joblib file with a fitted RandomForestClassifier")
+    parser.add_argument("-o", "--output", type=str, required=True, help="Output .npz file")
+    parser.add_argument("-s", "--scaler", type=str, default=None, help="StandardScaler joblib file to fold into the thresholds")
+    args = parser.parse_args()
+    # fmt: on
+
+    forest = export_sklearn(args.model, args.output, scaler_path=args.scaler)
+    print(
+        "Exported {} trees ({} nodes, depth {}){} to {}".format(
+            forest.num_trees,
+            len(forest.feature),
+            forest.depth,
+            " with folded scaler" if forest.scaler_folded else "",
+            args.output,
+        )
+    )
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class BoardGeometry:
+    """
+    Layout of the magnetometers on a ReSkin board.
+
+    The board frame has x pointing right and y pointing up when the board
+    is viewed from the top, with z along the magnetometer z axis. Chip
+    positions are given in this frame in units of the chip pitch.
+
+    Attributes
+    ----------
+    positions : np.ndarray
+        (num_mags, 2) chip positions in the board frame
+    rotations : np.ndarray
+        (num_mags, 3, 3) matrices taking a chip's (Bx, By, Bz) reading to
+        the board frame
+    names : list
+        Chip names, in the order chips appear in the data stream
+
+    Methods
+    -------
+    process(block):
+        Rotate a block of readings from the chip frames to the board frame
+    """
+
+    def __init__(self, positions, rotations, names=None):
+        self.positions = np.asarray(positions, dtype=float)
+        self.rotations = np.asarray(rotations, dtype=float)
+        if self.positions.ndim != 2 or self.positions.shape[1] != 2:
+            raise ValueError("positions must have shape (num_mags, 2)")
+        if self.rotations.shape != (self.positions.shape[0], 3, 3):
+            raise ValueError("rotations must have shape (num_mags, 3, 3)")
+        if names is None:
+            names = [str(m) for m in range(self.num_mags)]
+        self.names = list(names)
+
+    @property
+    def num_mags(self):
+        return self.positions.shape[0]
+
+    def process(self, block):
+        """
+        Rotate a block of readings from the chip frames to the board frame
+
+        Parameters
+        ----------
+        block : array_like
+            Readings of shape (N, num_mags, 3), or (N, 3 * num_mags) with
+            the axes of each chip next to each other (Bx0, By0, Bz0, Bx1...).
+            The output has the same shape as the input.
+        """
+        block = np.asarray(block, dtype=float)
+        mags = block.reshape(block.shape[0], self.num_mags, 3)
+        rotated = np.einsum("mij,nmj->nmi", self.rotations, mags)
+        return rotated.reshape(block.shape)
+
+    __call__ = process
+
+    def inverse(self):
+        """Return the geometry mapping board frame readings back to chip frames"""
+        return BoardGeometry(
+            self.positions, np.transpose(self.rotations, (0, 2, 1)), self.names
+        )
+
+
+def _rot_z(quarter_turns):
+    c, s = [(1, 0), (0, 1), (-1, 0), (0, -1)][quarter_turns % 4]
+    return [[c, -s, 0], [s, c, 0], [0, 0, 1]]
+
+
+# 5X board; chips are in the order they appear in the data stream
+FIVE_X_BOARD = BoardGeometry(
+    positions=[[0, 0], [0, 1], [1, 0], [0, -1], [-1, 0]],
+    rotations=[_rot_z(2), _rot_z(2), _rot_z(-1), _rot_z(1), _rot_z(0)],
+    names=["center", "top", "right", "bottom", "left"],
+)
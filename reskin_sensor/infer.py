@@ -0,0 +1,410 @@
+import argparse
+
+import numpy as np
+
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _softmax(x):
+    x = x - np.max(x, axis=-1, keepdims=True)
+    np.exp(x, out=x)
+    x /= np.sum(x, axis=-1, keepdims=True)
+    return x
+
+
+def _linear(x):
+    return x
+
+
+WEIGHT_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize_weights(w, dtype: str):
+    """
+    Quantize a weight matrix for storage
+
+    Returns
+    -------
+    q : np.ndarray
+        Weights in the requested dtype
+    scale : np.ndarray or None
+        For int8, the (outputs,) scale of every column, chosen so that the
+        largest weight of the column maps to 127; None otherwise
+    """
+    if dtype == "float32":
+        return w.astype(np.float32), None
+    if dtype == "float16":
+        return w.astype(np.float16), None
+    if dtype == "int8":
+        scale = np.max(np.abs(w), axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        q = np.clip(np.round(w / scale), -127, 127).astype(np.int8)
+        return q, scale.astype(np.float32)
+    raise ValueError("Unsupported weight dtype {}; use one of {}".format(dtype, WEIGHT_DTYPES))
+
+
+def dequantize_weights(q, scale=None):
+    """Inverse of quantize_weights, returning float32 weights"""
+    w = q.astype(np.float32)
+    if scale is not None:
+        w *= scale
+    return w
+
+
+ACTIVATIONS = {
+    "relu": _relu,
+    "tanh": np.tanh,
+    "sigmoid": _sigmoid,
+    "softmax": _softmax,
+    "linear": _linear,
+}
+
+
+class DenseNetwork:
+    """
+    NumPy runtime for fully connected classifiers exported from keras.
+
+    Attributes
+    ----------
+    weights : list
+        (inputs, outputs) kernel of every layer
+    biases : list
+        (outputs,) bias of every layer
+    activations : list
+        Activation name of every layer
+    scaler_folded : bool
+        Whether feature standardisation is part of the first layer, in which
+        case the network takes unscaled features
+    weight_dtype : str
+        Precision the weights were stored with; weights are always
+        evaluated in float32
+
+    Methods
+    -------
+    predict(x):
+        Class probabilities of one sample or a batch of samples
+    predict_label(x):
+        Most likely class of one sample or a batch of samples
+    fold_scaler(mean, scale):
+        Return a network that standardises its input in the first layer
+    quantized(dtype):
+        Return the network as it would be after storing it with dtype
+    """
+
+    kind = "dense"
+
+    def __init__(self, weights, biases, activations, scaler_folded=False, weight_dtype="float32"):
+        if not len(weights) == len(biases) == len(activations):
+            raise ValueError("Need one bias and one activation per weight matrix")
+        for a in activations:
+            if a not in ACTIVATIONS:
+                raise ValueError("Unsupported activation {}".format(a))
+        self.weights = [np.ascontiguousarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.ascontiguousarray(b, dtype=np.float32) for b in biases]
+        self.activations = list(activations)
+        self.scaler_folded = scaler_folded
+        self.weight_dtype = weight_dtype
+        self._layers = [
+            (w, b, ACTIVATIONS[a]) for w, b, a in zip(self.weights, self.biases, self.activations)
+        ]
+
+    @property
+    def num_inputs(self):
+        return self.weights[0].shape[0]
+
+    @property
+    def num_outputs(self):
+        return self.weights[-1].shape[1]
+
+    @classmethod
+    def from_keras(cls, model):
+        """
+        Build a network from a keras Sequential model
+
+        Dense layers are converted; Dropout and InputLayer are skipped
+        since they do nothing at inference time.
+        """
+        weights, biases, activations = [], [], []
+        for layer in model.layers:
+            kind = type(layer).__name__
+            if kind in ("Dropout", "InputLayer"):
+                continue
+            if kind != "Dense":
+                raise ValueError("Cannot export layer {} of type {}".format(layer.name, kind))
+            kernel, bias = layer.get_weights()
+            weights.append(kernel)
+            biases.append(bias)
+            activation = layer.get_config()["activation"]
+            if not isinstance(activation, str):
+                raise ValueError("Cannot export custom activation of layer {}".format(layer.name))
+            activations.append(activation)
+        return cls(weights, biases, activations)
+
+    def fold_scaler(self, mean, scale):
+        """
+        Return a network that standardises its input in the first layer
+
+        Since (x - mean) / scale @ W + b == x @ (W / scale) + (b - mean / scale @ W),
+        a StandardScaler in front of the network can be absorbed into the
+        first layer, so a prediction is a single chain of affine layers.
+
+        Parameters
+        ----------
+        mean, scale : array_like
+            (num_inputs,) StandardScaler mean_ and scale_
+        """
+        if self.scaler_folded:
+            raise ValueError("Network already includes a scaler")
+        mean = np.asarray(mean, dtype=np.float64)
+        scale = np.asarray(scale, dtype=np.float64)
+        w0 = self.weights[0].astype(np.float64)
+        weights = [w0 / scale[:, None]] + self.weights[1:]
+        biases = [self.biases[0] - (mean / scale) @ w0] + self.biases[1:]
+        return DenseNetwork(weights, biases, self.activations, True, self.weight_dtype)
+
+    def quantized(self, dtype: str):
+        """Return the network as it would be after storing it with dtype"""
+        weights = [dequantize_weights(*quantize_weights(w, dtype)) for w in self.weights]
+        return DenseNetwork(weights, self.biases, self.activations, self.scaler_folded, dtype)
+
+    def to_arrays(self, dtype: str = None):
+        """
+        Arrays describing the network, as stored by save()
+
+        Parameters
+        ----------
+        dtype : str
+            Weight precision: float32, float16 or int8 (per-column
+            symmetric). Biases are always kept in float32. Defaults to the
+            precision the network was loaded with.
+        """
+        dtype = dtype or self.weight_dtype
+        arrays = {
+            "activations": np.array(self.activations),
+            "scaler_folded": np.array(self.scaler_folded),
+            "weight_dtype": np.array(dtype),
+        }
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            q, scale = quantize_weights(w, dtype)
+            arrays["W{}".format(i)] = q
+            if scale is not None:
+                arrays["W{}_scale".format(i)] = scale
+            arrays["b{}".format(i)] = b
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Build a network from arrays returned by to_arrays() or an open .npz file"""
+        keys = set(arrays.keys())
+        activations = [str(a) for a in arrays["activations"]]
+        weights = [
+            dequantize_weights(
+                arrays["W{}".format(i)],
+                arrays["W{}_scale".format(i)] if "W{}_scale".format(i) in keys else None,
+            )
+            for i in range(len(activations))
+        ]
+        biases = [arrays["b{}".format(i)] for i in range(len(activations))]
+        scaler_folded = bool(arrays["scaler_folded"]) if "scaler_folded" in keys else False
+        weight_dtype = str(arrays["weight_dtype"]) if "weight_dtype" in keys else "float32"
+        return cls(weights, biases, activations, scaler_folded, weight_dtype)
+
+    def save(self, path: str, dtype: str = None):
+        """
+        Save the network to a .npz file
+
+        Parameters
+        ----------
+        path : str
+            Output file
+        dtype : str
+            Weight precision; see to_arrays
+        """
+        np.savez(path, **self.to_arrays(dtype))
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a network saved with save()"""
+        with np.load(path) as f:
+            return cls.from_arrays(f)
+
+    def predict(self, x):
+        """
+        Class probabilities of one sample or a batch of samples
+
+        Parameters
+        ----------
+        x : array_like
+            (num_inputs,) sample or (N, num_inputs) batch
+
+        Returns
+        -------
+        np.ndarray
+            (num_outputs,) or (N, num_outputs) outputs of the last layer
+        """
+        x = np.asarray(x, dtype=np.float32)
+        for w, b, activation in self._layers:
+            x = activation(x @ w + b)
+        return x
+
+    def predict_label(self, x):
+        """Most likely class of one sample or a batch of samples"""
+        return np.argmax(self.predict(x), axis=-1)
+
+
+class KerasPredictor:
+    """
+    Wraps a keras model so it can be used in place of a DenseNetwork.
+
+    TensorFlow is only imported when this class is instantiated.
+    """
+
+    scaler_folded = False
+
+    def __init__(self, path: str):
+        from tensorflow.keras.models import load_model
+
+        self.model = load_model(path)
+
+    def predict(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        out = self.model.predict(np.atleast_2d(x), verbose=0)
+        return out[0] if x.ndim == 1 else out
+
+    def predict_label(self, x):
+        return np.argmax(self.predict(x), axis=-1)
+
+
+def load_predictor(path: str):
+    """
+    Load a classifier for inference
+
+    Parameters
+    ----------
+    path : str
+        A model bundle (.reskin) or a .npz file exported with export_keras
+        or forest.export_sklearn, all evaluated with NumPy, or a keras model
+        file, which requires TensorFlow
+    """
+    if path.endswith(".reskin"):
+        from .bundle import ModelBundle
+
+        return ModelBundle.load(path)
+    if path.endswith(".npz"):
+        with np.load(path) as f:
+            if "kind" in f.files and str(f["kind"]) == "forest":
+                from .forest import FlatForest
+
+                return FlatForest.from_arrays(f)
+            return DenseNetwork.from_arrays(f)
+    return KerasPredictor(path)
+
+
+def export_keras(model_path: str, out_path: str, scaler_path: str = None, dtype: str = "float32"):
+    """
+    Export a keras model file to a .npz file for the NumPy runtime
+
+    Parameters
+    ----------
+    model_path : str
+        Keras model file
+    out_path : str
+        Output .npz file
+    scaler_path : str
+        Optional joblib file with the StandardScaler used in training; it
+        is folded into the first layer
+    dtype : str
+        Weight precision: float32, float16 or int8
+    """
+    from tensorflow.keras.models import load_model
+
+    network = DenseNetwork.from_keras(load_model(model_path))
+    if scaler_path is not None:
+        from joblib import load
+
+        scaler = load(scaler_path)
+        network = network.fold_scaler(scaler.mean_, scaler.scale_)
+    network.save(out_path, dtype=dtype)
+    return network
+
+
+def quantization_report(network, X, y, dtypes=WEIGHT_DTYPES):
+    """
+    Accuracy of a network stored with different weight precisions
+
+    Parameters
+    ----------
+    network : DenseNetwork
+        Full precision network
+    X : array_like
+        (N, num_inputs) held-out features, scaled as the network expects
+    y : array_like
+        (N,) held-out labels
+    dtypes : iterable
+        Weight precisions to compare
+
+    Returns
+    -------
+    dict
+        For every dtype, the accuracy, the accuracy drop relative to the
+        full precision network, and the fraction of predictions that agree
+        with it
+    """
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    reference = network.predict_label(X)
+    reference_acc = float(np.mean(reference == y))
+    report = {}
+    for dtype in dtypes:
+        pred = network.quantized(dtype).predict_label(X)
+        acc = float(np.mean(pred == y))
+        report[dtype] = {
+            "accuracy": acc,
+            "accuracy_drop": reference_acc - acc,
+            "agreement": float(np.mean(pred == reference)),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    # fmt: off
+    parser = argparse.ArgumentParser(description="Export a keras classifier for the NumPy inference runtime")
+    parser.add_argument("model", type=str, help="Keras model file")
+    parser.add_argument("-o", "--output", type=str, required=True, help="Output .npz file")
+    parser.add_argument("-s", "--scaler", type=str, default=None, help="StandardScaler joblib file to fold into the first layer")
+    parser.add_argument("--dtype", type=str, default="float32", choices=WEIGHT_DTYPES, help="Weight precision")
+    parser.add_argument("--eval", type=str, nargs="+", default=None, help="Held-out CSV files or datasets for an accuracy report")
+    args = parser.parse_args()
+    # fmt: on
+
+    network = export_keras(args.model, args.output, scaler_path=args.scaler, dtype=args.dtype)
+    print(
+        "Exported {} layers ({} -> {}) with {} weights{} to {}".format(
+            len(network.weights),
+            network.num_inputs,
+            network.num_outputs,
+            args.dtype,
+            " and folded scaler" if network.scaler_folded else "",
+            args.output,
+        )
+    )
+
+    if args.eval is not None:
+        from .loader import load_training_data
+
+        held_out = load_training_data(args.eval)
+        X = held_out.X
+        if not network.scaler_folded:
+            print("Warning: evaluating on unscaled features; pass --scaler")
+        for dtype, result in quantization_report(network, X, held_out.y).items():
+            print(
+                "{:>8}: accuracy {:.4f} (drop {:+.4f}), agreement {:.4f}".format(
+                    dtype, result["accuracy"], result["accuracy_drop"], result["agreement"]
+                )
+            )
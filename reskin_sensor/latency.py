@@ -0,0 +1,552 @@
+"""
+End-to-end latency from byte arrival to displayed prediction.
+
+    python -m reskin_sensor.latency -o latency.json
+    python -m reskin_sensor.latency --backends thread --batches 16 -m model.reskin
+
+A SensorEmulator streams the frames of a simulated board into a pseudo
+terminal, with presses at scripted times. The stream under test reads the
+other end like a real serial port. Every frame carries its index in place
+of the first chip's temperature, so every sample can be traced through the
+pipeline. For every press, the harness records when each stage first saw
+it:
+
+- decode: the reader finished decoding the first frame of the press
+- publish: the frame became visible in the stream's sample ring
+- consume: the InferenceWorker read the frame
+- detection: the ContactDetector confirmed the press
+- inference: the worker published a prediction made during the contact
+- display: a display loop redrawing at a fixed rate first showed it
+
+Latencies are measured from the time the first frame of the press was
+written to the port. They are reported as percentiles per stage for every
+combination of stream backend (ReSkinProcess, or SerialSource in a thread
+of this process), worker batch size and model. Presses are steps, so
+detection adds only the detector's min_duration samples to the pipeline.
+"""
+import argparse
+import json
+import os
+import pty
+import sys
+import threading
+import time
+import tty
+
+import numpy as np
+
+from .benchmark import default_models, environment, summarize
+from .calibration import calibrate
+from .contact import ContactDetector
+from .sources import SerialSource, random_presses
+from .sensor_proc import ReSkinProcess
+from .worker import InferenceWorker
+
+STAGES = ("decode", "publish", "consume", "detection", "inference", "display")
+BACKENDS = ("process", "thread")
+# Frame indices wrap around here, below the largest integer float32 holds exactly
+FRAME_INDEX_MODULUS = 1 << 24
+
+
+class SensorEmulator:
+    """
+    A board streaming burst-mode frames to a pseudo terminal.
+
+    Readings rest at random baselines with Gaussian noise. During a scripted
+    press the z field of the pressed chip steps by the press amplitude, and
+    that of its neighbours by a third as much, so every press starts at one
+    known frame. The temperature channel of the first chip carries the index
+    of the frame, modulo FRAME_INDEX_MODULUS, instead of a temperature.
+
+    Frames are written as they fall due, every block_interval. If the
+    reader falls behind and the terminal's buffer fills up, the rest is
+    kept and written later, as a board's USB stack would.
+
+    Attributes
+    ----------
+    port : str
+        Path of the pseudo terminal to open as the board's serial port
+    presses : list
+        Scripted presses, as sources.Press, starting after start_time
+    start_time : float
+        Wall-clock time frame 0 fell due, once started
+    num_frames : int
+        Number of frames written completely
+
+    Methods
+    -------
+    start():
+        Start writing frames in a background thread
+    stop():
+        Stop writing frames and close the terminal
+    onset_frame(press):
+        Index of the first frame of a press
+    arrival_time(frames):
+        Time at which the writes completing the given frames started
+    """
+
+    def __init__(
+        self,
+        num_mags: int = 5,
+        rate: float = 1000.0,
+        presses=None,
+        noise: float = 2.0,
+        seed: int = None,
+        block_interval: float = 0.001,
+        record_arrivals: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        record_arrivals : bool
+            Keep the write time of every frame for arrival_time; turn off
+            for long runs, where the record would grow without bound
+        """
+        self.num_mags = num_mags
+        self.rate = rate
+        self.presses = sorted(presses or [], key=lambda press: press.start)
+        self.noise = noise
+        self.block_interval = block_interval
+        self.record_arrivals = record_arrivals
+        self.start_time = None
+        self.num_frames = 0
+
+        self._num_floats = 4 * num_mags
+        self._rng = np.random.default_rng(seed)
+        self._baseline = self._rng.uniform(-300, 300, size=self._num_floats)
+        self._starts = np.array([press.start for press in self.presses], dtype=float)
+        self._ends = np.array([press.start + press.duration for press in self.presses], dtype=float)
+        # Change of every channel during each press
+        self._deltas = np.zeros((len(self.presses), self._num_floats))
+        for i, press in enumerate(self.presses):
+            for chip in range(num_mags):
+                weight = 1.0 if chip == press.chip else (1 / 3 if abs(chip - press.chip) == 1 else 0.0)
+                self._deltas[i, 4 * chip + 3] = weight * press.amplitude
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self._written = [0]
+        self._write_times = [np.nan]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start writing frames in a background thread"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop writing frames and close the terminal"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def onset_frame(self, press):
+        """Index of the first frame of a press"""
+        return int(np.ceil(press.start * self.rate - 1e-9))
+
+    def arrival_time(self, frames):
+        """
+        Time at which the writes completing the given frames started, NaN
+        for frames not written yet
+        """
+        written = np.array(self._written)
+        times = np.array(self._write_times + [np.nan])
+        return times[np.searchsorted(written, np.asarray(frames), side="right")]
+
+    def _frames(self, start, stop):
+        idx = np.arange(start, stop)
+        t = idx / self.rate
+        values = self._baseline + self._rng.normal(0, self.noise, size=(idx.shape[0], self._num_floats))
+        if self.presses:
+            press = np.searchsorted(self._starts, t, side="right") - 1
+            active = (press >= 0) & (t < self._ends[np.maximum(press, 0)])
+            values[active] += self._deltas[press[active]]
+        values[:, 0] = idx % FRAME_INDEX_MODULUS
+        frames = np.empty((idx.shape[0], 4 * self._num_floats + 2), dtype=np.uint8)
+        frames[:, :-2] = values.astype(np.float32).view(np.uint8)
+        frames[:, -2:] = (13, 10)
+        return frames.tobytes()
+
+    def _run(self):
+        frame_length = 4 * self._num_floats + 2
+        pending = bytearray()
+        scheduled = 0
+        sent = 0
+        self.start_time = time.time()
+        while not self._stop.is_set():
+            due = int((time.time() - self.start_time) * self.rate) + 1
+            if due > scheduled:
+                pending += self._frames(scheduled, due)
+                scheduled = due
+            if pending:
+                before = time.time()
+                try:
+                    n = os.write(self._master, pending)
+                except BlockingIOError:
+                    n = 0
+                del pending[:n]
+                sent += n
+                if sent // frame_length > self.num_frames:
+                    self.num_frames = sent // frame_length
+                    if self.record_arrivals:
+                        self._written.append(self.num_frames)
+                        self._write_times.append(before)
+            time.sleep(self.block_interval)
+
+
+class _TracedStream:
+    """Passes reads on to a stream, recording every block read and when"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.blocks = []
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def read_since(self, seq, max_samples=None):
+        rows, next_seq = self.stream.read_since(seq, max_samples)
+        if len(rows):
+            # Time, sequence number of the first row, and [time, acq_delay, frame] of every row
+            self.blocks.append((time.time(), next_seq - len(rows), np.array(rows[:, :3])))
+        return rows, next_seq
+
+
+class _TracedDetector:
+    """Passes blocks on to a ContactDetector, recording when contacts are confirmed"""
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.onsets = []
+
+    @property
+    def in_contact(self):
+        return self.detector.in_contact
+
+    @property
+    def contact_flags(self):
+        return self.detector.contact_flags
+
+    def process(self, block, times=None):
+        events = self.detector.process(block, times)
+        if any(event.kind == "start" for event in events):
+            self.onsets.append(time.time())
+        return events
+
+
+class _TracedClassifier:
+    """
+    Classifies with a model, recording when the first result of every contact is ready
+
+    The worker only classifies samples in contact, so the first call after
+    the detector confirmed a contact produces its first result.
+    """
+
+    def __init__(self, model, detector):
+        self.model = model
+        self.detector = detector
+        self.onsets = []
+
+    def __call__(self, features):
+        probabilities = self.model.predict(features.astype(np.float32))
+        if len(self.onsets) < len(self.detector.onsets):
+            self.onsets.append(time.time())
+        return probabilities
+
+
+class _Poller:
+    """Calls a function every interval seconds in a background thread"""
+
+    def __init__(self, fn, interval: float):
+        self.fn = fn
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        due = time.time()
+        while not self._stop.is_set():
+            self.fn()
+            due += self.interval
+            time.sleep(max(due - time.time(), 0))
+
+
+def open_stream(backend: str, port: str, num_mags: int, ring_size: int = 4096):
+    """A started stream of the given backend reading a board on port"""
+    if backend == "process":
+        stream = ReSkinProcess(num_mags=num_mags, port=port, burst_mode=True, ring_size=ring_size)
+    elif backend == "thread":
+        stream = SerialSource(port, num_mags=num_mags, burst_mode=True, ring_size=ring_size)
+    else:
+        raise ValueError("Unknown backend {!r}, expected one of {}".format(backend, BACKENDS))
+    stream.start()
+    return stream
+
+
+def _first_after(times, start, stop):
+    """First of the sorted times in [start, stop), NaN if none"""
+    times = np.asarray(times, dtype=float)
+    i = np.searchsorted(times, start, side="left")
+    return times[i] if i < times.shape[0] and times[i] < stop else np.nan
+
+
+def measure(
+    backend: str,
+    model,
+    max_batch: int = 1024,
+    num_mags: int = 5,
+    rate: float = 1000.0,
+    duration: float = 20.0,
+    interval: float = 0.4,
+    press_duration: float = 0.2,
+    amplitude: float = 400.0,
+    warmup: float = 2.0,
+    fps: float = 33.0,
+    probe_interval: float = 0.0005,
+    k_on: float = 10.0,
+    seed: int = 0,
+):
+    """
+    Latency of every stage for presses streamed through one configuration
+
+    Parameters
+    ----------
+    backend : str
+        "process" for ReSkinProcess, "thread" for SerialSource
+    model : object
+        Classifier with predict(x), e.g. from default_models or
+        infer.load_predictor
+    max_batch : int
+        Batch size limit of the InferenceWorker
+    duration : float
+        Seconds of scripted presses, after warmup seconds used to calibrate
+    interval, press_duration, amplitude : float
+        Press schedule; see sources.random_presses
+    fps : float
+        Rate of the display loop
+    probe_interval : float
+        Seconds between checks of the stream's sample count, which time the
+        publish stage
+
+    Returns
+    -------
+    dict
+        Per stage, the summary of the latencies in microseconds and the
+        number of presses it missed; and the frames written, samples
+        streamed and samples the worker dropped
+    """
+    presses = [
+        press._replace(start=press.start + warmup)
+        for press in random_presses(duration, num_mags, interval, press_duration, amplitude, seed)
+    ]
+    emulator = SensorEmulator(num_mags, rate, presses, seed=seed).start()
+    stream = open_stream(backend, emulator.port, num_mags, ring_size=max(4096, int(rate * warmup)))
+    pollers = []
+    worker = None
+    try:
+        deadline = time.time() + 10.0
+        while stream.sample_cnt == 0:
+            if time.time() > deadline:
+                raise RuntimeError("No samples from the {} backend on {}".format(backend, emulator.port))
+            time.sleep(0.01)
+
+        # Calibrate on the second half of the warmup
+        time.sleep(max(emulator.start_time + warmup - 0.05 - time.time(), 0))
+        count = stream.sample_cnt
+        rows, _ = stream.read_since(max(count - int(rate * warmup / 2), 0))
+        calibration = calibrate(rows[:, 2:])
+
+        traced = _TracedStream(stream)
+        detector = _TracedDetector(
+            ContactDetector.from_calibration(calibration, num_mags, k_on=k_on, k_off=k_on / 2)
+        )
+        classifier = _TracedClassifier(model, detector)
+        worker = InferenceWorker(traced, classifier, calibration.mean, num_mags, detector=detector, max_batch=max_batch)
+
+        publish_times, publish_counts = [], []
+
+        def probe():
+            count = stream.sample_cnt
+            if not publish_counts or count != publish_counts[-1]:
+                publish_times.append(time.time())
+                publish_counts.append(count)
+
+        display_onsets = []
+        shown = [False]
+
+        def redraw():
+            prediction = worker.latest
+            in_contact = prediction is not None and prediction.in_contact
+            if in_contact and not shown[0]:
+                display_onsets.append(time.time())
+            shown[0] = in_contact
+
+        pollers = [_Poller(probe, probe_interval).start(), _Poller(redraw, 1 / fps).start()]
+        worker.start()
+        time.sleep(max(emulator.start_time + warmup + duration + 0.5 - time.time(), 0))
+    finally:
+        for poller in pollers:
+            poller.stop()
+        if worker is not None:
+            worker.stop()
+        frames_written = emulator.num_frames
+        samples_streamed = stream.sample_cnt
+        stream.join(1.0)
+        if backend == "process" and stream.is_alive():
+            stream.terminate()
+        emulator.stop()
+
+    onset_frames = np.array([emulator.onset_frame(press) for press in presses])
+    starts = emulator.arrival_time(onset_frames)
+    stops = np.append(starts[1:], np.inf)
+    written = np.isfinite(starts)
+    starts, stops, onset_frames = starts[written], stops[written], onset_frames[written]
+
+    if traced.blocks:
+        read_times = np.concatenate([np.full(len(rows), t) for t, _, rows in traced.blocks])
+        seqs = np.concatenate([seq + np.arange(len(rows)) for _, seq, rows in traced.blocks])
+        rows = np.concatenate([rows for _, _, rows in traced.blocks])
+        steps = np.diff(rows[:, 2]) % FRAME_INDEX_MODULUS
+        rows[1:, 2] = rows[0, 2] + np.cumsum(steps)
+    else:
+        read_times, seqs, rows = np.empty(0), np.empty(0, dtype=int), np.empty((0, 3))
+    # First sample read at or after the onset of every press, if before the next one
+    idx = np.searchsorted(rows[:, 2], onset_frames, side="left")
+    found = idx < rows.shape[0]
+    found[found] = rows[idx[found], 2] < np.append(onset_frames[1:], np.inf)[found]
+    idx = np.minimum(idx, max(rows.shape[0] - 1, 0))
+
+    times = {stage: np.full(starts.shape[0], np.nan) for stage in STAGES}
+    if rows.shape[0]:
+        times["decode"][found] = rows[idx[found], 0] + rows[idx[found], 1]
+        probe_at = np.searchsorted(publish_counts, seqs[idx[found]], side="right")
+        probe_times = np.append(publish_times, np.nan)
+        times["publish"][found] = probe_times[probe_at]
+        times["consume"][found] = read_times[idx[found]]
+    for stage, onsets in (("detection", detector.onsets), ("inference", classifier.onsets), ("display", display_onsets)):
+        times[stage] = np.array([_first_after(onsets, a, b) for a, b in zip(starts, stops)])
+
+    stages = {}
+    for stage in STAGES:
+        latency = times[stage] - starts
+        stages[stage] = summarize(latency[np.isfinite(latency)])
+        stages[stage]["missed"] = int(np.sum(~np.isfinite(latency)))
+    return {
+        "presses": int(starts.shape[0]),
+        "frames_written": int(frames_written),
+        "samples_streamed": int(samples_streamed),
+        "worker_dropped": int(worker.num_dropped) if worker is not None else 0,
+        "stages": stages,
+    }
+
+
+def run(backends=BACKENDS, batch_sizes=(1, 1024), models=None, **kwargs):
+    """
+    Measure every combination of backend, batch size and model
+
+    Parameters
+    ----------
+    models : dict
+        Name to classifier; defaults to benchmark.default_models
+    kwargs
+        Passed on to measure
+    """
+    num_mags = kwargs.get("num_mags", 5)
+    if models is None:
+        models = default_models(num_inputs=3 * num_mags)
+    results = {}
+    for backend in backends:
+        for batch in batch_sizes:
+            for name, model in models.items():
+                print("Measuring backend={} max_batch={} model={}".format(backend, batch, name))
+                result = measure(backend, model, max_batch=batch, **kwargs)
+                results.setdefault("backend=" + backend, {}).setdefault("max_batch={}".format(batch), {})[name] = result
+    return results
+
+
+def print_table(results):
+    """Print the median and tail latency of every stage, in milliseconds"""
+    print("{:10s} {:>16s} {:12s} {:10s} {:>6s} {:>8s} {:>8s} {:>8s}".format(
+        "backend", "batch", "model", "stage", "missed", "p50_ms", "p95_ms", "p99_ms"
+    ))
+    for backend, by_batch in results.items():
+        for batch, by_model in by_batch.items():
+            for name, result in by_model.items():
+                for stage, stats in result["stages"].items():
+                    if stats["n"] == 0:
+                        p50 = p95 = p99 = float("nan")
+                    else:
+                        p50, p95, p99 = (stats[key] / 1000 for key in ("p50_us", "p95_us", "p99_us"))
+                    print("{:10s} {:>16s} {:12s} {:10s} {:6d} {:8.2f} {:8.2f} {:8.2f}".format(
+                        backend.split("=")[1], batch.split("=")[1], name, stage, stats["missed"], p50, p95, p99
+                    ))
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(description="Measure the latency from byte arrival to displayed prediction")
+    parser.add_argument("-o", "--output", type=str, help="JSON file to write the results to", default="latency_results.json")
+    parser.add_argument("-n", "--num_mags", type=int, help="Number of magnetometers of the simulated board", default=5)
+    parser.add_argument("--rate", type=float, help="Frames per second sent by the simulated board", default=1000.0)
+    parser.add_argument("--backends", type=str, nargs="+", choices=BACKENDS, help="Stream backends to measure", default=BACKENDS)
+    parser.add_argument("--batches", type=int, nargs="+", help="Worker batch sizes (max_batch) to measure", default=[1, 1024])
+    parser.add_argument("--models", type=str, nargs="+", choices=("dense", "forest"), help="Synthetic models to measure", default=["dense", "forest"])
+    parser.add_argument("-m", "--model", type=str, nargs="+", help="Further models, as accepted by load_predictor", default=[])
+    parser.add_argument("--duration", type=float, help="Seconds of presses per configuration", default=20.0)
+    parser.add_argument("--interval", type=float, help="Seconds between press onsets", default=0.4)
+    parser.add_argument("--press_duration", type=float, help="Seconds every press lasts", default=0.2)
+    parser.add_argument("--fps", type=float, help="Redraw rate of the simulated display", default=33.0)
+    parser.add_argument("--k_on", type=float, help="Contact threshold of the detector, in units of the noise floor", default=10.0)
+    parser.add_argument("--seed", type=int, help="Seed of the press schedule and noise", default=0)
+    parser.add_argument("--quick", action="store_true", help="Shorter runs, for a quick check")
+    parser.add_argument("--label", type=str, help="Free-form label stored with the results, e.g. a branch name")
+    args = parser.parse_args()
+    # fmt: on
+
+    from .infer import load_predictor
+
+    synthetic = default_models(num_inputs=3 * args.num_mags)
+    models = {name: synthetic[name] for name in args.models}
+    models.update({os.path.basename(path): load_predictor(path) for path in args.model})
+    settings = {
+        "num_mags": args.num_mags,
+        "rate": args.rate,
+        "duration": 5.0 if args.quick else args.duration,
+        "interval": args.interval,
+        "press_duration": args.press_duration,
+        "fps": args.fps,
+        "k_on": args.k_on,
+        "seed": args.seed,
+    }
+    output = {
+        "label": args.label,
+        "environment": environment(),
+        "settings": settings,
+        "results": run(args.backends, args.batches, models, **settings),
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print("Results written to {}".format(args.output))
+    print_table(output["results"])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
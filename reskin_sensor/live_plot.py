@@ -0,0 +1,216 @@
+import numpy as np
+
+from .features import channel_names
+
+
+class HistoryBuffer:
+    """
+    The last `capacity` rows of a stream, readable as one contiguous view.
+
+    Every row is written twice, at its ring position and `capacity` rows
+    further, so the rows in the ring are always a contiguous slice of the
+    preallocated array, oldest first, and reading them never copies.
+
+    Methods
+    -------
+    extend(rows):
+        Append a block of rows
+    view():
+        (n, width) view of the stored rows, oldest first
+    """
+
+    def __init__(self, capacity: int, width: int, dtype=float):
+        self.capacity = capacity
+        self._data = np.zeros((2 * capacity, width), dtype=dtype)
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def extend(self, rows):
+        """Append a block of rows"""
+        rows = np.asarray(rows)[-self.capacity :]
+        n = rows.shape[0]
+        if n == 0:
+            return
+        idx = (self._head + np.arange(n)) % self.capacity
+        self._data[idx] = rows
+        self._data[idx + self.capacity] = rows
+        self._head = (self._head + n) % self.capacity
+        self._count = min(self._count + n, self.capacity)
+
+    def view(self):
+        """(n, width) view of the stored rows, oldest first"""
+        end = self._head + self.capacity
+        return self._data[end - self._count : end]
+
+
+class LivePlot:
+    """
+    Live line plots of a ReSkinProcess stream.
+
+    Every frame drains all samples streamed since the previous frame with
+    ReSkinProcess.read_since into a HistoryBuffer and points the lines at
+    views of it, so no sample is skipped and the cost of a frame depends on
+    the window length, not on the sample rate.
+
+    Attributes
+    ----------
+    names : list
+        Names of the streamed channels, e.g. T0, Bx0...
+    history : HistoryBuffer
+        The last `window` samples, baseline subtracted
+    lines : list
+        Lines updated every frame
+    num_dropped : int
+        Samples that were overwritten in the stream before they were drawn
+
+    Methods
+    -------
+    bind(line, name):
+        Update a line with a channel every frame
+    make_figure(layout, ylim, figsize):
+        Create a grid of axes with one channel per axis
+    poll():
+        Read the samples streamed since the last call
+    draw():
+        Point every line at the current history
+    animate(fig, interval, extra_update):
+        Start a blitted animation of the figure
+    """
+
+    def __init__(self, stream, num_mags: int, baseline=None, window: int = 1000):
+        """
+        Parameters
+        ----------
+        stream : ReSkinProcess
+            Sensor stream; drawing starts with the samples streamed next
+        num_mags : int
+            Number of magnetometers on the board
+        baseline : array_like
+            Value subtracted from every channel, e.g. from initialize_sensor
+        window : int
+            Number of samples shown
+        """
+        self.stream = stream
+        self.names = channel_names(num_mags, temp_filtered=stream.temp_filtered)
+        self.baseline = None if baseline is None else np.asarray(baseline, dtype=float)
+        self.window = window
+        self.history = HistoryBuffer(window, len(self.names))
+        self.lines = []
+        self.num_dropped = 0
+        self._columns = []
+        self._x = np.arange(window)
+        self._seq = stream.sample_cnt
+
+    def bind(self, line, name: str):
+        """Update a line with a channel every frame"""
+        self._columns.append(self.names.index(name))
+        self.lines.append(line)
+        return line
+
+    def make_figure(self, layout, ylim=(-1000, 1000), figsize=None):
+        """
+        Create a grid of axes with one channel per axis
+
+        Parameters
+        ----------
+        layout : list
+            Rows of channel names; None leaves an axis empty
+        ylim : tuple
+            Y-axis limits of every plot
+        figsize : tuple
+            Figure size; 5 x 4 inches per axis by default
+
+        Returns
+        -------
+        fig, axs
+            The figure and the (rows, columns) array of axes
+        """
+        import matplotlib.pyplot as plt
+
+        rows, cols = len(layout), max(len(row) for row in layout)
+        if figsize is None:
+            figsize = (5 * cols, 4 * rows)
+        fig, axs = plt.subplots(rows, cols, figsize=figsize, sharex=True, squeeze=False)
+        fig.subplots_adjust(hspace=0.4)
+        for i, row in enumerate(layout):
+            for j, name in enumerate(row):
+                if name is None:
+                    continue
+                ax = axs[i, j]
+                (line,) = ax.plot([], [], label=name)
+                self.bind(line, name)
+                ax.set_xlim(0, self.window)
+                ax.set_ylim(*ylim)
+                ax.set_title(name)
+                ax.legend(loc="upper right")
+        return fig, axs
+
+    def poll(self):
+        """
+        Read the samples streamed since the last call
+
+        Returns
+        -------
+        np.ndarray
+            (n, num_channels) new samples, baseline subtracted
+        """
+        rows, next_seq = self.stream.read_since(self._seq)
+        self.num_dropped += next_seq - len(rows) - self._seq
+        self._seq = next_seq
+        data = rows[:, 2:]
+        if self.baseline is not None:
+            data = data - self.baseline
+        self.history.extend(data)
+        return data
+
+    def draw(self):
+        """Point every line at the current history"""
+        view = self.history.view()
+        x = self._x[: len(view)]
+        for line, column in zip(self.lines, self._columns):
+            line.set_data(x, view[:, column])
+        return self.lines
+
+    def animate(self, fig, interval: int = 30, extra_update=None):
+        """
+        Start a blitted animation of the figure
+
+        Parameters
+        ----------
+        fig : Figure
+            Figure the lines belong to
+        interval : int
+            Milliseconds between frames
+        extra_update : callable
+            Called after every update with the new samples; returns a list
+            of further artists to redraw
+
+        Returns
+        -------
+        FuncAnimation
+            Keep a reference to it for as long as the plot is shown
+        """
+        import matplotlib.animation as animation
+
+        def init():
+            for line in self.lines:
+                line.set_data([], [])
+            return self.lines + (extra_update(None) if extra_update is not None else [])
+
+        def update(frame):
+            new = self.poll() if self.stream.is_alive() else None
+            artists = self.draw()
+            if extra_update is not None:
+                artists = artists + extra_update(new)
+            return artists
+
+        return animation.FuncAnimation(
+            fig, update, init_func=init, blit=True, interval=interval, save_count=50, cache_frame_data=False
+        )
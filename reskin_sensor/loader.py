@@ -0,0 +1,150 @@
+import collections
+import glob
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .dataset import MANIFEST_NAME, Dataset, read_csv
+
+DEFAULT_CACHE_DIR = ".reskin_cache"
+
+TrainingData = collections.namedtuple("TrainingData", "X, y, columns, key")
+
+
+def file_hash(path: str, block_size: int = 1 << 20):
+    """SHA-1 of the contents of a file"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _label_key(labels):
+    if labels is None:
+        return "all"
+    return "-".join(str(int(l)) for l in sorted(set(labels)))
+
+
+def _expand(source):
+    """Resolve a glob pattern, file, dataset directory or list of them"""
+    if isinstance(source, str):
+        source = [source]
+    paths = []
+    for pattern in source:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError("No files match {}".format(pattern))
+        paths.extend(matches)
+    return paths
+
+
+def _parse_filtered(path, labels, cache_path):
+    columns, X, y = read_csv(path)
+    if labels is not None:
+        keep = np.isin(y, list(labels))
+        X, y = X[keep], y[keep]
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, X=X, y=y, columns=np.array(columns))
+    os.replace(tmp_path, cache_path)
+    return columns, X, y
+
+
+def load_training_data(source, labels=None, cache_dir: str = DEFAULT_CACHE_DIR, workers: int = None):
+    """
+    Load features and labels from CSV files or datasets
+
+    CSV files are parsed once; the rows matching the label filter are
+    cached in cache_dir under the hash of the file contents and the filter,
+    so later calls only read the cached arrays. Files that are not cached
+    yet are parsed in parallel. Datasets (directories with a manifest) are
+    memory-mapped and only the chunks with matching labels are read.
+
+    Parameters
+    ----------
+    source : str or list
+        Glob patterns, CSV files written by collect_data.py, or dataset
+        directories
+    labels : iterable
+        Labels to keep; all labels if None
+    cache_dir : str
+        Directory for the parsed arrays
+    workers : int
+        Number of parsing processes; defaults to the number of CPUs
+
+    Returns
+    -------
+    TrainingData
+        Features X (float32), labels y, column names and a key identifying
+        the loaded contents, e.g. for caching things fit on them
+    """
+    paths = _expand(source)
+    label_key = _label_key(labels)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    parts = [None] * len(paths)
+    keys = []
+    misses = []
+    for i, path in enumerate(paths):
+        if os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            dataset = Dataset(path)
+            X, y = dataset.load(labels=labels)
+            parts[i] = (dataset.columns, X, y)
+            keys.append(file_hash(os.path.join(path, MANIFEST_NAME)))
+            continue
+        digest = file_hash(path)
+        keys.append(digest)
+        cache_path = os.path.join(cache_dir, "{}-{}.npz".format(digest, label_key))
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                parts[i] = (list(cached["columns"]), cached["X"], cached["y"])
+        else:
+            misses.append((i, path, cache_path))
+
+    if len(misses) == 1:
+        i, path, cache_path = misses[0]
+        parts[i] = _parse_filtered(path, labels, cache_path)
+    elif misses:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                (i, pool.submit(_parse_filtered, path, labels, cache_path))
+                for i, path, cache_path in misses
+            ]
+            for i, future in futures:
+                parts[i] = future.result()
+
+    columns = parts[0][0]
+    for path, part in zip(paths, parts):
+        if len(part[0]) != len(columns):
+            raise ValueError(
+                "{} has {} feature columns, expected {}".format(path, len(part[0]), len(columns))
+            )
+    X = np.concatenate([p[1] for p in parts]).astype(np.float32, copy=False)
+    y = np.concatenate([p[2] for p in parts]).astype(np.int64, copy=False)
+    key = hashlib.sha1((" ".join(keys) + " " + label_key).encode()).hexdigest()
+    return TrainingData(X=X, y=y, columns=columns, key=key)
+
+
+def cached_scaler(data, cache_dir: str = DEFAULT_CACHE_DIR):
+    """
+    Return a StandardScaler fit on the training data, reusing earlier fits
+
+    Parameters
+    ----------
+    data : TrainingData
+        Data returned by load_training_data
+    cache_dir : str
+        Directory the fit scaler is cached in
+    """
+    from joblib import dump, load
+    from sklearn.preprocessing import StandardScaler
+
+    cache_path = os.path.join(cache_dir, "scaler-{}.joblib".format(data.key))
+    if os.path.exists(cache_path):
+        return load(cache_path)
+    scaler = StandardScaler().fit(data.X)
+    os.makedirs(cache_dir, exist_ok=True)
+    dump(scaler, cache_path)
+    return scaler
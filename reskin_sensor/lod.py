@@ -0,0 +1,229 @@
+"""
+Level-of-detail summaries of long recordings.
+
+A recording saved as an (N, num_columns) .npy file is memory-mapped and
+summarised once into a pyramid of per-bin minima and maxima: the first
+level has one bin per `base` samples, every further level merges `factor`
+bins of the one below. The pyramid is cached next to the recording as
+<recording>.lod.npy plus a small <recording>.lod.json index, and rebuilt
+when the recording changes. Plotting the min/max envelope of the level
+matching the zoom draws the same picture as plotting every sample, from at
+most a few thousand points.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+LOD_VERSION = 1
+
+
+class MinMaxPyramid:
+    """
+    Min/max pyramid of a memory-mapped recording.
+
+    Attributes
+    ----------
+    data : np.memmap
+        (N, num_columns) recording
+    base : int
+        Samples per bin of the first level
+    factor : int
+        Bins merged into one from each level to the next
+    levels : list
+        (mins, maxs) of every level, finest first; each (num_bins, num_columns)
+
+    Methods
+    -------
+    query(start, stop, max_points):
+        Envelope of rows [start, stop) with at most max_points bins
+    bin_size(level):
+        Samples per bin of a level; level 0 is the raw data
+    """
+
+    def __init__(self, path: str, base: int = 64, factor: int = 4, min_bins: int = 1024, rebuild: bool = False):
+        """
+        Parameters
+        ----------
+        path : str
+            .npy recording, e.g. saved from ReSkinProcess.get_buffer
+        base : int
+            Samples per bin of the first level
+        factor : int
+            Bins merged into one from each level to the next
+        min_bins : int
+            Stop adding levels once a level has at most this many bins
+        rebuild : bool
+            Ignore an existing cache
+        """
+        if base < 2 or factor < 2:
+            raise ValueError("base and factor must be at least 2")
+        self.path = path
+        self.base = base
+        self.factor = factor
+        self.min_bins = min_bins
+        self.data = np.load(path, mmap_mode="r")
+        if self.data.ndim != 2:
+            raise ValueError("Expected an (N, num_columns) recording, got shape {}".format(self.data.shape))
+        self._cache_path = path + ".lod.npy"
+        self._index_path = path + ".lod.json"
+        if rebuild or not self._load_cache():
+            self._build()
+            self._load_cache()
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    @property
+    def num_columns(self):
+        return self.data.shape[1]
+
+    def bin_size(self, level: int):
+        """Samples per bin of a level; level 0 is the raw data"""
+        return 1 if level == 0 else self.base * self.factor ** (level - 1)
+
+    def _source_stamp(self):
+        st = os.stat(self.path)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def _load_cache(self):
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+        expected = {
+            "version": LOD_VERSION,
+            "source": self._source_stamp(),
+            "base": self.base,
+            "factor": self.factor,
+            "min_bins": self.min_bins,
+        }
+        if any(index.get(k) != v for k, v in expected.items()) or not os.path.exists(self._cache_path):
+            return False
+        bins = np.load(self._cache_path, mmap_mode="r")
+        self.levels = [(bins[a:b, 0], bins[a:b, 1]) for a, b in index["offsets"]]
+        return True
+
+    def _build(self, chunk_bins: int = 4096):
+        n = len(self)
+        sizes = []
+        num_bins = -(-n // self.base)
+        while True:
+            sizes.append(num_bins)
+            if num_bins <= self.min_bins:
+                break
+            num_bins = -(-num_bins // self.factor)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+
+        tmp_path = self._cache_path + ".tmp.npy"
+        bins = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float64, shape=(int(offsets[-1]), 2, self.num_columns)
+        )
+        # First level straight from the recording, a chunk at a time
+        chunk_rows = chunk_bins * self.base
+        for start in range(0, n, chunk_rows):
+            chunk = np.asarray(self.data[start : start + chunk_rows], dtype=np.float64)
+            starts = np.arange(0, chunk.shape[0], self.base)
+            first = start // self.base
+            bins[first : first + len(starts), 0] = np.minimum.reduceat(chunk, starts, axis=0)
+            bins[first : first + len(starts), 1] = np.maximum.reduceat(chunk, starts, axis=0)
+        # Every further level from the one below
+        for level in range(1, len(sizes)):
+            below = bins[offsets[level - 1] : offsets[level]]
+            starts = np.arange(0, below.shape[0], self.factor)
+            out = bins[offsets[level] : offsets[level + 1]]
+            out[:, 0] = np.minimum.reduceat(below[:, 0], starts, axis=0)
+            out[:, 1] = np.maximum.reduceat(below[:, 1], starts, axis=0)
+        bins.flush()
+        del bins
+        os.replace(tmp_path, self._cache_path)
+
+        index = {
+            "version": LOD_VERSION,
+            "source": self._source_stamp(),
+            "base": self.base,
+            "factor": self.factor,
+            "min_bins": self.min_bins,
+            "offsets": [[int(a), int(b)] for a, b in zip(offsets[:-1], offsets[1:])],
+        }
+        with open(self._index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(self._index_path + ".tmp", self._index_path)
+
+    def query(self, start: int, stop: int, max_points: int = 2000):
+        """
+        Envelope of rows [start, stop) with at most max_points bins
+
+        Uses the raw rows if there are few enough, otherwise the finest
+        level with at most max_points bins in the range (or the coarsest).
+
+        Returns
+        -------
+        x : np.ndarray
+            (num_bins,) index of the first row of every bin
+        lo, hi : np.ndarray
+            (num_bins, num_columns) minimum and maximum of every bin; equal
+            for raw rows
+        level : int
+            Level used; 0 for raw rows
+        """
+        start = max(0, int(start))
+        stop = min(len(self), int(stop))
+        if stop <= start:
+            empty = np.empty((0, self.num_columns))
+            return np.empty(0, dtype=np.int64), empty, empty, 0
+        if stop - start <= max_points:
+            rows = np.asarray(self.data[start:stop], dtype=np.float64)
+            return np.arange(start, stop), rows, rows, 0
+        level = len(self.levels)
+        for k in range(1, len(self.levels) + 1):
+            if (stop - start) / self.bin_size(k) <= max_points:
+                level = k
+                break
+        size = self.bin_size(level)
+        first, last = start // size, -(-stop // size)
+        lo, hi = self.levels[level - 1]
+        return (
+            np.arange(first, last) * size,
+            np.asarray(lo[first:last]),
+            np.asarray(hi[first:last]),
+            level,
+        )
+
+
+def envelope_line(x, lo, hi):
+    """
+    Interleave bin minima and maxima into one polyline per column
+
+    Drawing the result connects every bin's minimum to its maximum, which
+    looks like plotting all samples of the bin.
+
+    Returns
+    -------
+    xs : np.ndarray
+        (2 * num_bins,) x coordinates
+    ys : np.ndarray
+        (2 * num_bins, num_columns) y coordinates
+    """
+    xs = np.repeat(x, 2)
+    ys = np.empty((2 * lo.shape[0],) + lo.shape[1:])
+    ys[0::2] = lo
+    ys[1::2] = hi
+    return xs, ys
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the level-of-detail cache of .npy recordings")
+    parser.add_argument("recordings", type=str, nargs="+", help=".npy recordings")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild existing caches")
+    args = parser.parse_args()
+
+    for path in args.recordings:
+        pyramid = MinMaxPyramid(path, rebuild=args.rebuild)
+        print(
+            "{}: {} rows, {} levels, coarsest {} bins".format(
+                path, len(pyramid), len(pyramid.levels), pyramid.levels[-1][0].shape[0]
+            )
+        )
@@ -0,0 +1,181 @@
+import glob
+import os
+import signal
+import threading
+
+from .infer import load_predictor
+
+MODEL_PATTERNS = ("*.reskin", "*.npz", "*.keras")
+
+
+def newest_model(directory: str, patterns=MODEL_PATTERNS):
+    """Most recently modified model file in a directory, or None"""
+    paths = [p for pattern in patterns for p in glob.glob(os.path.join(directory, pattern))]
+    if not paths:
+        return None
+    return max(paths, key=lambda p: (os.stat(p).st_mtime_ns, p))
+
+
+class ModelWatcher:
+    """
+    Keeps a model loaded from a file or directory up to date.
+
+    A background thread polls the modification time of the model file (or,
+    for a directory, of its newest model file) and reloads it when it
+    changes; reload() and, once installed, a signal force a reload. Loading
+    happens in the background thread and the result replaces `current` in a
+    single assignment, so a consumer that reads `current` once per frame
+    always sees either the old or the new model, never a partial one. If
+    loading fails the previous model stays in use.
+
+    Attributes
+    ----------
+    path : str
+        Model file or directory being watched
+    current : object
+        The latest successfully loaded model
+    source : str
+        File `current` was loaded from
+    version : int
+        Number of successful loads, starting at 1 for the initial model
+    last_error : Exception
+        Error of the last failed load, or None
+
+    Methods
+    -------
+    start():
+        Start watching in a background thread
+    stop():
+        Stop the background thread
+    reload():
+        Reload the model as soon as possible, even if it has not changed
+    install_signal_handler(signum):
+        Reload when the process receives signum (SIGHUP by default)
+    """
+
+    def __init__(self, path: str, load=load_predictor, poll_interval: float = 1.0, patterns=MODEL_PATTERNS):
+        """
+        Parameters
+        ----------
+        path : str
+            Model file, or directory whose newest model file is used
+        load : callable
+            Called with a file path, returns the model; may raise to reject
+            the file, e.g. if its feature layout does not match the sensor
+        poll_interval : float
+            Seconds between modification time checks
+        patterns : tuple
+            Glob patterns of model files when path is a directory
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.patterns = patterns
+        self.last_error = None
+        self.version = 0
+        self._load = load
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._force = False
+        self._thread = None
+
+        # The initial model is loaded in the caller so errors surface there
+        source = self._resolve()
+        if source is None:
+            raise FileNotFoundError("No model file in {}".format(path))
+        self._stamp = self._file_stamp(source)
+        self.current = load(source)
+        self.source = source
+        self.version = 1
+
+    def _resolve(self):
+        if os.path.isdir(self.path):
+            return newest_model(self.path, self.patterns)
+        return self.path if os.path.exists(self.path) else None
+
+    @staticmethod
+    def _file_stamp(source):
+        try:
+            st = os.stat(source)
+        except OSError:
+            return None
+        return (source, st.st_mtime_ns, st.st_size)
+
+    def start(self):
+        """Start watching in a background thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background thread"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reload(self):
+        """Reload the model as soon as possible, even if it has not changed"""
+        self._force = True
+        self._wake.set()
+        if self._thread is None:
+            # Not watching: nothing else will pick the request up
+            self.start()
+
+    def install_signal_handler(self, signum=None):
+        """
+        Reload when the process receives signum (SIGHUP by default)
+
+        Must be called from the main thread. Does nothing on platforms
+        without the signal, e.g. SIGHUP on Windows.
+        """
+        if signum is None:
+            signum = getattr(signal, "SIGHUP", None)
+        if signum is None:
+            return False
+        signal.signal(signum, lambda *_: self.reload())
+        return True
+
+    def _run(self):
+        pending = None
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            source = self._resolve()
+            stamp = self._file_stamp(source) if source is not None else None
+            if self._force:
+                self._force = False
+                pending = None
+                if stamp is not None:
+                    self._try_load(source, stamp)
+                continue
+            if stamp is None or stamp == self._stamp:
+                pending = None
+                continue
+            # Wait until the file stops changing so a model that is still
+            # being written is not picked up
+            if stamp != pending:
+                pending = stamp
+                continue
+            pending = None
+            self._try_load(source, stamp)
+
+    def _try_load(self, source, stamp):
+        # Remember the file even if loading fails, so a broken file is not
+        # retried on every poll; writing it again triggers a new attempt
+        self._stamp = stamp
+        try:
+            model = self._load(source)
+        except Exception as e:
+            self.last_error = e
+            print("Warning: keeping the current model; could not load {}: {}".format(source, e))
+            return
+        self.last_error = None
+        self.source = source
+        self.current = model
+        self.version += 1
+        print("Loaded model {}".format(source))
@@ -0,0 +1,121 @@
+import ctypes as ct
+from multiprocessing import Array, Value
+
+import numpy as np
+
+
+class SampleRing:
+    """
+    Fixed-size ring of samples in shared memory.
+
+    One process appends rows; any number of readers in other processes or
+    threads copy out everything written since the sequence number they
+    last saw, without locks or pipes. The writer announces the rows it is
+    about to overwrite before writing them and publishes the write count
+    after, so readers never see a half-written row: rows the writer may
+    have overwritten while a reader was copying them are dropped instead of
+    returned torn.
+
+    Rows are [time, acq_delay, data...] in float64. The ring is created
+    before the writing process is started and shared with it by pickling.
+
+    Attributes
+    ----------
+    capacity : int
+        Number of rows kept
+    width : int
+        Number of values per row
+    count : int
+        Number of rows written so far; the sequence number of the next row
+
+    Methods
+    -------
+    append(row):
+        Write a row; only one process may write
+    extend(rows):
+        Write a block of rows
+    read_since(seq, max_rows=None):
+        Rows written since sequence number seq
+    latest(num_rows):
+        Up to num_rows most recent rows
+    """
+
+    def __init__(self, capacity: int, width: int):
+        self.capacity = capacity
+        self.width = width
+        self._data = Array(ct.c_double, capacity * width, lock=False)
+        self._count = Value(ct.c_uint64, lock=False)
+        # Rows the writer is about to overwrite are announced here first
+        self._reserved = Value(ct.c_uint64, lock=False)
+        self._view = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_view"] = None
+        return state
+
+    @property
+    def rows(self):
+        """(capacity, width) NumPy view of the shared buffer"""
+        if self._view is None:
+            self._view = np.frombuffer(self._data, dtype=np.float64).reshape(self.capacity, self.width)
+        return self._view
+
+    @property
+    def count(self):
+        return self._count.value
+
+    def append(self, row):
+        """Write a row; only one process may write"""
+        n = self._count.value
+        self._reserved.value = n + 1
+        self.rows[n % self.capacity] = row
+        self._count.value = n + 1
+
+    def extend(self, rows):
+        """Write a block of rows; only one process may write"""
+        rows = np.asarray(rows)
+        n = self._count.value
+        self._reserved.value = n + rows.shape[0]
+        keep = rows[-self.capacity :]
+        idx = (n + rows.shape[0] - keep.shape[0] + np.arange(keep.shape[0])) % self.capacity
+        self.rows[idx] = keep
+        self._count.value = n + rows.shape[0]
+
+    def read_since(self, seq: int, max_rows: int = None):
+        """
+        Rows written since sequence number seq
+
+        Parameters
+        ----------
+        seq : int
+            Sequence number of the first row wanted, e.g. the next_seq
+            returned by the previous call; 0 for everything still kept
+        max_rows : int
+            Return at most this many of the newest rows
+
+        Returns
+        -------
+        rows : np.ndarray
+            (n, width) copy of the rows
+        next_seq : int
+            Sequence number to pass to the next call. Rows between seq and
+            next_seq - n were overwritten before they were read.
+        """
+        end = self._count.value
+        start = max(seq, end - self.capacity)
+        if max_rows is not None:
+            start = max(start, end - max_rows)
+        if start >= end:
+            return np.empty((0, self.width)), end
+        idx = np.arange(start, end) % self.capacity
+        rows = self.rows[idx]
+        # Rows older than this may have been overwritten during the copy
+        oldest_valid = self._reserved.value - self.capacity
+        if oldest_valid > start:
+            rows = rows[oldest_valid - start :]
+        return rows, end
+
+    def latest(self, num_rows: int):
+        """Up to num_rows most recent rows"""
+        return self.read_since(0, max_rows=num_rows)[0]
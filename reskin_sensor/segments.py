@@ -0,0 +1,73 @@
+import collections
+
+import numpy as np
+
+Segment = collections.namedtuple("Segment", "label, start, stop")
+
+
+def label_samples(seq, marks, default: int = -1, settle: int = 0):
+    """
+    Label samples from the marks recorded while they were streamed
+
+    Parameters
+    ----------
+    seq : array_like
+        (N,) sequence numbers of the samples, as returned by
+        ReSkinProcess.get_buffer(return_seq=True)
+    marks : list
+        Marks recorded with ReSkinProcess.mark, or (seq, label) pairs
+    default : int
+        Label of samples streamed before the first mark or during the
+        settling time
+    settle : int
+        Number of samples after every mark that are given the default
+        label, e.g. to discard the time taken to move to a new press
+
+    Returns
+    -------
+    np.ndarray
+        (N,) label of every sample
+    """
+    seq = np.asarray(seq, dtype=np.int64)
+    labels = np.full(seq.shape, default, dtype=np.int64)
+    if len(marks) == 0:
+        return labels
+    mark_seq = np.array([m[0] for m in marks], dtype=np.int64)
+    mark_labels = np.array([default if m[1] is None else m[1] for m in marks])
+    order = np.argsort(mark_seq, kind="stable")
+    mark_seq, mark_labels = mark_seq[order], mark_labels[order]
+
+    idx = np.searchsorted(mark_seq, seq, side="right") - 1
+    marked = idx >= 0
+    marked[marked] = seq[marked] - mark_seq[idx[marked]] >= settle
+    labels[marked] = mark_labels[idx[marked]]
+    return labels
+
+
+def extract_segments(labels, default: int = -1):
+    """
+    Split a labelled stream into runs of consecutive samples with one label
+
+    Parameters
+    ----------
+    labels : array_like
+        (N,) label of every sample
+    default : int
+        Runs with this label are left out
+
+    Returns
+    -------
+    list of Segment
+        Label and [start, stop) row range of every run
+    """
+    labels = np.asarray(labels)
+    if labels.shape[0] == 0:
+        return []
+    bounds = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    starts = np.concatenate(([0], bounds))
+    stops = np.concatenate((bounds, [labels.shape[0]]))
+    return [
+        Segment(label=labels[a].item(), start=int(a), stop=int(b))
+        for a, b in zip(starts, stops)
+        if labels[a] != default
+    ]
@@ -1,13 +1,18 @@
 import atexit
+import collections
 import ctypes as ct
 import sys
+import time
 from multiprocessing import Process, Event, Pipe, Value, Array
 
 import numpy as np
 import serial
 
+from .ring import SampleRing
 from .sensor import ReSkinBase, ReSkinData, ReSkinDummy
 
+Mark = collections.namedtuple("Mark", "seq, label, time")
+
 
 class ReSkinProcess(Process):
     """
@@ -36,6 +41,8 @@ class ReSkinProcess(Process):
         configurations is unavailable
     chunk_size : int
         Quantum of data piped from buffer at one time.
+    ring_size : int
+        Number of most recent samples kept in shared memory for read_since
 
     Methods
     -------
@@ -49,8 +56,12 @@ class ReSkinProcess(Process):
         Stop streaming data from ReSkin sensor
     get_data(num_samples=5):
         Return a specified number of samples from the ReSkin Sensor
-    get_buffer(timeout=1.0, pause_if_buffering=False):
+    get_buffer(timeout=1.0, pause_if_buffering=False, return_seq=False):
         Return the recorded buffer
+    read_since(seq, max_samples=None):
+        Return every sample streamed since sequence number seq
+    mark(label):
+        Record a label change at the current position in the stream
     """
 
     def __init__(
@@ -64,6 +75,7 @@ class ReSkinProcess(Process):
         reskin_data_struct: bool = True,
         allow_dummy_sensor: bool = False,
         chunk_size: int = 10000,
+        ring_size: int = 4096,
     ):
         """Initializes a ReSkinProcess object."""
         super(ReSkinProcess, self).__init__()
@@ -77,12 +89,16 @@ class ReSkinProcess(Process):
         self.allow_dummy_sensor = allow_dummy_sensor
 
         self._pipe_in, self._pipe_out = Pipe()
+        self._marks = []
         self._sample_cnt = Value(ct.c_uint64)
         self._buffer_size = Value(ct.c_uint64)
 
         self._last_time = Value(ct.c_double)
         self._last_delay = Value(ct.c_double)
         self._last_reading = Array(ct.c_float, self.num_mags * (4 - temp_filtered))
+        # Rows of [time, acq_delay, data...], written before _sample_cnt is
+        # incremented so ring and stream sequence numbers agree
+        self._ring = SampleRing(ring_size, 2 + self.num_mags * (4 - temp_filtered))
 
         self._chunk_size = chunk_size
 
@@ -118,6 +134,11 @@ class ReSkinProcess(Process):
     def sample_cnt(self):
         return self._sample_cnt.value
 
+    @property
+    def marks(self):
+        """Labels recorded with mark(), as a list of Mark(seq, label, time)"""
+        return list(self._marks)
+
     def start_streaming(self):
         """Start streaming data from ReSkin sensor"""
         if not self._event_quit_request.is_set():
@@ -181,7 +202,60 @@ class ReSkinProcess(Process):
 
         return samples
 
-    def get_buffer(self, timeout: float = 1.0, pause_if_buffering: bool = False):
+    def read_since(self, seq: int, max_samples: int = None):
+        """
+        Return every sample streamed since sequence number seq
+
+        Unlike get_data, this does not wait and does not miss samples as
+        long as it is called before ring_size newer samples have arrived.
+
+        Parameters
+        ----------
+        seq : int
+            Sequence number of the first sample wanted; pass the next_seq
+            of the previous call to continue where it stopped
+        max_samples : int
+            Return at most this many of the newest samples
+
+        Returns
+        -------
+        rows : np.ndarray
+            (n, 2 + num_channels) rows of [time, acq_delay, data...]
+        next_seq : int
+            Sequence number of the next sample. If next_seq - n > seq, the
+            samples in between were overwritten before they were read.
+        """
+        return self._ring.read_since(seq, max_samples)
+
+    def mark(self, label):
+        """
+        Record a label change at the current position in the stream
+
+        The label applies to every sample streamed from now on, up to the
+        next mark. Samples are identified by their sequence number, the
+        number of samples streamed before them, so labels can be matched to
+        buffered data after the fact with reskin_sensor.segments.
+
+        Parameters
+        ----------
+        label : int
+            Label of the samples that follow
+
+        Returns
+        -------
+        int
+            Sequence number of the first sample the label applies to
+        """
+        mark = Mark(seq=self._sample_cnt.value, label=label, time=time.time())
+        self._marks.append(mark)
+        return mark.seq
+
+    def get_buffer(
+        self,
+        timeout: float = 1.0,
+        pause_if_buffering: bool = False,
+        return_seq: bool = False,
+    ):
         """
         Return the recorded buffer
 
@@ -192,6 +266,9 @@ class ReSkinProcess(Process):
 
         pause_if_buffering : bool
             Pauses buffering if still running, and then collects and returns buffer
+
+        return_seq : bool
+            Also return the sequence number of every buffered sample
         """
         # Check if buffering is paused
         if self._event_is_buffering.is_set():
@@ -205,12 +282,23 @@ class ReSkinProcess(Process):
             else:
                 self._event_is_buffering.clear()
         rtn = []
+        seq = []
         if self._event_sending_data.is_set() or self._buffer_size.value > 0:
             self._event_sending_data.wait(timeout=timeout)
-            while self._pipe_in.poll() or self._buffer_size.value > 0:
-                rtn.extend(self._pipe_in.recv())
+            while True:
+                # Only receive chunks already in the pipe: the count is
+                # updated after a chunk is sent, so a non-zero count does
+                # not mean another chunk is coming
+                if self._pipe_in.poll(0.001):
+                    chunk_seq, chunk = self._pipe_in.recv()
+                    rtn.extend(chunk)
+                    seq.extend(chunk_seq)
+                elif self._buffer_size.value == 0 and not self._pipe_in.poll():
+                    break
             self._event_sending_data.clear()
 
+        if return_seq:
+            return rtn, np.array(seq, dtype=np.int64)
         return rtn
 
     def join(self, timeout=None):
@@ -221,9 +309,22 @@ class ReSkinProcess(Process):
 
         super(ReSkinProcess, self).join(timeout)
 
+    def _send_buffer(self, buffer, buffer_seq):
+        """Pipe the buffer to the main process in chunks"""
+        self._event_sending_data.set()
+        chk = self._chunk_size
+        while len(buffer) > 0:
+            if chk > len(buffer):
+                chk = len(buffer)
+            self._pipe_out.send((buffer_seq[0:chk], buffer[0:chk]))
+            buffer[0:chk] = []
+            buffer_seq[0:chk] = []
+            self._buffer_size.value = len(buffer)
+
     def run(self):
         """This loop runs until it's asked to quit."""
         buffer = []
+        buffer_seq = []
         # Initialize sensor
         try:
             self.sensor = ReSkinBase(
@@ -261,26 +362,22 @@ class ReSkinProcess(Process):
                     is_streaming = True
                     # Any logging or stuff you want to do when streaming has
                     # just started should go here
+                t, acq_delay, reading = self.sensor.get_sample()
                 (
                     self._last_time.value,
                     self._last_delay.value,
                     self._last_reading[:],
-                ) = self.sensor.get_sample()
+                ) = (t, acq_delay, reading)
+                self._ring.append(np.concatenate(([t, acq_delay], reading)))
 
                 self._sample_cnt.value += 1
 
                 if self._event_is_buffering.is_set():
                     buffer.append(self.last_reading)
+                    buffer_seq.append(self._sample_cnt.value - 1)
                     self._buffer_size.value = len(buffer)
                 elif self._buffer_size.value > 0:
-                    self._event_sending_data.set()
-                    chk = self._chunk_size
-                    while len(buffer) > 0:
-                        if chk > len(buffer):
-                            chk = len(buffer)
-                        self._pipe_out.send(buffer[0:chk])
-                        buffer[0:chk] = []
-                        self._buffer_size.value = len(buffer)
+                    self._send_buffer(buffer, buffer_seq)
 
             else:
                 if is_streaming:
@@ -288,13 +385,6 @@ class ReSkinProcess(Process):
                     # Logging when streaming just stopped
 
                 if self._buffer_size.value > 0:
-                    self._event_sending_data.set()
-                    chk = self._chunk_size
-                    while len(buffer) > 0:
-                        if chk > len(buffer):
-                            chk = len(buffer)
-                        self._pipe_out.send(buffer[0:chk])
-                        buffer[0:chk] = []
-                        self._buffer_size.value = len(buffer)
+                    self._send_buffer(buffer, buffer_seq)
 
         self.pause_streaming()
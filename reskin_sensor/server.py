@@ -0,0 +1,537 @@
+"""
+Share one sensor between many local programs.
+
+A StreamServer owns the ReSkinProcess and publishes its decoded samples on
+a Unix domain socket or a localhost TCP port; ReSkinClient connects to it
+and offers the familiar get_data/get_buffer/read_since API.
+
+Every message is a 5-byte header, a message type (uint8) and a payload
+length (uint32, little endian), followed by the payload:
+
+- HELLO (server): JSON with num_mags, temp_filtered, device_id and the
+  names of the streamed channels
+- SUBSCRIBE (client): JSON with the channels wanted (names or indices;
+  null for all) and a decimation factor
+- DATA (server): sequence number of the first sample (uint64), decimation
+  (uint16) and number of samples n (uint32), then n float64 timestamps, n
+  float32 acquisition delays and n * num_channels float32 readings. With
+  decimation d only samples whose sequence number is a multiple of d are
+  sent, so clients with the same d see the same samples.
+- ERROR (server): UTF-8 message, after which the connection is closed
+"""
+import argparse
+import json
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .features import channel_names
+from .ring import SampleRing
+from .sensor_proc import Mark, ReSkinProcess
+from .sources import StreamSource
+
+PROTOCOL_VERSION = 1
+DEFAULT_ADDRESS = "127.0.0.1:7437"
+
+MSG_HELLO = 1
+MSG_SUBSCRIBE = 2
+MSG_DATA = 3
+MSG_ERROR = 4
+
+HEADER = struct.Struct("<BI")
+DATA_HEADER = struct.Struct("<QHI")
+
+
+def parse_address(address: str):
+    """
+    Socket family and address of "unix:/path", "/path", "tcp:host:port",
+    "host:port" or "port" (localhost)
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    if address.startswith("tcp:"):
+        address = address[4:]
+    elif "/" in address:
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def pack_message(kind: int, payload: bytes):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def pack_data(first_seq: int, decimation: int, rows, columns=None):
+    """DATA message for (n, 2 + num_channels) rows of [time, acq_delay, data...]"""
+    data = rows[:, 2:] if columns is None else rows[:, 2 + columns]
+    payload = b"".join(
+        (
+            DATA_HEADER.pack(first_seq, decimation, rows.shape[0]),
+            rows[:, 0].astype("<f8").tobytes(),
+            rows[:, 1].astype("<f4").tobytes(),
+            data.astype("<f4").tobytes(),
+        )
+    )
+    return pack_message(MSG_DATA, payload)
+
+
+def unpack_data(payload: bytes, num_channels: int):
+    """
+    Decode a DATA payload
+
+    Returns
+    -------
+    seq : np.ndarray
+        (n,) sequence number of every sample
+    rows : np.ndarray
+        (n, 2 + num_channels) rows of [time, acq_delay, data...]
+    """
+    first_seq, decimation, n = DATA_HEADER.unpack_from(payload)
+    offset = DATA_HEADER.size
+    times = np.frombuffer(payload, "<f8", n, offset)
+    offset += 8 * n
+    delays = np.frombuffer(payload, "<f4", n, offset)
+    offset += 4 * n
+    data = np.frombuffer(payload, "<f4", n * num_channels, offset).reshape(n, num_channels)
+    rows = np.empty((n, 2 + num_channels))
+    rows[:, 0] = times
+    rows[:, 1] = delays
+    rows[:, 2:] = data
+    return first_seq + decimation * np.arange(n, dtype=np.int64), rows
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.subscribed = False
+        self.columns = None
+        self.decimation = 1
+        self.dropped = 0
+        # Set once an error is queued; the connection is closed when it is sent or by then
+        self.close_deadline = None
+
+
+class StreamServer:
+    """
+    Publishes the samples of a ReSkinProcess to local clients.
+
+    A single thread accepts connections, reads subscriptions, and every
+    poll_interval sends the samples streamed since the last poll to every
+    subscriber, encoded once per distinct subscription. Sockets are
+    non-blocking; a client that falls more than max_pending bytes behind
+    loses samples instead of slowing down the others.
+
+    Methods
+    -------
+    serve_forever():
+        Serve until shutdown() is called
+    shutdown():
+        Stop serving and close all connections
+    """
+
+    def __init__(
+        self,
+        stream,
+        address: str = DEFAULT_ADDRESS,
+        poll_interval: float = 0.005,
+        max_pending: int = 1 << 22,
+        error_timeout: float = 1.0,
+    ):
+        """
+        Parameters
+        ----------
+        stream : ReSkinProcess
+            Started sensor stream
+        address : str
+            "unix:/path" or a path for a Unix domain socket, "host:port" or
+            "port" for TCP
+        poll_interval : float
+            Seconds between sends
+        max_pending : int
+            Bytes queued for a client before its samples are dropped
+        error_timeout : float
+            Seconds a client that is sent an error has to read it before
+            its connection is closed
+        """
+        self.stream = stream
+        self.address = address
+        self.poll_interval = poll_interval
+        self.max_pending = max_pending
+        self.error_timeout = error_timeout
+        self.names = channel_names(stream.num_mags, temp_filtered=stream.temp_filtered)
+        self._hello = pack_message(
+            MSG_HELLO,
+            json.dumps(
+                {
+                    "version": PROTOCOL_VERSION,
+                    "num_mags": stream.num_mags,
+                    "temp_filtered": bool(stream.temp_filtered),
+                    "device_id": stream.device_id,
+                    "channels": self.names,
+                }
+            ).encode(),
+        )
+        self._selector = selectors.DefaultSelector()
+        self._connections = {}
+        self._stop = threading.Event()
+
+        family, sock_address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(sock_address):
+            os.unlink(sock_address)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(sock_address)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._unix_path = sock_address if family == socket.AF_UNIX else None
+        self._selector.register(self._listener, selectors.EVENT_READ)
+
+    @property
+    def num_clients(self):
+        return len(self._connections)
+
+    def serve_forever(self):
+        """Serve until shutdown() is called"""
+        seq = self.stream.sample_cnt
+        try:
+            while not self._stop.is_set():
+                for key, events in self._selector.select(self.poll_interval):
+                    if key.fileobj is self._listener:
+                        self._accept()
+                        continue
+                    conn = self._connections.get(key.fileobj)
+                    if conn is None:
+                        continue
+                    try:
+                        if events & selectors.EVENT_READ:
+                            self._read(conn)
+                        if events & selectors.EVENT_WRITE and conn.sock in self._connections:
+                            self._flush(conn)
+                    except Exception as e:
+                        # A misbehaving client must not stop the others being served
+                        print("Warning: closing a client connection after an error: {!r}".format(e))
+                        self._close(conn)
+                now = time.time()
+                for conn in list(self._connections.values()):
+                    if conn.close_deadline is not None and now > conn.close_deadline:
+                        self._close(conn)
+                rows, next_seq = self.stream.read_since(seq)
+                first_seq = next_seq - len(rows)
+                seq = next_seq
+                if len(rows):
+                    self._publish(first_seq, rows)
+        finally:
+            self._close_all()
+
+    def shutdown(self):
+        """Stop serving and close all connections"""
+        self._stop.set()
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except OSError as e:
+            # e.g. out of file descriptors; the client is refused, the server goes on
+            print("Warning: failed to accept a client: {}".format(e))
+            return
+        sock.setblocking(False)
+        conn = _Connection(sock)
+        self._connections[sock] = conn
+        self._selector.register(sock, selectors.EVENT_READ)
+        self._send(conn, self._hello)
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(conn)
+            return
+        if conn.close_deadline is not None:
+            # Only waiting for the error message to be sent
+            return
+        conn.inbuf += data
+        while len(conn.inbuf) >= HEADER.size:
+            kind, length = HEADER.unpack_from(conn.inbuf)
+            if len(conn.inbuf) < HEADER.size + length:
+                break
+            payload = bytes(conn.inbuf[HEADER.size : HEADER.size + length])
+            del conn.inbuf[: HEADER.size + length]
+            if kind != MSG_SUBSCRIBE:
+                self._fail(conn, "Unexpected message type {}".format(kind))
+                return
+            try:
+                self._subscribe(conn, json.loads(payload.decode()))
+            except (ValueError, TypeError) as e:
+                self._fail(conn, str(e))
+                return
+
+    def _subscribe(self, conn, request):
+        if not isinstance(request, dict):
+            raise ValueError("A subscription must be a JSON object")
+        channels = request.get("channels")
+        decimation = int(request.get("decimation", 1))
+        if not 1 <= decimation <= 0xFFFF:
+            raise ValueError("Decimation must be between 1 and 65535")
+        if channels is None:
+            conn.columns = None
+        else:
+            columns = []
+            for c in channels:
+                if isinstance(c, str):
+                    if c not in self.names:
+                        raise ValueError("Unknown channel {}".format(c))
+                    c = self.names.index(c)
+                if not 0 <= c < len(self.names):
+                    raise ValueError("Channel index {} out of range".format(c))
+                columns.append(c)
+            conn.columns = np.array(columns, dtype=np.intp)
+        conn.decimation = decimation
+        conn.subscribed = True
+
+    def _publish(self, first_seq, rows):
+        messages = {}
+        for conn in list(self._connections.values()):
+            if not conn.subscribed:
+                continue
+            d = conn.decimation
+            key = (d, None if conn.columns is None else conn.columns.tobytes())
+            if key not in messages:
+                offset = (-first_seq) % d
+                selected = rows[offset::d]
+                messages[key] = (
+                    pack_data(first_seq + offset, d, selected, conn.columns) if len(selected) else None
+                )
+            if messages[key] is None:
+                continue
+            if len(conn.outbuf) > self.max_pending:
+                conn.dropped += 1
+                continue
+            self._send(conn, messages[key])
+
+    def _send(self, conn, message):
+        was_empty = not conn.outbuf
+        conn.outbuf += message
+        if was_empty:
+            self._flush(conn)
+
+    def _flush(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close(conn)
+            return
+        del conn.outbuf[:sent]
+        if conn.close_deadline is not None and not conn.outbuf:
+            self._close(conn)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbuf else 0)
+        self._selector.modify(conn.sock, events)
+
+    def _fail(self, conn, message):
+        """Send an error after whatever is queued, then close the connection"""
+        if conn.close_deadline is not None:
+            return
+        conn.subscribed = False
+        conn.close_deadline = time.time() + self.error_timeout
+        self._send(conn, pack_message(MSG_ERROR, message.encode()))
+
+    def _close(self, conn):
+        if self._connections.pop(conn.sock, None) is None:
+            return
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+
+    def _close_all(self):
+        for conn in list(self._connections.values()):
+            self._close(conn)
+        self._selector.unregister(self._listener)
+        self._listener.close()
+        if self._unix_path is not None and os.path.exists(self._unix_path):
+            os.unlink(self._unix_path)
+
+
+class ReSkinClient(StreamSource):
+    """
+    Receives a sensor stream from a StreamServer.
+
+    Mirrors the reading side of ReSkinProcess, so scripts can use either.
+    Samples are received in a background thread; sequence numbers returned
+    by get_buffer and mark are the server's, while read_since and
+    sample_cnt count the samples this client received.
+
+    Attributes
+    ----------
+    num_mags : int
+        Number of magnetometers of the served sensor
+    temp_filtered : bool
+        Whether the served stream has no temperature channels
+    device_id : int
+        Sensor ID of the served stream
+    channels : list
+        Names of the channels received, in order
+
+    Methods
+    -------
+    start():
+        Connect and start receiving
+    join():
+        Disconnect
+
+    See sources.StreamSource for the reading methods.
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_ADDRESS,
+        channels=None,
+        decimation: int = 1,
+        reskin_data_struct: bool = True,
+        ring_size: int = 4096,
+        timeout: float = 5.0,
+    ):
+        """
+        Parameters
+        ----------
+        address : str
+            Server address, see parse_address
+        channels : list
+            Channel names or indices to receive; all if None
+        decimation : int
+            Receive every decimation-th sample
+        reskin_data_struct : bool
+            Return samples as ReSkinData instead of arrays
+        ring_size : int
+            Number of most recent samples kept for read_since
+        timeout : float
+            Seconds to wait for the server's greeting
+        """
+        super().__init__(reskin_data_struct=reskin_data_struct, ring_size=ring_size)
+        self.address = address
+        self.decimation = decimation
+        self._requested_channels = channels
+        self._timeout = timeout
+        self._sock = None
+        self._last_seq = -1
+        self._error = None
+
+    def start(self):
+        """Connect and start receiving"""
+        family, sock_address = parse_address(self.address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(self._timeout)
+        self._sock.connect(sock_address)
+        kind, payload = self._recv_message()
+        if kind != MSG_HELLO:
+            raise ConnectionError("Expected a greeting from {}".format(self.address))
+        hello = json.loads(payload.decode())
+        self.device_id = hello["device_id"]
+        names = hello["channels"]
+        if self._requested_channels is None:
+            self.channels = list(names)
+        else:
+            self.channels = [c if isinstance(c, str) else names[c] for c in self._requested_channels]
+        self._set_layout(hello["num_mags"], hello["temp_filtered"])
+        if len(self.channels) != self._ring.width - 2:
+            # A subset of channels: keep the ring as wide as the subscription
+            self._ring = SampleRing(self.ring_size, 2 + len(self.channels))
+        request = {"channels": self._requested_channels, "decimation": self.decimation}
+        self._sock.sendall(pack_message(MSG_SUBSCRIBE, json.dumps(request).encode()))
+        self._sock.settimeout(None)
+        return super().start()
+
+    def join(self, timeout=None):
+        """Disconnect"""
+        self._stop.set()
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+        super().join(timeout)
+
+    close = join
+
+    def _recv_exact(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = self._sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("Server closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def _recv_message(self):
+        kind, length = HEADER.unpack(self._recv_exact(HEADER.size))
+        return kind, self._recv_exact(length)
+
+    def _run(self):
+        try:
+            while not self.stop_requested:
+                kind, payload = self._recv_message()
+                if kind == MSG_ERROR:
+                    raise ConnectionError(payload.decode(errors="replace"))
+                if kind != MSG_DATA:
+                    continue
+                seq, rows = unpack_data(payload, len(self.channels))
+                self._publish(rows, seq)
+                self._last_seq = int(seq[-1])
+        except (OSError, ConnectionError) as e:
+            self._error = e
+
+    def mark(self, label):
+        """Record a label change; applies from the next sample the server streams"""
+        mark = Mark(seq=self._last_seq + 1, label=label, time=time.time())
+        self._marks.append(mark)
+        return mark.seq
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(description="Serve a ReSkin sensor stream to local clients")
+    parser.add_argument("-p", "--port", type=str, help="Port to which the microcontroller is connected", required=True)
+    parser.add_argument("-b", "--baudrate", type=int, help="Baudrate at which the microcontroller is streaming data", default=115200)
+    parser.add_argument("-n", "--num_mags", type=int, help="Number of magnetometers on the sensor board", default=5)
+    parser.add_argument("-tf", "--temp_filtered", action="store_true", help="Flag to filter temperature from sensor output")
+    parser.add_argument("-d", "--device_id", type=int, help="Sensor ID reported to clients", default=1)
+    parser.add_argument("-a", "--address", type=str, help="unix:/path or host:port to listen on", default=DEFAULT_ADDRESS)
+    parser.add_argument("--allow_dummy_sensor", action="store_true", help="Serve random data if the sensor is unavailable")
+    args = parser.parse_args()
+    # fmt: on
+
+    stream = ReSkinProcess(
+        num_mags=args.num_mags,
+        port=args.port,
+        baudrate=args.baudrate,
+        burst_mode=True,
+        device_id=args.device_id,
+        temp_filtered=args.temp_filtered,
+        allow_dummy_sensor=args.allow_dummy_sensor,
+    )
+    stream.start()
+    server = StreamServer(stream, args.address)
+    print("Serving on {}".format(args.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.join()
+
+
+if __name__ == "__main__":
+    main()
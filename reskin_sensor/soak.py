@@ -0,0 +1,447 @@
+"""
+Long-running soak test of acquisition and its consumers.
+
+    python -m reskin_sensor.soak --hours 4 -o soak.jsonl
+    python -m reskin_sensor.soak --quick
+
+A stream reads a simulated board for hours, headless, while the consumers
+of an interactive session run against it:
+
+- an InferenceWorker detects presses and classifies the samples during
+  them
+- a recorder buffers a few seconds of samples every so often and fetches
+  them with get_buffer, as collect_data.py does
+- a display loop does the work of a frame of the demos at a fixed rate,
+  short of drawing: it reads the latest reading and prediction, turns
+  the reading into fields relative to the baseline and formats a status
+  line
+
+Every interval seconds the runner samples the resident memory of this
+process and of the acquisition process, the sample rate, the frames of
+the board missing from the stream, the samples skipped by the worker, and
+the percentiles
+of the worker's acquisition-to-result latency. Samples are appended to a
+JSON lines log as they are taken. check() flags memory that keeps growing,
+a sample rate below the board's, growing losses and latency that worsens
+over the run; flags are printed as they appear, and the runner exits with
+status 1 if any were raised.
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .benchmark import default_models, environment
+from .calibration import calibrate
+from .contact import ContactDetector
+from .features import split_readings
+from .latency import FRAME_INDEX_MODULUS, SensorEmulator, open_stream
+from .sources import SimulatedSource, random_presses
+from .worker import InferenceWorker
+
+BACKENDS = ("process", "thread", "simulated")
+
+Sample = collections.namedtuple(
+    "Sample",
+    "elapsed, rss_mb, child_rss_mb, rate, num_samples, num_lost, num_skipped, "
+    "latency_p50_ms, latency_p95_ms, latency_p99_ms, num_recorded",
+)
+
+
+def rss_mb(pid="self"):
+    """
+    Resident memory of a process in MB, from /proc, or psutil where there
+    is no /proc; NaN if neither is available
+    """
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+
+        return psutil.Process(os.getpid() if pid == "self" else int(pid)).memory_info().rss / 2**20
+    except Exception:
+        return float("nan")
+
+
+class _TimedWorker(InferenceWorker):
+    """InferenceWorker keeping the latency of every pass"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def step(self):
+        n = super().step()
+        if n:
+            self.latencies.append(self.latest.latency)
+        return n
+
+    def take_latencies(self):
+        """Latencies of the passes since the last call"""
+        latencies, self.latencies = self.latencies, []
+        return np.array(latencies)
+
+
+class _FrameCounter:
+    """
+    Passes reads on to a stream, counting the frames of a SensorEmulator
+    that are missing between the samples read
+
+    A step in the frame index larger than the step in sequence numbers
+    means frames never reached the stream; samples that reached it but
+    were not read, e.g. skipped by the worker, do not count.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.num_lost = 0
+        self._last = None
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def read_since(self, seq, max_samples=None):
+        rows, next_seq = self.stream.read_since(seq, max_samples)
+        if len(rows):
+            frames = rows[:, 2]
+            last_seq, last_frame = self._last or (next_seq - len(rows), frames[0])
+            steps = np.diff(np.concatenate(([last_frame], frames))) % FRAME_INDEX_MODULUS
+            self.num_lost += int(steps.sum()) - (next_seq - 1 - last_seq)
+            self._last = (next_seq - 1, frames[-1])
+        return rows, next_seq
+
+
+class SoakTest:
+    """
+    Acquisition and consumers of a simulated board, sampled periodically.
+
+    Attributes
+    ----------
+    backend : str
+        "process" (ReSkinProcess) or "thread" (SerialSource) reading an
+        emulated board on a pseudo terminal, or "simulated" for a
+        SimulatedSource
+    rate : float
+        Frames per second sent by the board
+    samples : list
+        Sample of every interval since the start
+    stream : object
+        The stream under test, once started
+    status : str
+        Status line of the latest frame of the display loop
+
+    Methods
+    -------
+    start():
+        Start acquisition and consumers
+    sample():
+        Take and return a Sample
+    stop():
+        Stop everything
+    """
+
+    def __init__(
+        self,
+        backend: str = "process",
+        model=None,
+        num_mags: int = 5,
+        rate: float = 1000.0,
+        max_batch: int = 1024,
+        record_every: float = 30.0,
+        record_length: float = 10.0,
+        fps: float = 33.0,
+        seed: int = 0,
+    ):
+        """
+        Parameters
+        ----------
+        model : object
+            Classifier with predict(x); defaults to the synthetic dense
+            network of benchmark.default_models
+        max_batch : int
+            Batch size limit of the InferenceWorker
+        record_every, record_length : float
+            The recorder buffers record_length seconds of samples every
+            record_every seconds
+        fps : float
+            Rate of the display loop
+        """
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend {!r}, expected one of {}".format(backend, BACKENDS))
+        self.backend = backend
+        self.model = model if model is not None else default_models(num_inputs=3 * num_mags)["dense"]
+        self.num_mags = num_mags
+        self.rate = rate
+        self.max_batch = max_batch
+        self.record_every = record_every
+        self.record_length = record_length
+        self.fps = fps
+        self.seed = seed
+        self.samples = []
+        self.stream = None
+        self.emulator = None
+        self.worker = None
+        self._frames = None
+        self.status = ""
+        self._baseline = None
+        self._num_recorded = 0
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start acquisition and consumers"""
+        # A press every 2 s for up to a day, leaving the first 5 s to calibrate
+        presses = [
+            press._replace(start=press.start + 3.0)
+            for press in random_presses(24 * 3600, self.num_mags, seed=self.seed)
+        ]
+        if self.backend == "simulated":
+            self.stream = SimulatedSource(self.num_mags, self.rate, presses=presses, seed=self.seed).start()
+        else:
+            self.emulator = SensorEmulator(self.num_mags, self.rate, presses, seed=self.seed, record_arrivals=False).start()
+            self.stream = open_stream(self.backend, self.emulator.port, self.num_mags)
+
+        # Calibrate on half a second of data, before the first press
+        deadline = time.time() + 10.0
+        while self.stream.sample_cnt < self.rate / 2:
+            if time.time() > deadline:
+                raise RuntimeError("The {} backend streamed {} samples in 10 s".format(self.backend, self.stream.sample_cnt))
+            time.sleep(0.05)
+        rows, _ = self.stream.read_since(self.stream.sample_cnt - int(self.rate / 2))
+        calibration = calibrate(rows[:, 2:])
+        detector = ContactDetector.from_calibration(calibration, self.num_mags)
+        self._baseline = calibration.mean
+        # Frames of the emulator carry their index; simulated samples cannot be lost
+        self._frames = _FrameCounter(self.stream) if self.emulator is not None else None
+        self.worker = _TimedWorker(
+            self._frames or self.stream, self.model.predict, calibration.mean, self.num_mags, detector=detector, max_batch=self.max_batch
+        ).start()
+
+        self._threads = [threading.Thread(target=fn, daemon=True) for fn in (self._record, self._display)]
+        for thread in self._threads:
+            thread.start()
+        self._start_time = self._last_time = time.time()
+        self._last_count = self.stream.sample_cnt
+        return self
+
+    def _record(self):
+        while not self._stop.wait(max(self.record_every - self.record_length, 0)):
+            # get_buffer emptied the buffer of the last recording
+            self.stream.start_buffering()
+            if self._stop.wait(self.record_length):
+                self.stream.pause_buffering()
+                break
+            buffer = self.stream.get_buffer(pause_if_buffering=True)
+            self._num_recorded += len(buffer or [])
+
+    def _display(self):
+        while not self._stop.wait(1 / self.fps):
+            reading, prediction = self.stream.last_reading, self.worker.latest
+            if reading is None:
+                continue
+            _, mags = split_readings(np.asarray(reading.data) - self._baseline, self.num_mags)
+            strengths = np.linalg.norm(mags, axis=-1)
+            pressed = prediction is not None and prediction.in_contact
+            self.status = "reading {:.1f} ms old, strongest field {:.0f} at chip {}, press: {}".format(
+                (time.time() - reading.time) * 1000, strengths.max(), int(np.argmax(strengths)), prediction.label if pressed else "none"
+            )
+
+    def sample(self):
+        """Take and return a Sample"""
+        now = time.time()
+        count = self.stream.sample_cnt
+        latencies = self.worker.take_latencies() * 1000
+        if latencies.shape[0]:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        else:
+            p50 = p95 = p99 = float("nan")
+        child = getattr(self.stream, "pid", None)
+        sample = Sample(
+            elapsed=now - self._start_time,
+            rss_mb=rss_mb(),
+            child_rss_mb=rss_mb(child) if child is not None else 0.0,
+            rate=(count - self._last_count) / (now - self._last_time),
+            num_samples=int(count),
+            num_lost=self._frames.num_lost if self._frames is not None else 0,
+            num_skipped=int(self.worker.num_dropped),
+            latency_p50_ms=float(p50),
+            latency_p95_ms=float(p95),
+            latency_p99_ms=float(p99),
+            num_recorded=int(self._num_recorded),
+        )
+        self._last_time, self._last_count = now, count
+        self.samples.append(sample)
+        return sample
+
+    def stop(self):
+        """Stop everything"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        if self.worker is not None:
+            self.worker.stop()
+        if self.stream is not None:
+            self.stream.join(1.0)
+            if self.backend == "process" and self.stream.is_alive():
+                self.stream.terminate()
+        if self.emulator is not None:
+            self.emulator.stop()
+
+
+def check(
+    samples,
+    rate: float,
+    warmup: float = 300.0,
+    leak_mb_per_hour: float = 10.0,
+    min_growth_mb: float = 10.0,
+    rate_tolerance: float = 0.05,
+    loss_tolerance: float = 0.001,
+    latency_factor: float = 2.0,
+):
+    """
+    Flag leaks and degradation in the samples of a soak test
+
+    Samples taken in the first warmup seconds are ignored, and trends need
+    at least four samples after it. The first and last quarter of the rest
+    are compared.
+
+    Parameters
+    ----------
+    rate : float
+        Frames per second sent by the board
+    leak_mb_per_hour, min_growth_mb : float
+        Flag memory growing faster than leak_mb_per_hour, as fitted over
+        the run, once it has grown by min_growth_mb
+    rate_tolerance : float
+        Flag a median rate over the last quarter this fraction below rate
+    loss_tolerance : float
+        Flag losses or skips of more than this fraction of the samples
+    latency_factor : float
+        Flag a median p99 latency over the last quarter this many times
+        that over the first
+
+    Returns
+    -------
+    dict
+        Description of every problem found, keyed by the check that found it
+    """
+    samples = [s for s in samples if s.elapsed >= warmup]
+    if len(samples) < 4:
+        return {}
+    quarter = len(samples) // 4
+    first, last = samples[:quarter], samples[-quarter:]
+    flags = {}
+
+    hours = np.array([s.elapsed for s in samples]) / 3600
+    for name, field in (("this process", "rss_mb"), ("the acquisition process", "child_rss_mb")):
+        mb = np.array([getattr(s, field) for s in samples])
+        if not np.all(np.isfinite(mb)) or np.ptp(hours) == 0:
+            continue
+        slope = np.polyfit(hours, mb, 1)[0]
+        growth = mb[-1] - mb[0]
+        if slope > leak_mb_per_hour and growth > min_growth_mb:
+            flags[field] = "Memory of {} grows by {:.1f} MB/h ({:.1f} MB to {:.1f} MB)".format(name, slope, mb[0], mb[-1])
+
+    recent = float(np.median([s.rate for s in last]))
+    if recent < (1 - rate_tolerance) * rate:
+        flags["rate"] = "Sample rate fell to {:.1f} Hz, {:.0%} of the board's {:.1f} Hz".format(recent, recent / rate, rate)
+
+    produced = samples[-1].num_samples - samples[0].num_samples
+    for field, message in (
+        ("num_lost", "{} frames of the board never reached the stream, which streamed {} samples"),
+        ("num_skipped", "{} of {} samples were skipped by the worker"),
+    ):
+        n = getattr(samples[-1], field) - getattr(samples[0], field)
+        if produced > 0 and n > loss_tolerance * produced:
+            flags[field] = message.format(n, produced)
+
+    before = np.array([s.latency_p99_ms for s in first])
+    after = np.array([s.latency_p99_ms for s in last])
+    if np.any(np.isfinite(before)) and np.any(np.isfinite(after)):
+        before, after = np.nanmedian(before), np.nanmedian(after)
+        if after > latency_factor * before:
+            flags["latency"] = "p99 latency rose from {:.2f} ms to {:.2f} ms".format(before, after)
+    return flags
+
+
+def main():
+    # fmt: off
+    parser = argparse.ArgumentParser(description="Soak-test acquisition and its consumers against a simulated board")
+    parser.add_argument("-o", "--output", type=str, help="JSON lines log of the samples", default="soak.jsonl")
+    parser.add_argument("--backend", type=str, choices=BACKENDS, help="Stream under test", default="process")
+    parser.add_argument("-n", "--num_mags", type=int, help="Number of magnetometers of the simulated board", default=5)
+    parser.add_argument("--rate", type=float, help="Frames per second sent by the simulated board", default=1000.0)
+    parser.add_argument("-m", "--model", type=str, help="Classifier, as accepted by load_predictor; defaults to a synthetic network")
+    parser.add_argument("--max_batch", type=int, help="Batch size limit of the inference worker", default=1024)
+    parser.add_argument("--record_every", type=float, help="Seconds between the starts of recordings fetched with get_buffer", default=30.0)
+    parser.add_argument("--record_length", type=float, help="Seconds every recording lasts", default=10.0)
+    parser.add_argument("--hours", type=float, help="Length of the run", default=4.0)
+    parser.add_argument("--interval", type=float, help="Seconds between samples", default=60.0)
+    parser.add_argument("--warmup", type=float, help="Seconds ignored when looking for trends", default=300.0)
+    parser.add_argument("--leak", type=float, help="Memory growth flagged as a leak, in MB/h", default=10.0)
+    parser.add_argument("--quick", action="store_true", help="A two-minute run sampled every 5 s with short recordings, for a quick check")
+    args = parser.parse_args()
+    # fmt: on
+
+    if args.quick:
+        args.hours, args.interval, args.warmup = 2 / 60, 5.0, 30.0
+        args.record_every, args.record_length = 10.0, 3.0
+    model = None
+    if args.model is not None:
+        from .infer import load_predictor
+
+        model = load_predictor(args.model)
+
+    test = SoakTest(args.backend, model, args.num_mags, args.rate, args.max_batch, args.record_every, args.record_length)
+    settings = {key: value for key, value in vars(args).items() if key not in ("output", "quick")}
+    flags = {}
+    with open(args.output, "w") as log:
+        log.write(json.dumps({"environment": environment(), "settings": settings}) + "\n")
+        test.start()
+        print("{:>9s} {:>9s} {:>9s} {:>9s} {:>7s} {:>8s} {:>9s} {:>9s}".format(
+            "elapsed_s", "rss_mb", "child_mb", "rate_hz", "lost", "skipped", "p50_ms", "p99_ms"
+        ))
+        try:
+            stop = time.time() + args.hours * 3600
+            while time.time() < stop:
+                time.sleep(min(args.interval, max(stop - time.time(), 0)))
+                sample = test.sample()
+                log.write(json.dumps(sample._asdict()) + "\n")
+                log.flush()
+                print("{:9.0f} {:9.1f} {:9.1f} {:9.1f} {:7d} {:8d} {:9.2f} {:9.2f}".format(
+                    sample.elapsed, sample.rss_mb, sample.child_rss_mb, sample.rate,
+                    sample.num_lost, sample.num_skipped, sample.latency_p50_ms, sample.latency_p99_ms,
+                ))
+                found = check(test.samples, args.rate, args.warmup, args.leak)
+                for key in found.keys() - flags.keys():
+                    print("Warning: " + found[key])
+                # Keep problems that cleared up later, e.g. a temporary rate drop
+                flags.update(found)
+        except KeyboardInterrupt:
+            print("Interrupted")
+        finally:
+            test.stop()
+        log.write(json.dumps({"flags": list(flags.values())}) + "\n")
+
+    print("Samples written to {}".format(args.output))
+    if flags:
+        print("Problems found:")
+        for flag in flags.values():
+            print("- " + flag)
+        return 1
+    print("No leak or degradation found")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
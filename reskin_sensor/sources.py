@@ -0,0 +1,684 @@
+"""
+Interchangeable sources of sensor data.
+
+Every tool reads its data through the reading API of ReSkinProcess:
+start, is_alive, join, sample_cnt, last_reading, get_data, read_since,
+start_buffering, pause_buffering, get_buffer and mark. Besides
+ReSkinProcess on one serial port, this module provides the same API for
+
+- SerialSource: one serial port read by a thread of this process, which
+  avoids copying samples between processes
+- MultiSource: several boards, e.g. on different ports, seen as one
+  board with all their magnetometers
+- SimulatedSource: synthetic readings at a fixed rate with scripted
+  presses, for running tools without hardware
+- ReplaySource: a saved recording, paced in real time or as fast as
+  possible, for benchmarking and regression-testing on real sessions
+
+and server.ReSkinClient reads a stream shared by reskin-serve.
+add_source_arguments and source_from_args let every script choose its
+source on the command line.
+"""
+import collections
+import threading
+import time
+
+import numpy as np
+
+from .ring import SampleRing
+from .sensor import ReSkinData
+from .sensor_proc import Mark, ReSkinProcess
+
+# A scripted press: from `start` s after the source starts, for `duration` s,
+# the field of `chip` changes by up to `amplitude` along z
+Press = collections.namedtuple("Press", "start, duration, chip, amplitude, label")
+
+
+class StreamSource:
+    """
+    Base class of the sources that produce samples in a background thread.
+
+    Subclasses implement _run, which calls _publish with blocks of rows of
+    [time, acq_delay, data...] until stop_requested is set. Sequence
+    numbers count the samples published, as for ReSkinProcess.
+
+    Attributes
+    ----------
+    num_mags : int
+        Number of magnetometers
+    temp_filtered : bool
+        Whether the stream has no temperature channels
+    device_id : int
+        Sensor ID attached to returned samples
+    reskin_data_struct : bool
+        Return samples as ReSkinData instead of arrays
+
+    Methods
+    -------
+    start():
+        Start producing samples
+    join():
+        Stop producing samples
+    get_data(num_samples=5):
+        Return a specified number of samples
+    start_buffering(overwrite=False):
+        Start buffering samples
+    pause_buffering():
+        Stop buffering samples
+    get_buffer(timeout=1.0, pause_if_buffering=False, return_seq=False):
+        Return the recorded buffer
+    read_since(seq, max_samples=None):
+        Return every sample produced since sequence number seq
+    mark(label):
+        Record a label change at the current position in the stream
+    """
+
+    def __init__(
+        self,
+        num_mags: int = None,
+        temp_filtered: bool = False,
+        device_id: int = -1,
+        reskin_data_struct: bool = True,
+        ring_size: int = 4096,
+    ):
+        self.temp_filtered = temp_filtered
+        self.device_id = device_id
+        self.reskin_data_struct = reskin_data_struct
+        self.ring_size = ring_size
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._buffering = False
+        self._buffer = []
+        self._buffer_seq = []
+        self._marks = []
+        if num_mags is not None:
+            self._set_layout(num_mags, temp_filtered)
+
+    def _set_layout(self, num_mags, temp_filtered):
+        self.num_mags = num_mags
+        self.temp_filtered = temp_filtered
+        self._ring = SampleRing(self.ring_size, 2 + num_mags * (4 - temp_filtered))
+
+    @property
+    def stop_requested(self):
+        return self._stop.is_set()
+
+    def start(self):
+        """Start producing samples"""
+        self._thread = threading.Thread(target=self._run_and_wake, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run_and_wake(self):
+        try:
+            self._run()
+        finally:
+            with self._cond:
+                self._cond.notify_all()
+
+    def _run(self):
+        raise NotImplementedError
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout=None):
+        """Stop producing samples"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _publish(self, rows, seq=None):
+        """
+        Append a block of rows; seq optionally gives the sequence number of
+        every row to record in the buffer instead of the local count
+        """
+        if rows.shape[0] == 0:
+            return
+        with self._cond:
+            if seq is None:
+                seq = np.arange(self._ring.count, self._ring.count + rows.shape[0])
+            self._ring.extend(rows)
+            if self._buffering:
+                self._buffer.extend(self._format(row) for row in rows)
+                self._buffer_seq.extend(np.asarray(seq).tolist())
+            self._cond.notify_all()
+
+    def _format(self, row):
+        if self.reskin_data_struct:
+            return ReSkinData(time=row[0], acq_delay=row[1], data=row[2:].tolist(), dev_id=self.device_id)
+        return np.concatenate((row, [self.device_id]))
+
+    @property
+    def sample_cnt(self):
+        return self._ring.count
+
+    @property
+    def last_reading(self):
+        rows = self._ring.latest(1)
+        return self._format(rows[0]) if len(rows) else None
+
+    @property
+    def marks(self):
+        """Labels recorded with mark(), as a list of Mark(seq, label, time)"""
+        return list(self._marks)
+
+    def get_data(self, num_samples=5):
+        """
+        Return a specified number of samples: the latest one and the
+        num_samples - 1 that follow it
+        """
+        if num_samples <= 0:
+            return []
+        with self._cond:
+            while self._ring.count == 0 and self.is_alive():
+                self._cond.wait(0.1)
+            start = max(self._ring.count - 1, 0)
+            while self._ring.count < start + num_samples and self.is_alive():
+                self._cond.wait(0.1)
+        rows, _ = self._ring.read_since(start, num_samples)
+        return [self._format(row) for row in rows[:num_samples]]
+
+    def read_since(self, seq: int, max_samples: int = None):
+        """Return every sample produced since sequence number seq; see ReSkinProcess.read_since"""
+        return self._ring.read_since(seq, max_samples)
+
+    def start_buffering(self, overwrite: bool = False):
+        """Start buffering samples"""
+        with self._cond:
+            if self._buffering:
+                print("Warning: Data is already buffering")
+                return
+            if overwrite:
+                self._buffer, self._buffer_seq = [], []
+            self._buffering = True
+
+    def pause_buffering(self):
+        """Stop buffering samples"""
+        with self._cond:
+            self._buffering = False
+
+    def get_buffer(self, timeout: float = 1.0, pause_if_buffering: bool = False, return_seq: bool = False):
+        """Return the recorded buffer; see ReSkinProcess.get_buffer"""
+        with self._cond:
+            if self._buffering:
+                if not pause_if_buffering:
+                    print(
+                        "Cannot get buffer while data is buffering. Set "
+                        "pause_if_buffering=True to pause buffering and "
+                        "retrieve buffer"
+                    )
+                    return
+                self._buffering = False
+            rtn, seq = self._buffer, self._buffer_seq
+            self._buffer, self._buffer_seq = [], []
+        if return_seq:
+            return rtn, np.array(seq, dtype=np.int64)
+        return rtn
+
+    def mark(self, label):
+        """Record a label change; applies from the next sample produced"""
+        mark = Mark(seq=self._ring.count, label=label, time=time.time())
+        self._marks.append(mark)
+        return mark.seq
+
+
+class SerialSource(StreamSource):
+    """
+    Reads a board's serial port in a thread of this process.
+
+    Every read takes all bytes the port has received and decodes the
+    frames they complete at once, with aio.FrameDecoder; the frames of one
+    read share its arrival time. Compared with ReSkinProcess this saves the
+    copy through a pipe and the busy-waiting poll of the port, but decoding
+    shares the interpreter with the consumers.
+
+    Attributes
+    ----------
+    port : str
+        Serial port the board is connected to
+    baudrate : int
+        Baudrate of the port
+    burst_mode : bool
+        Whether the board streams binary frames instead of text lines
+    """
+
+    def __init__(
+        self,
+        port: str,
+        num_mags: int = 1,
+        baudrate: int = 115200,
+        burst_mode: bool = True,
+        device_id: int = -1,
+        temp_filtered: bool = False,
+        reskin_data_struct: bool = True,
+        ring_size: int = 4096,
+        read_timeout: float = 0.01,
+    ):
+        from .aio import FrameDecoder
+
+        super().__init__(num_mags, temp_filtered, device_id, reskin_data_struct, ring_size)
+        self.port = port
+        self.baudrate = baudrate
+        self.burst_mode = burst_mode
+        self.read_timeout = read_timeout
+        self._decoder = FrameDecoder(num_mags, burst_mode, temp_filtered)
+
+    def _run(self):
+        import serial
+
+        with serial.Serial(port=self.port, baudrate=self.baudrate, timeout=self.read_timeout) as ser:
+            # Start from fresh data, not whatever the port buffered
+            ser.reset_input_buffer()
+            while not self.stop_requested:
+                # Blocks for the first byte, then takes whatever else arrived
+                data = ser.read(1)
+                if not data:
+                    continue
+                data += ser.read(ser.in_waiting)
+                self._publish(self._decoder.feed(data, time.time()))
+
+
+class MultiSource(StreamSource):
+    """
+    Several sensor streams seen as one board.
+
+    The channels of all streams are concatenated in the order given, so
+    chip m of the second stream is chip num_mags_0 + m of the result. The
+    first stream sets the pace: every one of its samples produces one
+    combined sample, holding the latest reading of every other stream
+    taken at or before it.
+
+    Parameters
+    ----------
+    streams : list
+        Sources to combine, e.g. one ReSkinProcess per port; they are
+        started and joined with this source
+    poll_interval : float
+        Seconds between reads of the streams
+    """
+
+    def __init__(self, streams, poll_interval: float = 0.002, device_id: int = -1, reskin_data_struct: bool = True, ring_size: int = 4096):
+        if len({bool(s.temp_filtered) for s in streams}) > 1:
+            raise ValueError("Cannot combine temperature-filtered and unfiltered streams")
+        super().__init__(
+            num_mags=sum(s.num_mags for s in streams),
+            temp_filtered=bool(streams[0].temp_filtered),
+            device_id=device_id,
+            reskin_data_struct=reskin_data_struct,
+            ring_size=ring_size,
+        )
+        self.streams = list(streams)
+        self.poll_interval = poll_interval
+
+    def start(self):
+        for stream in self.streams:
+            stream.start()
+        return super().start()
+
+    def join(self, timeout=None):
+        super().join(timeout)
+        for stream in self.streams:
+            stream.join(timeout)
+
+    def _run(self):
+        seqs = [s.sample_cnt for s in self.streams]
+        held = [None] * len(self.streams)
+        while not self.stop_requested and all(s.is_alive() for s in self.streams):
+            blocks = []
+            for i, stream in enumerate(self.streams):
+                rows, seqs[i] = stream.read_since(seqs[i])
+                blocks.append(rows)
+            paced = blocks[0]
+            if held[0] is not None and len(paced) and all(h is not None for h in held[1:]):
+                out = np.empty((len(paced), self._ring.width))
+                out[:, :2] = paced[:, :2]
+                col = 2
+                for i, rows in enumerate(blocks):
+                    if i == 0:
+                        values = paced[:, 2:]
+                    else:
+                        # Latest reading of stream i at or before every paced sample
+                        candidates = np.concatenate((held[i][None], rows))
+                        idx = np.searchsorted(candidates[:, 0], paced[:, 0], side="right") - 1
+                        values = candidates[np.maximum(idx, 0), 2:]
+                    out[:, col : col + values.shape[1]] = values
+                    col += values.shape[1]
+                self._publish(out)
+            for i, rows in enumerate(blocks):
+                if len(rows):
+                    held[i] = rows[-1]
+            time.sleep(self.poll_interval)
+
+
+class SimulatedSource(StreamSource):
+    """
+    Synthetic sensor readings at a fixed rate.
+
+    Every channel rests at a random baseline with Gaussian noise; during a
+    scripted press the field of the pressed chip changes along z following
+    a raised cosine, and its neighbours change by a third as much. Samples
+    are timestamped with the time they are scheduled for, so the presses
+    are known exactly relative to the stream.
+
+    Attributes
+    ----------
+    presses : list
+        Scripted presses, as Press(start, duration, chip, amplitude, label)
+    start_time : float
+        Wall-clock time of the first sample, once started
+
+    Methods
+    -------
+    label_at(times):
+        Label of the press active at the given times, -1 if none
+    """
+
+    def __init__(
+        self,
+        num_mags: int = 5,
+        rate: float = 1000.0,
+        noise: float = 2.0,
+        presses=None,
+        seed: int = None,
+        temp_filtered: bool = False,
+        device_id: int = -1,
+        reskin_data_struct: bool = True,
+        ring_size: int = 4096,
+        block_interval: float = 0.001,
+    ):
+        """
+        Parameters
+        ----------
+        rate : float
+            Samples per second
+        noise : float
+            Standard deviation of the noise, in the units of the readings
+        presses : list
+            Scripted presses, not overlapping; see random_presses
+        seed : int
+            Seed of the noise and baselines
+        block_interval : float
+            Seconds between produced blocks
+        """
+        super().__init__(num_mags, temp_filtered, device_id, reskin_data_struct, ring_size)
+        self.rate = rate
+        self.noise = noise
+        self.presses = sorted(presses or [], key=lambda press: press.start)
+        self._starts = np.array([press.start for press in self.presses], dtype=float)
+        self._ends = np.array([press.start + press.duration for press in self.presses], dtype=float)
+        self._labels = np.array([press.label for press in self.presses], dtype=int)
+        self.block_interval = block_interval
+        self.start_time = None
+        self._rng = np.random.default_rng(seed)
+        per_chip = 4 - temp_filtered
+        self._baseline = self._rng.uniform(-300, 300, size=num_mags * per_chip)
+        if not temp_filtered:
+            self._baseline[::4] = self._rng.uniform(25, 35, size=num_mags)
+        # Column of the z field of every chip
+        self._z_columns = np.arange(num_mags) * per_chip + per_chip - 1
+
+    def label_at(self, times):
+        """Label of the press active at the given wall-clock times, -1 if none"""
+        times = np.asarray(times, dtype=float) - (self.start_time or 0.0)
+        labels = np.full(times.shape, -1)
+        if not self.presses:
+            return labels
+        idx = np.searchsorted(self._starts, times, side="right") - 1
+        active = (idx >= 0) & (times < self._ends[np.maximum(idx, 0)])
+        labels[active] = self._labels[idx[active]]
+        return labels
+
+    def signal(self, t):
+        """(n, num_channels) noise-free readings at times t after the start"""
+        t = np.asarray(t, dtype=float)
+        values = np.repeat(self._baseline[None], t.shape[0], axis=0)
+        if not self.presses or t.shape[0] == 0:
+            return values
+        # Only the presses overlapping this block
+        first = np.searchsorted(self._ends, t[0], side="right")
+        last = np.searchsorted(self._starts, t[-1], side="right")
+        for press in self.presses[first:last]:
+            phase = (t - press.start) / press.duration
+            active = (phase >= 0) & (phase < 1)
+            if not np.any(active):
+                continue
+            envelope = 0.5 - 0.5 * np.cos(2 * np.pi * phase[active])
+            for chip in range(self.num_mags):
+                weight = 1.0 if chip == press.chip else (1 / 3 if abs(chip - press.chip) == 1 else 0.0)
+                if weight:
+                    values[active, self._z_columns[chip]] += weight * press.amplitude * envelope
+        return values
+
+    def _run(self):
+        self.start_time = time.time()
+        produced = 0
+        while not self.stop_requested:
+            due = int((time.time() - self.start_time) * self.rate) + 1
+            if due > produced:
+                t = np.arange(produced, due) / self.rate
+                rows = np.empty((t.shape[0], self._ring.width))
+                rows[:, 0] = self.start_time + t
+                rows[:, 1] = 0.0
+                rows[:, 2:] = self.signal(t) + self._rng.normal(0, self.noise, size=(t.shape[0], self._ring.width - 2))
+                self._publish(rows)
+                produced = due
+            time.sleep(self.block_interval)
+
+
+def random_presses(duration: float, num_mags: int, interval: float = 2.0, press_duration: float = 0.5, amplitude: float = 400.0, seed: int = None):
+    """
+    Presses at random chips every `interval` s for `duration` s; the label
+    of a press is its chip + 1, so 0 can mean no press
+    """
+    rng = np.random.default_rng(seed)
+    starts = np.arange(interval, duration - press_duration, interval)
+    return [
+        Press(start=float(s), duration=press_duration, chip=int(c), amplitude=amplitude, label=int(c) + 1)
+        for s, c in zip(starts, rng.integers(0, num_mags, size=starts.shape[0]))
+    ]
+
+
+class ReplaySource(StreamSource):
+    """
+    Replays a recording saved as an .npy array.
+
+    The recording holds one row per sample, [time, acq_delay, data...],
+    optionally followed by the device ID as saved from get_buffer with
+    reskin_data_struct=False. Timestamps are shifted to the time of
+    replay, so latencies measured downstream are meaningful.
+
+    Attributes
+    ----------
+    speed : float
+        Replay speed relative to the recording; None replays as fast as
+        possible, block_size samples at a time
+    loop : bool
+        Start over at the end of the recording instead of stopping
+    num_replayed : int
+        Samples replayed so far
+    """
+
+    def __init__(
+        self,
+        path: str,
+        num_mags: int,
+        speed: float = 1.0,
+        loop: bool = False,
+        block_size: int = 256,
+        device_id: int = -1,
+        reskin_data_struct: bool = True,
+        ring_size: int = 4096,
+        block_interval: float = 0.001,
+        temp_filtered: bool = None,
+        has_device_id: bool = None,
+    ):
+        """
+        Parameters
+        ----------
+        temp_filtered : bool
+            Whether the recording has no temperature channels; None infers
+            it from the number of columns
+        has_device_id : bool
+            Whether the recording ends with a device ID column; None infers
+            it from the number of columns
+
+        Raises
+        ------
+        ValueError
+            If the columns do not fit num_mags, or fit more than one layout
+        """
+        data = np.load(path, mmap_mode="r")
+        if data.ndim != 2:
+            raise ValueError("Expected an (N, num_columns) recording, got shape {}".format(data.shape))
+        layouts = [
+            (per_chip, extra)
+            for per_chip in (4, 3)
+            for extra in (2, 3)
+            if temp_filtered in (None, per_chip == 3)
+            and has_device_id in (None, extra == 3)
+            and data.shape[1] == per_chip * num_mags + extra
+        ]
+        if not layouts:
+            raise ValueError("A recording of {} columns does not fit {} magnetometers".format(data.shape[1], num_mags))
+        if len(layouts) > 1:
+            # e.g. one chip with temperature, or one without but with a device ID
+            raise ValueError(
+                "A recording of {} columns is ambiguous for {} magnetometers; "
+                "pass temp_filtered or has_device_id".format(data.shape[1], num_mags)
+            )
+        per_chip = layouts[0][0]
+        super().__init__(num_mags, per_chip == 3, device_id, reskin_data_struct, ring_size)
+        self.path = path
+        self.data = data
+        self.speed = speed if speed else None
+        self.loop = loop
+        self.block_size = block_size
+        self.block_interval = block_interval
+        self.num_replayed = 0
+        self._num_columns = per_chip * num_mags + 2
+
+    def _run(self):
+        times = np.asarray(self.data[:, 0], dtype=float)
+        n = times.shape[0]
+        while not self.stop_requested:
+            start_wall = time.time()
+            pos = 0
+            while pos < n and not self.stop_requested:
+                if self.speed is None:
+                    stop = min(pos + self.block_size, n)
+                else:
+                    elapsed = (time.time() - start_wall) * self.speed
+                    stop = int(np.searchsorted(times, times[0] + elapsed, side="right"))
+                    if stop <= pos:
+                        time.sleep(self.block_interval)
+                        continue
+                rows = np.array(self.data[pos:stop, : self._num_columns], dtype=float)
+                if self.speed is None:
+                    rows[:, 0] = time.time()
+                else:
+                    rows[:, 0] = start_wall + (rows[:, 0] - times[0]) / self.speed
+                self._publish(rows)
+                self.num_replayed += rows.shape[0]
+                pos = stop
+            if not self.loop:
+                break
+
+
+def add_source_arguments(parser, board: bool = True, required: bool = True):
+    """
+    Add the options choosing a source to an argparse parser
+
+    Exactly one of --port (one or more serial ports), --simulate, --replay
+    or --connect selects the source.
+
+    Parameters
+    ----------
+    board : bool
+        Also add --num_mags and --temp_filtered
+    required : bool
+        Require a source to be chosen
+    """
+    # fmt: off
+    group = parser.add_mutually_exclusive_group(required=required)
+    group.add_argument("-p", "--port", type=str, nargs="+", help="Port(s) to which the microcontroller(s) are connected; several ports are combined into one board")
+    group.add_argument("--simulate", action="store_true", help="Use simulated data with a press every few seconds")
+    group.add_argument("--replay", type=str, help="Replay an .npy recording; add -tf if it has no temperature channels")
+    group.add_argument("--connect", type=str, help="Read the stream of a reskin-serve server at this address")
+    parser.add_argument("--thread", action="store_true", help="Read the port(s) in a thread instead of a separate process")
+    parser.add_argument("-b", "--baudrate", type=int, help="Baudrate at which the microcontroller is streaming data", default=115200)
+    if board:
+        parser.add_argument("-n", "--num_mags", type=int, help="Number of magnetometers on the sensor board (per port)", default=5)
+        parser.add_argument("-tf", "--temp_filtered", action="store_true", help="Flag to filter temperature from sensor output")
+    parser.add_argument("--rate", type=float, help="Sample rate of simulated data, in Hz", default=1000.0)
+    parser.add_argument("--speed", type=float, help="Replay speed; 0 replays as fast as possible", default=1.0)
+    parser.add_argument("--loop", action="store_true", help="Replay the recording in a loop")
+    # fmt: on
+
+
+def source_from_args(args, device_id: int = 1, **kwargs):
+    """
+    Create the source chosen with add_source_arguments; not yet started
+
+    Further keyword arguments, e.g. ring_size or reskin_data_struct, are
+    passed on to the source. Use the source's num_mags, which counts the
+    magnetometers of all ports, rather than args.num_mags. A temp_filtered
+    keyword applies to live sources only; a replayed recording follows -tf
+    if the parser has that option, and is inferred from its columns if not.
+    """
+    temp_filtered = kwargs.pop("temp_filtered", getattr(args, "temp_filtered", False))
+    if args.simulate:
+        return SimulatedSource(
+            num_mags=args.num_mags,
+            rate=args.rate,
+            presses=random_presses(24 * 3600, args.num_mags),
+            temp_filtered=temp_filtered,
+            device_id=device_id,
+            **kwargs,
+        )
+    if args.replay is not None:
+        return ReplaySource(
+            args.replay,
+            args.num_mags,
+            speed=args.speed,
+            loop=args.loop,
+            device_id=device_id,
+            temp_filtered=getattr(args, "temp_filtered", None),
+            **kwargs,
+        )
+    if args.connect is not None:
+        from .server import ReSkinClient
+
+        return ReSkinClient(args.connect, **kwargs)
+
+    if getattr(args, "thread", False):
+        kwargs.pop("chunk_size", None)
+        streams = [
+            SerialSource(
+                port,
+                num_mags=args.num_mags,
+                baudrate=args.baudrate,
+                device_id=device_id,
+                temp_filtered=temp_filtered,
+                **kwargs,
+            )
+            for port in args.port
+        ]
+    else:
+        streams = [
+            ReSkinProcess(
+                num_mags=args.num_mags,
+                port=port,
+                baudrate=args.baudrate,
+                burst_mode=True,
+                device_id=device_id,
+                temp_filtered=temp_filtered,
+                **kwargs,
+            )
+            for port in args.port
+        ]
+    if len(streams) == 1:
+        return streams[0]
+    kwargs.pop("chunk_size", None)
+    return MultiSource(streams, device_id=device_id, **kwargs)
@@ -0,0 +1,270 @@
+import collections
+
+import numpy as np
+
+from .features import feature_names, features_to_mags
+from .filters import StreamFilter
+from .segments import extract_segments
+
+# Statistics over the window, in output order
+WINDOW_FEATURES = ("mean", "slope", "peak", "energy", "magnitude")
+
+
+def window_feature_names(num_mags: int, features=WINDOW_FEATURES):
+    """Column names matching the output of WindowFeatures"""
+    names = []
+    for stat in features:
+        if stat == "magnitude":
+            names += ["mag{}".format(m) for m in range(num_mags)]
+        else:
+            names += ["{}_{}".format(stat, name) for name in feature_names(num_mags)]
+    return names
+
+
+class WindowFeatures(StreamFilter):
+    """
+    Statistics of the frame features over the last `window` samples.
+
+    Takes (N, 3 * num_mags) frame features (see features.frame_features)
+    and returns one row per sample with, for the window ending at that
+    sample:
+
+    - mean: mean of every feature
+    - slope: least-squares slope of every feature, per sample
+    - peak: largest absolute value of every feature
+    - energy: mean square of every feature
+    - magnitude: mean field magnitude of every chip
+
+    Like the other stream filters the start of the stream is padded with
+    the first sample, and feeding a recording block by block gives the
+    same result as feeding it at once. The sums over the window are kept
+    between blocks and updated as samples enter and leave it, and the
+    peak is kept in a monotonic queue per feature (blocks of at least a
+    window use the van Herk/Gil-Werman running maximum instead), so the
+    cost per sample does not depend on the window length, even for
+    single-sample blocks. The sums are recomputed from the window every
+    `window` samples so rounding errors do not build up over a long
+    stream. Training (window_features) and live inference use this same
+    code, so their features are identical.
+
+    Parameters
+    ----------
+    num_mags : int
+        Number of magnetometers on the board
+    window : int
+        Number of samples per window
+    features : tuple
+        Statistics to compute, a subset of WINDOW_FEATURES
+    """
+
+    def __init__(self, num_mags: int, window: int, features=WINDOW_FEATURES):
+        if window < 2:
+            raise ValueError("window must be at least 2 samples")
+        unknown = set(features) - set(WINDOW_FEATURES)
+        if unknown:
+            raise ValueError("Unknown window features {}".format(sorted(unknown)))
+        self.num_mags = num_mags
+        self.window = window
+        self.features = tuple(features)
+        k = np.arange(window, dtype=float)
+        self._slope_den = np.sum(np.square(k - k.mean()))
+        self.reset()
+
+    @property
+    def num_features(self):
+        return len(window_feature_names(self.num_mags, self.features))
+
+    @property
+    def names(self):
+        return window_feature_names(self.num_mags, self.features)
+
+    def process(self, block):
+        block = np.asarray(block, dtype=float)
+        if block.shape[0] == 0:
+            return np.empty((0, self.num_features))
+        return super().process(block)
+
+    def _init_state(self, first_sample):
+        k = self.window
+        # The last k samples, a ring starting at _head; before the stream
+        # starts the window holds k copies of the first sample
+        self._rows = np.repeat(first_sample[None], k, axis=0)
+        self._head = 0
+        self._count = 0
+        self._refresh()
+        # (index, |value|) of every sample that may still be the peak of a
+        # later window, per feature, in decreasing order of value
+        self._peaks = [collections.deque([(-1, value)]) for value in np.abs(first_sample).tolist()]
+
+    def _ordered(self):
+        """The last window samples, oldest first"""
+        return np.roll(self._rows, -self._head, axis=0)
+
+    def _magnitudes(self, frames):
+        return np.sqrt(np.square(features_to_mags(frames, self.num_mags)).sum(axis=-1))
+
+    def _refresh(self):
+        """Recompute the running sums from the window"""
+        rows = self._ordered()
+        position = np.arange(self.window, dtype=float)[:, None]
+        self._sum = rows.sum(axis=0)
+        self._position_sum = (position * rows).sum(axis=0)
+        self._square_sum = np.square(rows).sum(axis=0)
+        self._magnitude_sum = self._magnitudes(rows).sum(axis=0)
+        self._since_refresh = 0
+
+    def _process(self, block):
+        k = self.window
+        n = block.shape[0]
+        # The sample that leaves the window as each sample of the block enters
+        leaving = self._rows[(self._head + np.arange(min(n, k))) % k]
+        if n > k:
+            leaving = np.concatenate((leaving, block[: n - k]), axis=0)
+        sums = self._sum + np.cumsum(block - leaving, axis=0)
+
+        out = []
+        for stat in self.features:
+            if stat == "mean":
+                out.append(sums / k)
+            elif stat == "slope":
+                # Sum of (position in window) * x: every sample moves down
+                # one position, the leaving one drops out at position 0 and
+                # the new one enters at position k - 1
+                previous = np.concatenate((self._sum[None], sums[:-1]), axis=0)
+                position_sums = self._position_sum + np.cumsum(leaving - previous + (k - 1) * block, axis=0)
+                self._position_sum = position_sums[-1]
+                out.append((position_sums - (k - 1) / 2 * sums) / self._slope_den)
+            elif stat == "peak":
+                out.append(self._running_peak(np.abs(block)))
+            elif stat == "energy":
+                square_sums = self._square_sum + np.cumsum(np.square(block) - np.square(leaving), axis=0)
+                self._square_sum = square_sums[-1]
+                out.append(square_sums / k)
+            elif stat == "magnitude":
+                magnitudes = self._magnitudes(np.concatenate((block, leaving), axis=0))
+                magnitude_sums = self._magnitude_sum + np.cumsum(magnitudes[:n] - magnitudes[n:], axis=0)
+                self._magnitude_sum = magnitude_sums[-1]
+                out.append(magnitude_sums / k)
+        self._sum = sums[-1]
+
+        keep = block[-k:]
+        self._rows[(self._head + np.arange(n - keep.shape[0], n)) % k] = keep
+        self._head = (self._head + n) % k
+        self._count += n
+        self._since_refresh += n
+        if self._since_refresh >= k:
+            self._refresh()
+        return np.concatenate(out, axis=1)
+
+    def _running_peak(self, block):
+        """Peak of every window ending in a block of absolute values"""
+        k = self.window
+        n = block.shape[0]
+        if n >= k:
+            window = np.abs(self._ordered())
+            peaks = _running_max(np.concatenate((window[1:], block), axis=0), k, n)
+            self._peaks = _max_queues(block[-k:], self._count + n - k)
+            return peaks
+        peaks = []
+        for i, row in enumerate(block.tolist(), start=self._count):
+            for queue, value in zip(self._peaks, row):
+                while queue and queue[-1][1] <= value:
+                    queue.pop()
+                queue.append((i, value))
+                if queue[0][0] <= i - k:
+                    queue.popleft()
+            peaks.append([queue[0][1] for queue in self._peaks])
+        return np.array(peaks)
+
+
+def _max_queues(x, first_index):
+    """Monotonic queues of the running maximum of every column after the rows x"""
+    later = np.full(x.shape, -np.inf)
+    later[:-1] = np.maximum.accumulate(x[::-1], axis=0)[::-1][1:]
+    queues = []
+    for column in range(x.shape[1]):
+        rows = np.flatnonzero(x[:, column] > later[:, column])
+        queues.append(collections.deque(zip((first_index + rows).tolist(), x[rows, column].tolist())))
+    return queues
+
+
+def _running_max(x, k, n):
+    """Maximum over the windows x[i:i + k] for i < n, in O(1) per row"""
+    num_blocks = -(-x.shape[0] // k)
+    blocks = np.full((num_blocks * k,) + x.shape[1:], -np.inf)
+    blocks[: x.shape[0]] = x
+    blocks = blocks.reshape((num_blocks, k) + x.shape[1:])
+    prefix = np.maximum.accumulate(blocks, axis=1).reshape((-1,) + x.shape[1:])
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape((-1,) + x.shape[1:])
+    # A window starting at i spans the end of i's block and the start of the next
+    return np.maximum(suffix[:n], prefix[k - 1 : k - 1 + n])
+
+
+def window_features(frames, num_mags: int, window: int, features=WINDOW_FEATURES, chunk_rows: int = 1 << 16):
+    """
+    Windowed features of a whole recording
+
+    Parameters
+    ----------
+    frames : array_like
+        (N, 3 * num_mags) frame features of one continuous recording
+    num_mags, window, features
+        See WindowFeatures
+    chunk_rows : int
+        Number of rows processed at a time
+
+    Returns
+    -------
+    np.ndarray
+        (N, num_features) features, identical to those computed live
+    """
+    extractor = WindowFeatures(num_mags, window, features)
+    frames = np.asarray(frames, dtype=float)
+    if frames.shape[0] == 0:
+        return extractor.process(frames)
+    return np.concatenate(
+        [extractor.process(frames[i : i + chunk_rows]) for i in range(0, frames.shape[0], chunk_rows)]
+    )
+
+
+def labelled_window_features(
+    frames, labels, num_mags: int, window: int, features=WINDOW_FEATURES, drop_partial: bool = True
+):
+    """
+    Windowed training features, computed separately for every labelled run
+
+    Windows never span a label change, so features of one class do not
+    leak into another.
+
+    Parameters
+    ----------
+    frames : array_like
+        (N, 3 * num_mags) frame features in recording order, e.g. the rows
+        of a CSV written by collect_data.py
+    labels : array_like
+        (N,) label of every row
+    num_mags, window, features
+        See WindowFeatures
+    drop_partial : bool
+        Drop the first window - 1 rows of every run, whose windows would be
+        padded
+
+    Returns
+    -------
+    X : np.ndarray
+        (n, num_features) features
+    y : np.ndarray
+        (n,) labels
+    """
+    frames = np.asarray(frames, dtype=float)
+    labels = np.asarray(labels)
+    X, y = [], []
+    for segment in extract_segments(labels, default=None):
+        run = window_features(frames[segment.start : segment.stop], num_mags, window, features)
+        if drop_partial:
+            run = run[window - 1 :]
+        X.append(run)
+        y.append(np.full(len(run), segment.label, dtype=labels.dtype))
+    if not X:
+        return np.empty((0, len(window_feature_names(num_mags, features)))), labels[:0]
+    return np.concatenate(X), np.concatenate(y)
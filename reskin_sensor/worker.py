@@ -0,0 +1,183 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+from .features import frame_features, split_readings
+
+Prediction = collections.namedtuple(
+    "Prediction", "seq, time, label, probabilities, in_contact, latency"
+)
+
+
+class InferenceWorker:
+    """
+    Classifies streamed samples in a background thread.
+
+    The worker drains all samples that arrived since its last pass from
+    ReSkinProcess.read_since, turns them into features and classifies them
+    with a single batched call, so inference keeps up with the sensor
+    rate no matter how fast the user interface redraws. With a detector,
+    only samples during a press are classified, so an idle sensor costs
+    no inference. The state after the newest sample is published in
+    `latest`, which the interface reads whenever it draws.
+
+    Attributes
+    ----------
+    latest : Prediction
+        State after the newest sample, or None: its sequence number, sensor
+        timestamp, the label and class probabilities of the newest
+        classified sample (None before the first), whether a press was in
+        progress, and the seconds from acquisition to result
+    num_predicted : int
+        Number of samples classified
+    num_dropped : int
+        Number of samples that were overwritten in the stream before the
+        worker could read them
+    events : collections.deque
+        Most recent contact events, if a detector is used
+
+    Methods
+    -------
+    start():
+        Start classifying in a background thread
+    stop():
+        Stop the background thread
+    step():
+        Classify the samples that arrived since the last step
+    """
+
+    def __init__(
+        self,
+        stream,
+        classify,
+        init_values,
+        num_mags: int,
+        smoother=None,
+        detector=None,
+        transform=None,
+        poll_interval: float = 0.002,
+        max_batch: int = 1024,
+    ):
+        """
+        Parameters
+        ----------
+        stream : ReSkinProcess
+            Started sensor stream
+        classify : callable
+            Called with an (N, num_features) block of features, returns the
+            (N, num_classes) class probabilities; called from the worker
+            thread
+        init_values : array_like
+            Calibrated baseline subtracted from every sample
+        num_mags : int
+            Number of magnetometers on the board
+        smoother : StreamFilter
+            Optional filter applied to the raw samples
+        detector : ContactDetector
+            Optional press detector fed with the features; if given, only
+            samples in contact are classified
+        transform : callable
+            Optional function of the (N, num_features) features of every
+            sample, e.g. a windowed feature extractor, whose result is
+            classified; called on every sample, in contact or not
+        poll_interval : float
+            Seconds to sleep when no new samples have arrived
+        max_batch : int
+            Classify at most this many of the newest samples per pass; older
+            ones are counted as dropped
+        """
+        self.stream = stream
+        self.classify = classify
+        self.init_values = np.asarray(init_values, dtype=float)
+        self.num_mags = num_mags
+        self.smoother = smoother
+        self.detector = detector
+        self.transform = transform
+        self.poll_interval = poll_interval
+        self.max_batch = max_batch
+
+        self.latest = None
+        self.num_predicted = 0
+        self.num_dropped = 0
+        self.events = collections.deque(maxlen=100)
+        self._seq = stream.sample_cnt
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start classifying in a background thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.step() == 0:
+                    time.sleep(self.poll_interval)
+            except Exception as e:
+                # Keep the interface alive, e.g. if a reloaded model is broken
+                print("Warning: inference failed: {}".format(e))
+                time.sleep(0.5)
+
+    def step(self):
+        """
+        Classify the samples that arrived since the last step
+
+        Returns
+        -------
+        int
+            Number of samples read
+        """
+        rows, next_seq = self.stream.read_since(self._seq, self.max_batch)
+        self.num_dropped += next_seq - len(rows) - self._seq
+        self._seq = next_seq
+        if len(rows) == 0:
+            return 0
+
+        values = rows[:, 2:]
+        if self.smoother is not None:
+            values = self.smoother.process(values)
+        _, mags = split_readings(values - self.init_values, self.num_mags)
+        features = frame_features(mags)
+
+        in_contact = False
+        contact_flags = None
+        if self.detector is not None:
+            self.events.extend(self.detector.process(features, times=rows[:, 0]))
+            in_contact = self.detector.in_contact
+            contact_flags = self.detector.contact_flags
+        if self.transform is not None:
+            features = self.transform(features)
+        if contact_flags is not None:
+            features = features[contact_flags]
+
+        previous = self.latest
+        label = probabilities = None
+        if previous is not None:
+            label, probabilities = previous.label, previous.probabilities
+        if len(features):
+            probabilities = np.asarray(self.classify(features))[-1]
+            label = int(np.argmax(probabilities))
+            self.num_predicted += len(features)
+        # A single assignment, so readers never see a mix of two results
+        self.latest = Prediction(
+            seq=next_seq - 1,
+            time=rows[-1, 0],
+            label=label,
+            probabilities=probabilities,
+            in_contact=in_contact,
+            latency=time.time() - rows[-1, 0],
+        )
+        return len(rows)
@@ -17,5 +17,6 @@ setup(
     packages=find_packages(),
     install_requires=["numpy>=1.21.3", "pyserial>=3.5"],
     python_requires=">=3.6",
+    entry_points={"console_scripts": ["reskin-serve=reskin_sensor.server:main"]},
     url="https://github.com/raunaqbhirangi/reskin_sensor.git",
 )
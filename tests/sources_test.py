@@ -0,0 +1,38 @@
+import argparse
+
+import numpy as np
+import pytest
+
+from reskin_sensor.sources import add_source_arguments, source_from_args
+
+NUM_MAGS = 5
+
+
+def heatmap_parser():
+    """The options of visualizations/heatmap.py that choose its source"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-nm", "--num-mags", type=int, required=True)
+    add_source_arguments(parser, board=False, required=False)
+    return parser
+
+
+@pytest.mark.parametrize("temp_filtered", [False, True])
+def test_heatmap_replays_either_layout(tmp_path, temp_filtered):
+    # [time, acq_delay, data..., device ID], as saved by get_buffer
+    num_columns = (3 if temp_filtered else 4) * NUM_MAGS + 3
+    path = str(tmp_path / "recording.npy")
+    np.save(path, np.zeros((10, num_columns)))
+    args = heatmap_parser().parse_args(["-nm", str(NUM_MAGS), "--replay", path])
+    # heatmap.py asks for filtered live sources, but a recording keeps its layout
+    source = source_from_args(args, temp_filtered=True, reskin_data_struct=False)
+    assert source.temp_filtered == temp_filtered
+
+
+def test_replay_follows_temp_filtered_option(tmp_path):
+    path = str(tmp_path / "recording.npy")
+    np.save(path, np.zeros((10, 4 * NUM_MAGS + 2)))
+    parser = argparse.ArgumentParser()
+    add_source_arguments(parser)
+    with pytest.raises(ValueError):
+        source_from_args(parser.parse_args(["--replay", path, "-tf"]))
+    assert not source_from_args(parser.parse_args(["--replay", path])).temp_filtered
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+
+from reskin_sensor.features import features_to_mags
+from reskin_sensor.windows import WindowFeatures, window_features
+
+NUM_MAGS = 5
+
+
+def reference_features(frames, window):
+    """WindowFeatures computed directly on every window"""
+    padded = np.concatenate((np.repeat(frames[:1], window - 1, axis=0), frames), axis=0)
+    windows = sliding_window_view(padded, window, axis=0)  # (N, features, window)
+    position = np.arange(window) - (window - 1) / 2
+    magnitudes = np.linalg.norm(features_to_mags(padded, NUM_MAGS), axis=-1)
+    return np.concatenate(
+        [
+            windows.mean(axis=-1),
+            (windows * position).sum(axis=-1) / np.square(position).sum(),
+            np.abs(windows).max(axis=-1),
+            np.square(windows).mean(axis=-1),
+            sliding_window_view(magnitudes, window, axis=0).mean(axis=-1),
+        ],
+        axis=1,
+    )
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    # An offset keeps the running sums far from zero, where rounding shows most
+    return rng.normal(size=(1500, 3 * NUM_MAGS)) * 100 + 300
+
+
+@pytest.mark.parametrize("window", [2, 7, 64, 500])
+def test_matches_sliding_windows(frames, window):
+    expected = reference_features(frames, window)
+    np.testing.assert_allclose(window_features(frames, NUM_MAGS, window), expected, rtol=1e-9, atol=1e-8)
+
+
+@pytest.mark.parametrize("window", [2, 7, 64, 500])
+def test_one_sample_at_a_time(frames, window):
+    expected = reference_features(frames, window)
+    extractor = WindowFeatures(NUM_MAGS, window)
+    online = np.concatenate([extractor.process(frames[i : i + 1]) for i in range(frames.shape[0])])
+    np.testing.assert_allclose(online, expected, rtol=1e-9, atol=1e-8)
+
+
+def test_blocks_of_any_size(frames):
+    window = 50
+    expected = reference_features(frames, window)
+    extractor = WindowFeatures(NUM_MAGS, window)
+    sizes = np.random.default_rng(1).integers(0, 3 * window, size=frames.shape[0])
+    bounds = np.concatenate(([0], np.cumsum(sizes)))
+    blocks = [extractor.process(frames[a:b]) for a, b in zip(bounds[:-1], bounds[1:]) if a < frames.shape[0]]
+    np.testing.assert_allclose(np.concatenate(blocks), expected, rtol=1e-9, atol=1e-8)
+
+
+def test_feature_subset(frames):
+    window = 10
+    expected = reference_features(frames, window)
+    columns = 3 * NUM_MAGS
+    peak = slice(2 * columns, 3 * columns)
+    extractor = WindowFeatures(NUM_MAGS, window, features=("peak",))
+    np.testing.assert_allclose(extractor.process(frames), expected[:, peak], rtol=1e-9, atol=1e-8)
+    assert extractor.names[0].startswith("peak_")
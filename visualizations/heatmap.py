@@ -1,138 +1,185 @@
-from collections import deque
 import time
 
 import argparse
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
+from matplotlib.ticker import FuncFormatter
 import numpy as np
 
-from reskin_sensor import ReSkinProcess
+from reskin_sensor.features import channel_names
+from reskin_sensor.live_plot import HistoryBuffer
+from reskin_sensor.lod import MinMaxPyramid, envelope_line
+from reskin_sensor.sources import add_source_arguments, source_from_args
 
 
-def plot_heatmap(data, num_mags):
-    data_dim = data.shape[-1]
-
-    data_mask = np.zeros((data_dim,), dtype=bool)
-    data_mask[2:-1] = True
+def data_mask(data_dim, num_mags):
+    """Columns with magnetic field readings in a saved (N, data_dim) recording"""
+    mask = np.zeros((data_dim,), dtype=bool)
+    mask[2:-1] = True
 
     # Filter temperature if required
     if data_dim == 4 * num_mags + 3:
-        data_mask[2:-1:4] = False
-
-    fig, axs = plt.subplots(2, 1, figsize=(8, 16))
-
-    filt_data = data[..., data_mask]
-    times = data[..., 0] - data[0, 0]
-    axs[0].plot(times, filt_data)
-    axs[0].set_xlabel("Time, in s")
-    pc = axs[1].pcolormesh(filt_data.T)
-
-    xticks = np.arange(0, data.shape[0], max(1, data.shape[0] // 10))
-    axs[1].set_xlabel("Time, in s")
-    axs[1].set_xticks(xticks)
-    axs[1].set_xticklabels(["{:.2f}".format(times[i]) for i in xticks])
-    axs[1].set_yticks(np.linspace(0.5, num_mags * 3 - 0.5, num_mags * 3))
-
-    ylabels = []
-    for m in range(num_mags):
-        ylabels.extend(["Bx{}".format(m), "By{}".format(m), "Bz{}".format(m)])
-    axs[1].set_yticklabels(ylabels)
-
-    fig.colorbar(pc)
+        mask[2:-1:4] = False
+    return mask
+
+
+def plot_heatmap(data_path, num_mags, max_points=2000):
+    """
+    Plot a saved recording as lines and a heatmap
+
+    The recording is memory-mapped and summarised once into a min/max
+    pyramid cached next to it (see reskin_sensor.lod). Only the level
+    matching the current zoom is drawn, at most max_points bins, and it is
+    redrawn whenever the visible range changes, so even a full day of data
+    pans and zooms interactively.
+    """
+    pyramid = MinMaxPyramid(data_path)
+    mask = data_mask(pyramid.num_columns, num_mags)
+    times = pyramid.data[:, 0]
+    t0 = float(times[0])
+    names = channel_names(num_mags, temp_filtered=True)
+
+    fig, axs = plt.subplots(2, 1, figsize=(8, 16), sharex=True)
+    lines = axs[0].plot(np.zeros((0, len(names))))
+    image = axs[1].imshow(
+        np.zeros((len(names), 1)), aspect="auto", interpolation="nearest", extent=(0, len(pyramid), len(names) - 0.5, -0.5)
+    )
+    axs[1].set_yticks(np.arange(len(names)))
+    axs[1].set_yticklabels(names)
+    for ax in axs:
+        ax.set_xlabel("Time, in s")
+    # x is the sample index; label it with the recording time
+    axs[1].xaxis.set_major_formatter(
+        FuncFormatter(lambda x, pos: "{:.2f}".format(float(times[int(np.clip(x, 0, len(pyramid) - 1))]) - t0))
+    )
+    status = axs[0].set_title("")
+
+    def render(start, stop):
+        x, lo, hi, level = pyramid.query(start, stop, max_points)
+        if len(x) == 0:
+            return
+        lo, hi = lo[:, mask], hi[:, mask]
+        xs, ys = envelope_line(x, lo, hi)
+        for c, line in enumerate(lines):
+            line.set_data(xs, ys[:, c])
+        # Keep the reading furthest from zero so short presses stay visible
+        peak = np.where(np.abs(hi) >= np.abs(lo), hi, lo)
+        image.set_data(peak.T)
+        image.set_extent((x[0], x[-1] + pyramid.bin_size(level), len(names) - 0.5, -0.5))
+        status.set_text("{} samples per bin".format(pyramid.bin_size(level)))
+
+    def on_xlim_changed(ax):
+        start, stop = ax.get_xlim()
+        render(np.floor(start), np.ceil(stop) + 1)
+        fig.canvas.draw_idle()
+
+    render(0, len(pyramid))
+    # Lines span the range of the whole recording
+    _, lo, hi, _ = pyramid.query(0, len(pyramid), 1)
+    axs[0].set_ylim(lo[:, mask].min(), hi[:, mask].max())
+    axs[0].set_xlim(0, len(pyramid))
+    image.set_clim(lo[:, mask].min(), hi[:, mask].max())
+    axs[0].callbacks.connect("xlim_changed", on_xlim_changed)
+
+    fig.colorbar(image)
     plt.show()
 
 
-def update_data(ax, sensor, init_time, baseline, ln, xdata, ydata, i):
-    sensor.pause_buffering()
-    buf = np.array(sensor.get_buffer())
-    sensor.start_buffering()
-    times = buf[:, 0] - init_time
-    data = buf[:, 2:-1] - baseline
-
-    xdata.extend(list(times))
-    ydata.extend(list(data))
-
-    ln.set_array(np.array(ydata).T)
-
-    xticks = np.arange(0, len(xdata), max(1, len(xdata) // 10))
-    xlabels = ["{:.2f}".format(xdata[i]) for i in xticks]
-
-    ax.set_xticklabels(xlabels)
-
-    return (ln,)
+def stream_heatmap(sensor, num_mags, window, lims, interval=30, timeout=10.0):
+    """
+    Show a live source (sensor, simulation or replay) as a scrolling heatmap
+
+    Every frame reads all samples streamed since the previous one from the
+    sensor's sample ring, so nothing is lost and buffering is never paused.
+    The samples are written into a fixed (window, channels) HistoryBuffer
+    whose window is always a contiguous view, and only the image and the
+    status text are redrawn (blitting), so the frame rate does not depend
+    on the sample rate.
+
+    Raises RuntimeError if the source stops, or has not streamed window
+    samples for the baseline within timeout seconds.
+    """
+    # Baseline from the most recent samples, without stopping the stream
+    deadline = time.time() + timeout
+    while sensor.sample_cnt < window:
+        if not sensor.is_alive():
+            raise RuntimeError("The source stopped after {} of {} samples".format(sensor.sample_cnt, window))
+        if time.time() > deadline:
+            raise RuntimeError("The source streamed {} of {} samples in {} s".format(sensor.sample_cnt, window, timeout))
+        time.sleep(0.05)
+    init_rows, seq = sensor.read_since(0, window)
+    baseline = np.mean(init_rows[:, 2:], axis=0)
+    init_time = init_rows[0, 0]
+
+    names = channel_names(num_mags, temp_filtered=sensor.temp_filtered)
+    history = HistoryBuffer(window, len(names))
+    history.extend(np.zeros((window, len(names))))
+
+    fig, ax = plt.subplots()
+    image = ax.imshow(
+        np.zeros((len(names), window)),
+        aspect="auto",
+        interpolation="nearest",
+        vmin=lims[0],
+        vmax=lims[1],
+        extent=(-window, 0, len(names) - 0.5, -0.5),
+        animated=True,
+    )
+    ax.set_yticks(np.arange(len(names)))
+    ax.set_yticklabels(names)
+    ax.set_xlabel("Samples before the latest")
+    status = ax.text(0.01, 1.01, "", transform=ax.transAxes, animated=True)
+    fig.colorbar(image)
+
+    last_seq, last_time = seq, time.time()
+
+    def update(frame):
+        nonlocal seq, last_seq, last_time
+        rows, seq = sensor.read_since(seq)
+        if len(rows):
+            history.extend(rows[:, 2:] - baseline)
+            image.set_data(history.view().T)
+            now = time.time()
+            rate = (seq - last_seq) / max(now - last_time, 1e-6)
+            last_seq, last_time = seq, now
+            status.set_text("t = {:.2f} s, {:.0f} samples/s".format(rows[-1, 0] - init_time, rate))
+        return image, status
+
+    ani = FuncAnimation(fig, update, interval=interval, blit=True, cache_frame_data=False)
+    plt.show()
+    return ani
 
 
 if __name__ == "__main__":
     # fmt: off
     parser = argparse.ArgumentParser(description="Visualize ReSkin data as a heatmap")
-    parser.add_argument("--stream", action="store_true", help="Flag to stream live data")
+    parser.add_argument("--stream", action="store_true", help="Flag to stream live data; same as --port /dev/ttyACM0 if no source is given")
     parser.add_argument("-nm", "--num-mags", type=int, required=True, help="Number of magnetometers")
-    parser.add_argument("-p", "--port", type=str, default="/dev/ttyACM0", help="ReSkin post; ignored if not streaming")
+    add_source_arguments(parser, board=False, required=False)
     parser.add_argument("-ws", "--window-size", type=int, default=1000, help="Number of samples visualized at a time")
     parser.add_argument("--lims", type=float, nargs=2, default=[-300., 300.], help="Colorbar limits for streaming")
+    parser.add_argument("--fps", type=int, default=30, help="Target frame rate for streaming")
 
-    parser.add_argument("-dp", "--data-path", type=str, help="Path for loading data")
+    parser.add_argument("-dp", "--data-path", type=str, help="Path of a .npy recording to plot")
     args = parser.parse_args()
     # fmt: on
+    if args.fps <= 0:
+        parser.error("--fps must be positive")
 
     num_samples = args.window_size
-    num_mags = args.num_mags
+    if args.stream and not (args.port or args.simulate or args.replay or args.connect):
+        args.port = ["/dev/ttyACM0"]
 
-    if args.stream:
-        reskin = ReSkinProcess(
-            num_mags=args.num_mags,
-            port=args.port,
+    if args.port or args.simulate or args.replay or args.connect:
+        reskin = source_from_args(
+            args,
             temp_filtered=True,
             reskin_data_struct=False,
+            ring_size=max(4096, 2 * num_samples),
         )
         reskin.start()
-        time.sleep(1.0)
-        init_data = np.array(reskin.get_data(num_samples))
-        baseline = np.mean(init_data[..., 2:-1], axis=0, keepdims=True)
-        init_time = init_data[0, 0]
-
-        reskin.start_buffering()
-
-        fig, ax = plt.subplots()
-        xdata, ydata = deque(maxlen=num_samples), deque(maxlen=num_samples)
-
-        xdata.extend(list(init_data[..., 0]) - init_time)
-        ydata.extend(list(init_data[..., 2:-1] - baseline))
-
-        ln = ax.pcolormesh(np.array(ydata).T, vmin=args.lims[0], vmax=args.lims[1])
-        ax.set_xticks(np.arange(0, num_samples, max(1, num_samples // 10)))
-        ax.set_yticks(np.linspace(0.5, num_mags * 3 - 0.5, num_mags * 3))
-        ylabels = []
-        for m in range(num_mags):
-            ylabels.extend(["Bx{}".format(m), "By{}".format(m), "Bz{}".format(m)])
-        ax.set_yticklabels(ylabels)
-        ax.set_xlabel("Time, in s")
-        cbar = fig.colorbar(ln)
-
-        ani = FuncAnimation(
-            fig,
-            lambda i: update_data(ax, reskin, init_time, baseline, ln, xdata, ydata, i),
-            blit=False,
-        )
-        plt.show()
+        time.sleep(0.1)
+        stream_heatmap(reskin, reskin.num_mags, num_samples, args.lims, interval=1000 // args.fps)
 
     else:
-        data_path = args.data_path
-
-        # Load data
-        with open(data_path, "rb") as f:
-            data = np.load(f)
-
-        data_dim = data.shape[-1]
-
-        data_mask = np.zeros((data_dim,), dtype=bool)
-        data_mask[2:-1] = True
-
-        # Filter temperature if required
-        if data_dim == 4 * num_mags + 3:
-            data_mask[2:-1:4] = False
-
-        with open(data_path, "rb") as f:
-            data = np.load(f)
-            # test_data = data["task"][..., data_mask]
-        plot_heatmap(data, num_mags)
+        plot_heatmap(args.data_path, args.num_mags)
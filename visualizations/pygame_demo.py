@@ -1,10 +1,13 @@
+import argparse
 import pygame
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pygame.locals import *
-import math
 import time
 import numpy as np
-from reskin_sensor import ReSkinBase
+from reskin_sensor.features import split_readings
+from reskin_sensor.geometry import FIVE_X_BOARD
+from reskin_sensor.sources import add_source_arguments, source_from_args
 
 def init_pygame():
     time.sleep(1)
@@ -17,71 +20,99 @@ def init_pygame():
     pygame.display.set_caption('5X Board Visual')
     return clock, screen, bg
 
-def get_baseline(sens, num_samples):
-    print("Leave board resting on table")
-    time.sleep(2.)
+def get_baseline(sens, num_samples, settle=2., timeout=10.):
+    """
+    Mean of num_samples streamed after settle seconds; runs in a worker thread
 
-    baseline_samples = sens.get_data(num_samples)
-    baseline = [s.data for s in baseline_samples]
-    baseline = np.array(baseline)
-    baseline = np.mean(baseline, axis=0)
+    Raises RuntimeError if the source stops, or has not streamed num_samples
+    samples within timeout seconds.
+    """
+    print("Leave board resting on table")
+    time.sleep(settle)
+
+    seq = sens.sample_cnt
+    deadline = time.time() + timeout
+    while sens.sample_cnt < seq + num_samples:
+        if not sens.is_alive():
+            raise RuntimeError("The source stopped after {} of {} baseline samples".format(sens.sample_cnt - seq, num_samples))
+        if time.time() > deadline:
+            raise RuntimeError("The source streamed {} of {} baseline samples in {} s".format(sens.sample_cnt - seq, num_samples, timeout))
+        time.sleep(0.01)
+    rows, _ = sens.read_since(seq)
+    baseline = np.mean(rows[:num_samples, 2:], axis=0)
     print("Resting data collected.")
 
     return baseline
 
+def arrow_geometry(fields, chip_locations, scale):
+    """Arrow ends and circle radii of all chips from (num_mags, 3) board-frame fields"""
+    ends = chip_locations + fields[:, :2] * [1, -1]
+    radii = np.abs(fields[:, 2]) / scale
+    return ends, radii
+
 
 if __name__ == '__main__':
     
     WHITE = pygame.Color(255, 255, 255)
     RED = pygame.Color(255, 0, 0) 
     BLACK = pygame.Color(0,0,0)
-
-    viz_sensor = ReSkinBase(num_mags=5, port='/dev/ttyACM0', baudrate=115200)
+    FPS = 60
+
+    board = FIVE_X_BOARD
+    parser = argparse.ArgumentParser(description="Field of every chip of a 5X board, drawn as arrows")
+    add_source_arguments(parser, board=False, required=False)
+    args = parser.parse_args()
+    args.num_mags = board.num_mags
+    if not (args.port or args.simulate or args.replay or args.connect):
+        args.port = ['/dev/ttyACM0']
+
+    # Acquisition runs in the background; the render loop only reads its latest sample
+    viz_sensor = source_from_args(args)
+    viz_sensor.start()
     scale = 100
 
-    temp_mask = np.ones((20,),dtype=bool)
-    temp_mask[::4] = False
     
     clock, screen, bg = init_pygame()
+    font = pygame.font.Font(None, 28)
     
-    # read first 100 samples as baseline
+    # average 100 samples as baseline, in the background
     numBaselineSamples = 100
+    baseline_worker = ThreadPoolExecutor(max_workers=1)
+    pending_baseline = baseline_worker.submit(get_baseline, viz_sensor, numBaselineSamples)
+    baseline = None
 
-    baseline = get_baseline(viz_sensor, numBaselineSamples)
-
-    # chip locations in pixels on the game board
-    # in order of center, top, right, bottom, left to match incoming data stream
-    chip_locations = np.array([[211,204], [211, 60],[357, 206],[211, 353],[67, 204]])
+    # chip locations in pixels on the game board, in the order of
+    # board.positions (center, top, right, bottom, left); the chips of the
+    # background image are not on an exact grid
+    chip_locations = np.array([[211, 204], [211, 60], [357, 206], [211, 353], [67, 204]])
 
     while True:
 
-        raw_data = viz_sensor.get_data(1)
-        input_data = raw_data[0].data - baseline
-        #rotation of chip axes to pygame coordinate system
-
-        input_data = input_data[temp_mask]
-        input_data[0:3] = [input_data[1], -1*input_data[0], -1*input_data[2]]
-        input_data[3:6] = [input_data[4], -1*input_data[3], -1*input_data[5]]
-        input_data[6:9] = [input_data[6], input_data[7], -1*input_data[8]]
-        input_data[9:12] = [-1*input_data[9], -1*input_data[10], -1*input_data[11]]
-        input_data[12:15] = [-1*input_data[13], input_data[12], -1*input_data[14]]
+        if pending_baseline is not None and pending_baseline.done():
+            baseline = pending_baseline.result()
+            pending_baseline = None
 
         screen.blit(bg, (0,0))
-        for idx in range(5):
-            center_arrow = chip_locations[idx]
-            angle = math.atan2(input_data[3*idx+1],input_data[3*idx])
-            z = math.sqrt((input_data[3*idx]*input_data[3*idx]+input_data[3*idx+1]*input_data[3*idx+1]))
-            x = center_arrow[0] + math.sin(angle)*z
-            y = center_arrow[1] + math.cos(angle)*z
-            r = abs(input_data[3*idx+2])/scale
-            pygame.draw.line(screen, (0,0,0), center_arrow, (x,y), 5)
-            pygame.draw.circle(screen, (0,0,1), center_arrow, r, 1)
+        if baseline is not None:
+            input_data = np.asarray(viz_sensor.last_reading.data) - baseline
+            #rotation of chip axes to the board frame (x right, y up)
+            _, mags = split_readings(input_data, board.num_mags)
+            fields = board.process(mags[None])[0]
+            ends, radii = arrow_geometry(fields, chip_locations, scale)
+            for center_arrow, end, r in zip(chip_locations, ends, radii):
+                pygame.draw.line(screen, (0,0,0), center_arrow, end, 5)
+                pygame.draw.circle(screen, (0,0,1), center_arrow, r, 1)
+        if pending_baseline is not None:
+            screen.blit(font.render("Collecting baseline...", True, RED), (10, 10))
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                viz_sensor.join()
                 sys.exit()
             elif event.type == KEYDOWN:
-                if event.key == ord('b'):
-                    baseline = get_baseline(viz_sensor, numBaselineSamples)
+                if event.key == ord('b') and pending_baseline is None:
+                    # keep showing the old baseline until the new one is ready
+                    pending_baseline = baseline_worker.submit(get_baseline, viz_sensor, numBaselineSamples)
 
-        pygame.display.update()
\ No newline at end of file
+        pygame.display.update()
+        clock.tick(FPS)